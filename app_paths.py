@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+
+def app_cache_dir(*parts: str) -> str:
+	"""Thư mục cache của ứng dụng (tạo nếu chưa có).
+
+	Ưu tiên biến môi trường VEO3_CACHE_DIR, sau đó %LOCALAPPDATA%\\Veo3 trên Windows
+	hoặc $XDG_CACHE_HOME/veo3 (~/.cache/veo3) trên Linux/macOS.
+	"""
+	base = os.environ.get("VEO3_CACHE_DIR")
+	if not base:
+		if os.name == "nt":
+			base = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"), "Veo3")
+		else:
+			xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+			base = os.path.join(xdg, "veo3")
+	path = os.path.join(base, *parts)
+	os.makedirs(path, exist_ok=True)
+	return path
+
+
+def file_identity(path: str) -> Optional[str]:
+	"""Khóa cache cho một file: đường dẫn tuyệt đối + kích thước + mtime."""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+class JsonFileCache:
+	"""Cache key -> giá trị JSON, giữ trong bộ nhớ và lưu vào một file dưới app_cache_dir().
+
+	filename là đường dẫn tuyệt đối thì lưu đúng chỗ đó (vd. index của kho nằm ở ổ khác).
+	"""
+
+	def __init__(self, filename: str):
+		self.filename = filename
+		self._lock = threading.Lock()
+		self._data: Optional[Dict[str, Any]] = None
+
+	def _path(self) -> str:
+		return os.path.join(app_cache_dir(), self.filename)
+
+	def _read_disk(self) -> Dict[str, Any]:
+		try:
+			with open(self._path(), "r", encoding="utf-8") as f:
+				data = json.load(f)
+			return data if isinstance(data, dict) else {}
+		except (OSError, ValueError):
+			return {}
+
+	def _loaded(self) -> Dict[str, Any]:
+		if self._data is None:
+			self._data = self._read_disk()
+		return self._data
+
+	def get(self, key: str) -> Optional[Any]:
+		with self._lock:
+			return self._loaded().get(key)
+
+	def set(self, key: str, value: Any, persist: bool = True) -> None:
+		with self._lock:
+			self._loaded()[key] = value
+			if persist:
+				self._flush_locked()
+
+	def flush(self) -> None:
+		with self._lock:
+			self._flush_locked()
+
+	def snapshot(self) -> Dict[str, Any]:
+		"""Bản sao toàn bộ dữ liệu, đã gộp các mục mà tiến trình khác vừa ghi xuống đĩa."""
+		with self._lock:
+			self._flush_locked()
+			return dict(self._loaded())
+
+	def _flush_locked(self) -> None:
+		data = self._loaded()
+		# Gộp với bản trên đĩa để các tiến trình chạy song song không xóa mục của nhau
+		for key, value in self._read_disk().items():
+			data.setdefault(key, value)
+		path = self._path()
+		tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		try:
+			with open(tmp, "w", encoding="utf-8") as f:
+				json.dump(data, f)
+			os.replace(tmp, path)
+		except OSError:
+			pass
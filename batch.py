@@ -0,0 +1,379 @@
+"""Chạy hàng loạt job ghép video không cần giao diện (không import PyQt5).
+
+Manifest là file JSON:
+
+	{
+		"defaults": {"bitrate_mbps": 12, "transition": "Crossfade"},
+		"jobs": [
+			{"inputs": ["a.mp4", "b.mp4"], "output": "out/ab.mp4"},
+			{"inputs": ["c.mp4"], "output": "out/c.mp4", "options": {"hide_qr": true}}
+		]
+	}
+
+Chạy: python batch.py manifest.json --jobs 3
+      python batch.py manifest.json --jobs auto   (scheduler.py chọn số job và số thread)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from delogo import DelogoPreset
+from history import RenderReport
+from mezzanine import normalized_builder
+from processing import FFmpegPipelineBuilder, Rendition, probe_inputs
+from ratecontrol import render_with_rate_control
+from render_cache import cached_render, render_mode
+from renditions import render_renditions
+from scheduler import JobScheduler, Slot, apply_slot, describe_estimate
+from segments import render_segmented
+from smart_render import render_smart
+
+
+# Giá trị mặc định giống chế độ AUTO của giao diện
+DEFAULT_OPTIONS: Dict[str, Any] = {
+	"loop_if_single": True,
+	"transition": "Crossfade",
+	"transition_duration": 0.8,
+	"smooth_transition": False,
+	"force_9_16": True,
+	"fps60": True,
+	"sharpen": True,
+	"color": True,
+	"fast_mode": False,
+	"hwaccel_decode": False,
+	"filter_threads": 0,
+	"zoom_logo": False,
+	"zoom_factor": 1.05,
+	"zoom_auto": False,
+	"film_grain": False,
+	"grain_strength": 0.5,
+	"vignette": False,
+	"vignette_strength": 0.3,
+	"chromatic": False,
+	"chromatic_strength": 0.2,
+	"digital_noise": False,
+	"noise_strength": 0.3,
+	"lut_path": None,
+	"delogo": False,
+	"delogo_preset": "auto",
+	"delogo_w": 260,
+	"delogo_h": 110,
+	"delogo_margin": 30,
+	"hevc": False,
+	"bitrate_mbps": 12,
+	# "crf": chất lượng cố định, đỉnh bitrate không quá bitrate_mbps; "target_size": file ra
+	# khoảng target_size_mb MB, encode 2 lượt (xem ratecontrol.py)
+	"rate_control": "crf",
+	"target_size_mb": None,
+	"keep_audio": False,
+	"reencode_metadata": True,
+	"hide_qr": False,
+	# Cách che logo/QR: "blur" (boxblur chỉ trên vùng cần che) hoặc "fill" (nội suy delogo)
+	"region_blur": "blur",
+	"use_nvenc": False,
+	"preset": "fast",
+	"threads": 0,
+	"faststart": True,
+	"stream_copy": True,
+	# >= 2: encode chia đoạn song song trong một job (xem segments.py)
+	"segment_workers": 0,
+	# Lưu từng khúc đã encode: job lỗi/bị dừng chạy lại chỉ encode phần còn thiếu (xem segments.py)
+	"resumable": False,
+	# Job trùng input + tùy chọn với lần render trước thì dùng lại output (xem render_cache.py)
+	"render_cache": True,
+	# Chuẩn hóa mỗi clip một lần rồi dùng lại cho các job sau (xem mezzanine.py)
+	"mezzanine_cache": False,
+	# Chỉ encode lại vùng quanh transition, phần còn lại chép từ mezzanine (xem smart_render.py)
+	"smart_render": False,
+	# Bản xuất thêm từ cùng một lần giải mã (xem renditions.py), vd.
+	# [{"suffix": "_1080p", "short_side": 1080}, {"suffix": "_720p", "width": 720, "hevc": true}]:
+	# file ra là output chèn suffix trước phần mở rộng; thiếu width/height thì giữ tỉ lệ canvas
+	"renditions": [],
+}
+
+# Khóa hợp lệ của một mục trong "renditions"
+_RENDITION_KEYS = {"suffix", "width", "height", "short_side", "hevc", "bitrate_mbps"}
+
+
+@dataclass
+class BatchJob:
+	inputs: List[str]
+	output: str
+	options: Dict[str, Any] = field(default_factory=dict)
+	name: str = ""
+
+
+@dataclass
+class JobResult:
+	name: str
+	output: str
+	ok: bool
+	seconds: float
+	error: Optional[str] = None
+
+
+def configure_builder(inputs: List[str], options: Dict[str, Any]) -> FFmpegPipelineBuilder:
+	"""Tạo FFmpegPipelineBuilder từ dict tùy chọn (giống VideoToolUI.build_pipeline)."""
+	opts = dict(DEFAULT_OPTIONS)
+	opts.update(options or {})
+	unknown = set(opts) - set(DEFAULT_OPTIONS)
+	if unknown:
+		raise ValueError(f"Tùy chọn không hợp lệ: {', '.join(sorted(unknown))}")
+
+	inputs = list(inputs)
+	loop_single = len(inputs) == 1 and bool(opts["loop_if_single"])
+
+	builder = FFmpegPipelineBuilder(inputs)
+	if loop_single:
+		builder.set_loop(2)
+	builder.set_target_vertical_4k(bool(opts["force_9_16"]))
+	builder.set_fps60(bool(opts["fps60"]))
+	fast_mode = bool(opts["fast_mode"])
+	builder.set_quality_filters(use_sharpen=bool(opts["sharpen"]) and not fast_mode, use_color=bool(opts["color"]) and not fast_mode)
+	builder.set_speed_options(fast_mode=fast_mode, hwaccel_decode=bool(opts["hwaccel_decode"]), filter_threads=int(opts["filter_threads"]))
+	builder.set_zoom_options(enable=bool(opts["zoom_logo"]), factor=float(opts["zoom_factor"]), auto=bool(opts["zoom_auto"]))
+	builder.set_cinematic_effects(
+		film_grain=bool(opts["film_grain"]), grain_strength=float(opts["grain_strength"]),
+		vignette=bool(opts["vignette"]), vignette_strength=float(opts["vignette_strength"]),
+		chromatic=bool(opts["chromatic"]), chromatic_strength=float(opts["chromatic_strength"]),
+		digital_noise=bool(opts["digital_noise"]), noise_strength=float(opts["noise_strength"]),
+		use_lut=bool(opts["lut_path"]), lut_path=opts["lut_path"],
+	)
+	if opts["delogo"]:
+		builder.set_delogo(
+			preset=DelogoPreset(name=str(opts["delogo_preset"])),
+			box_size=(int(opts["delogo_w"]), int(opts["delogo_h"])),
+			margin=int(opts["delogo_margin"]),
+		)
+	if opts["transition"] and opts["transition"] != "Không" and (len(inputs) >= 2 or loop_single):
+		builder.set_transition(str(opts["transition"]), float(opts["transition_duration"]), bool(opts["smooth_transition"]))
+	builder.set_export(
+		hevc=bool(opts["hevc"]), bitrate_mbps=int(opts["bitrate_mbps"]), keep_audio=bool(opts["keep_audio"]),
+		reencode_metadata=bool(opts["reencode_metadata"]), hide_qr=bool(opts["hide_qr"]),
+	)
+	builder.set_region_blur_mode(str(opts["region_blur"]))
+	builder.set_rate_control(str(opts["rate_control"]), float(opts["target_size_mb"]) if opts["target_size_mb"] else None)
+	builder.set_performance(use_nvenc=bool(opts["use_nvenc"]), preset=str(opts["preset"]), threads=int(opts["threads"]), faststart=bool(opts["faststart"]))
+	builder.set_stream_copy(bool(opts["stream_copy"]))
+	return builder
+
+
+def rendition_output(output: str, suffix: str) -> str:
+	root, ext = os.path.splitext(output)
+	return f"{root}{suffix}{ext or '.mp4'}"
+
+
+def job_renditions(output: str, options: Dict[str, Any]) -> List[Rendition]:
+	"""Các bản xuất của job (bản chính = output, theo canvas) khi có tùy chọn "renditions"; rỗng nếu không có."""
+	items = options.get("renditions") or []
+	if not items:
+		return []
+	result = [Rendition(output)]
+	for i, item in enumerate(items):
+		unknown = set(item) - _RENDITION_KEYS
+		if unknown:
+			raise ValueError(f"Rendition #{i + 1}: khóa không hợp lệ: {', '.join(sorted(unknown))}")
+		if not item.get("suffix"):
+			raise ValueError(f"Rendition #{i + 1} thiếu 'suffix'")
+		result.append(Rendition(
+			rendition_output(output, str(item["suffix"])),
+			width=int(item["width"]) if item.get("width") else None,
+			height=int(item["height"]) if item.get("height") else None,
+			short_side=int(item["short_side"]) if item.get("short_side") else None,
+			hevc=bool(item["hevc"]) if item.get("hevc") is not None else None,
+			bitrate_mbps=int(item["bitrate_mbps"]) if item.get("bitrate_mbps") else None,
+		))
+	return result
+
+
+def load_manifest(path: str) -> List[BatchJob]:
+	with open(path, "r", encoding="utf-8") as f:
+		data = json.load(f)
+	base_dir = os.path.dirname(os.path.abspath(path))
+	defaults = data.get("defaults", {})
+	jobs: List[BatchJob] = []
+	for i, item in enumerate(data.get("jobs", [])):
+		if not item.get("inputs") or not item.get("output"):
+			raise ValueError(f"Job #{i + 1} thiếu 'inputs' hoặc 'output'")
+		options = dict(defaults)
+		options.update(item.get("options", {}))
+		# Đường dẫn tương đối tính theo thư mục chứa manifest
+		inputs = [os.path.join(base_dir, p) for p in item["inputs"]]
+		output = os.path.join(base_dir, item["output"])
+		jobs.append(BatchJob(inputs=inputs, output=output, options=options, name=item.get("name") or f"job{i + 1}"))
+	return jobs
+
+
+def run_job(job: BatchJob, slot: Optional[Slot] = None) -> JobResult:
+	"""Chạy một job (trong tiến trình con của pool); slot: số thread do JobScheduler cấp."""
+	t0 = time.monotonic()
+	builder = None
+	try:
+		builder = configure_builder(job.inputs, job.options)
+		if slot is not None:
+			apply_slot(builder, slot)
+		builder.set_renditions(job_renditions(job.output, job.options))
+		segment_workers = int(job.options.get("segment_workers", DEFAULT_OPTIONS["segment_workers"]))
+		smart = bool(job.options.get("smart_render", DEFAULT_OPTIONS["smart_render"]))
+		mezzanine = bool(job.options.get("mezzanine_cache", DEFAULT_OPTIONS["mezzanine_cache"]))
+		resumable = bool(job.options.get("resumable", DEFAULT_OPTIONS["resumable"]))
+		out_dir = os.path.dirname(os.path.abspath(job.output))
+		os.makedirs(out_dir, exist_ok=True)
+
+		last_pct = [-10.0]
+
+		def on_progress(pct: Optional[float], line: str):
+			# Chỉ in mỗi 10% để log của nhiều job song song còn đọc được
+			if pct is not None and pct - last_pct[0] >= 10.0:
+				last_pct[0] = pct
+				print(f"[{job.name}] {line}", flush=True)
+
+		def print_notes(notes: List[str]) -> None:
+			for note in notes:
+				print(f"[{job.name}] {note}", flush=True)
+
+		def render() -> RenderReport:
+			if builder.renditions:
+				# Mọi bản ra từ một tiến trình ffmpeg: không chia đoạn/smart render
+				target = builder
+				if mezzanine:
+					target = normalized_builder(builder, on_progress=on_progress)
+				try:
+					return render_renditions(target, on_progress=on_progress, on_notes=print_notes)
+				finally:
+					if target is not builder:
+						target.cleanup()
+			if smart:
+				return render_smart(builder, job.output, on_progress=on_progress)
+			target = builder
+			if mezzanine:
+				target = normalized_builder(builder, on_progress=on_progress)
+			try:
+				if segment_workers >= 2 or resumable:
+					report = render_segmented(target, job.output, segment_workers, on_progress=on_progress, resume=resumable)
+					print_notes(target.build_notes)
+					return report
+				return render_with_rate_control(target, job.output, on_progress=on_progress, on_notes=print_notes)
+			finally:
+				if target is not builder:
+					target.cleanup()
+
+		# Cache render chỉ lưu một file output
+		if job.options.get("render_cache", DEFAULT_OPTIONS["render_cache"]) and not builder.renditions:
+			report = cached_render(builder, job.output, render, on_progress=on_progress,
+								   mode=render_mode(smart, mezzanine, segment_workers, resumable))
+		else:
+			report = render()
+		print(f"[{job.name}] {report.summary()}", flush=True)
+		return JobResult(job.name, job.output, True, time.monotonic() - t0)
+	except subprocess.CalledProcessError as e:
+		tail = (e.stderr or "").strip().splitlines()[-3:]
+		detail = f": {' | '.join(tail)}" if tail else ""
+		return JobResult(job.name, job.output, False, time.monotonic() - t0, f"FFmpeg lỗi (mã {e.returncode}){detail}")
+	except Exception as e:
+		return JobResult(job.name, job.output, False, time.monotonic() - t0, str(e))
+	finally:
+		if builder is not None:
+			builder.cleanup()
+
+
+def _print_result(res: JobResult) -> None:
+	status = "OK" if res.ok else f"LỖI: {res.error}"
+	print(f"[{res.name}] {status} ({res.seconds:.1f}s) -> {res.output}", flush=True)
+
+
+def job_processes(job: BatchJob) -> int:
+	"""Số tiến trình ffmpeg một job chạy cùng lúc (encode chia đoạn dùng nhiều tiến trình)."""
+	workers = int(job.options.get("segment_workers", DEFAULT_OPTIONS["segment_workers"]))
+	return workers if workers >= 2 else 1
+
+
+def run_batch(jobs: List[BatchJob], max_workers: int = 1) -> List[JobResult]:
+	"""Chạy các job với tối đa max_workers tiến trình ffmpeg cùng lúc.
+
+	max_workers <= 0: JobScheduler chọn số job chạy cùng lúc, số thread mỗi job và thứ tự
+	(job nặng trước) theo số nhân, RAM còn trống và lịch sử render.
+	"""
+	results: List[JobResult] = []
+	# Probe trước tất cả input (song song, có cache đĩa) để các tiến trình con không probe lại
+	probe_inputs([p for job in jobs for p in job.inputs])
+	if max_workers <= 0:
+		return _run_scheduled(jobs)
+	with ProcessPoolExecutor(max_workers=max(1, max_workers)) as pool:
+		futures = {pool.submit(run_job, job): job for job in jobs}
+		for fut in as_completed(futures):
+			res = fut.result()
+			results.append(res)
+			_print_result(res)
+	return results
+
+
+def _run_scheduled(jobs: List[BatchJob]) -> List[JobResult]:
+	scheduler = JobScheduler()
+	results: List[JobResult] = []
+	estimates = []
+	runnable: List[Tuple[BatchJob, FFmpegPipelineBuilder]] = []
+	for job in jobs:
+		try:
+			builder = configure_builder(job.inputs, job.options)
+			estimates.append(scheduler.estimate(builder, job_processes(job)))
+			runnable.append((job, builder))
+		except Exception as e:
+			# Tùy chọn/input sai: báo lỗi như run_job, không chặn các job khác
+			results.append(JobResult(job.name, job.output, False, 0.0, str(e)))
+			_print_result(results[-1])
+	pending = [runnable[i] + (estimates[i],) for i in scheduler.order(estimates)]
+	for job, _, est in pending:
+		print(f"[{job.name}] ước tính {describe_estimate(est)}, chạy tối đa {scheduler.concurrency(est)} job loại này cùng lúc", flush=True)
+
+	def reestimate() -> None:
+		# Job vừa xong đã ghi lịch sử render: ước tính và xếp lại các job còn chờ
+		fresh = [scheduler.estimate(builder, job_processes(job)) for job, builder, _ in pending]
+		pending[:] = [pending[i][:2] + (fresh[i],) for i in scheduler.order(fresh)]
+
+	with ProcessPoolExecutor(max_workers=scheduler.cpu_count) as pool:
+		running = {}
+		while pending or running:
+			# Giữ đúng thứ tự: job đầu hàng chưa đủ chỗ thì chờ, không cho job nhỏ chen lên
+			while pending:
+				slot = scheduler.admit(pending[0][2])
+				if slot is None:
+					break
+				job, _, _ = pending.pop(0)
+				print(f"[{job.name}] bắt đầu: {slot.describe()}", flush=True)
+				running[pool.submit(run_job, job, slot)] = slot
+			done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+			for fut in done:
+				scheduler.release(running.pop(fut))
+				res = fut.result()
+				results.append(res)
+				_print_result(res)
+			if pending:
+				reestimate()
+	return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Ghép & nâng cấp video hàng loạt theo manifest JSON")
+	parser.add_argument("manifest", help="File manifest JSON")
+	parser.add_argument("-j", "--jobs", default="1", help="Số tiến trình ffmpeg chạy song song; auto = tự chọn theo CPU/RAM")
+	args = parser.parse_args(argv)
+
+	jobs = load_manifest(args.manifest)
+	if not jobs:
+		print("Manifest không có job nào", file=sys.stderr)
+		return 1
+	results = run_batch(jobs, max_workers=0 if args.jobs == "auto" else int(args.jobs))
+	failed = [r for r in results if not r.ok]
+	print(f"Xong {len(results) - len(failed)}/{len(results)} job", flush=True)
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
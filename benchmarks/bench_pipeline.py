@@ -0,0 +1,235 @@
+"""Đo chi phí từng tùy chọn của FFmpegPipelineBuilder trên input tổng hợp (lavfi), so với baseline.
+
+Chạy (không cần mạng, không cần GPU):
+
+	python benchmarks/bench_pipeline.py                      # đo + so với benchmarks/baseline.json
+	python benchmarks/bench_pipeline.py --save-baseline      # đo và ghi lại baseline của máy này
+	python benchmarks/bench_pipeline.py --configs base,sharpen --inputs 1080x1920@30 --repeat 3
+	python benchmarks/bench_pipeline.py --canvas 2160x3840   # canvas 4K thật (chậm hơn ~4 lần)
+
+Mỗi cấu hình là một dict tùy chọn của batch.py (cùng đường dựng builder với batch/giao diện),
+đổi một tùy chọn so với "base" để thấy chi phí riêng của nó. Input được sinh một lần bằng
+testsrc2 + nhiễu theo thời gian (khó nén như video thật) và cache trong thư mục cache của ứng dụng.
+Số đo lấy từ RenderReport (fps encode, tốc độ, CPU user+sys, RAM đỉnh); với --repeat > 1 lấy trung vị.
+
+So sánh baseline: một mục bị coi là chậm đi khi CPU tăng hoặc fps giảm quá --threshold
+(mặc định 15%; hai lần chạy liền nhau trên cùng máy lệch nhau 5-10%, --repeat 3 giảm
+dao động); khi đó lệnh trả về mã 1. Baseline chỉ có ý nghĩa trên cùng máy + cùng bản
+ffmpeg, nên thông tin máy được lưu kèm và in cảnh báo khi khác.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_paths import app_cache_dir  # noqa: E402
+from batch import configure_builder  # noqa: E402
+from capabilities import detect_capabilities  # noqa: E402
+from processing import _FFMPEG_BIN, run_ffmpeg_with_progress  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# tên -> (rộng, cao, fps) của input tổng hợp
+INPUTS: Dict[str, Tuple[int, int, int]] = {
+	"1080x1920@30": (1080, 1920, 30),
+	"720x1280@60": (720, 1280, 60),
+	"1920x1080@25": (1920, 1080, 25),
+}
+
+# Chỉ CPU, không stream copy, không transition: mọi cấu hình khác chỉ đổi một vài khóa so với đây
+BASE: Dict[str, Any] = {
+	"stream_copy": False, "loop_if_single": False, "transition": "Không", "keep_audio": False,
+	"sharpen": False, "color": False, "use_nvenc": False, "hwaccel_decode": False,
+}
+
+# tên -> (tùy chọn thêm vào BASE, số clip trên timeline)
+CONFIGS: Dict[str, Tuple[Dict[str, Any], int]] = {
+	"base": ({}, 1),
+	"fast_mode": ({"fast_mode": True}, 1),
+	"preset_ultrafast": ({"preset": "ultrafast"}, 1),
+	"preset_medium": ({"preset": "medium"}, 1),
+	"sharpen": ({"sharpen": True}, 1),
+	"color": ({"color": True}, 1),
+	"cinematic": ({"film_grain": True, "vignette": True, "digital_noise": True}, 1),
+	"delogo": ({"delogo": True, "delogo_preset": "top_right"}, 1),
+	"delogo_blur": ({"delogo": True, "delogo_preset": "top_right", "region_blur": "blur"}, 1),
+	"hide_qr": ({"hide_qr": True}, 1),
+	"transition": ({"transition": "Crossfade"}, 2),
+	"auto": ({"sharpen": True, "color": True, "transition": "Crossfade", "delogo": True, "delogo_preset": "top_right"}, 2),
+}
+
+METRICS = ("fps", "speed", "cpu_seconds", "peak_rss_mb", "wall_seconds")
+
+
+def make_input(name: str, index: int, seconds: float) -> str:
+	"""Sinh (hoặc lấy từ cache) clip thứ index của input name: H.264 + AAC, dài seconds giây."""
+	w, h, fps = INPUTS[name]
+	path = os.path.join(app_cache_dir("bench_media"), f"{w}x{h}_{fps}_{seconds:g}s_{index}.mp4")
+	if os.path.isfile(path):
+		return path
+	tmp = path + ".part.mp4"
+	cmd = [
+		_FFMPEG_BIN, "-y", "-hide_banner", "-v", "error",
+		"-f", "lavfi", "-i", f"testsrc2=s={w}x{h}:r={fps}:d={seconds},noise=alls=4:allf=t",
+		"-f", "lavfi", "-i", f"sine=frequency={440 + 110 * index}:sample_rate=48000:d={seconds}",
+		"-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p", "-g", str(fps * 2),
+		"-c:a", "aac", "-b:a", "128k", "-shortest", tmp,
+	]
+	subprocess.run(cmd, check=True)
+	os.replace(tmp, path)
+	return path
+
+
+def run_case(config: str, input_name: str, seconds: float, canvas: Tuple[int, int], repeat: int,
+			 threads: int, work_dir: str) -> Dict[str, Any]:
+	"""Render một cấu hình trên một input repeat lần, trả về trung vị các số đo."""
+	extra, clips = CONFIGS[config]
+	inputs = [make_input(input_name, k, seconds) for k in range(clips)]
+	options = dict(BASE, threads=threads, **extra)
+	samples: Dict[str, List[float]] = {m: [] for m in METRICS}
+	for _ in range(repeat):
+		builder = configure_builder(inputs, options)
+		builder.canvas_size = canvas
+		out = os.path.join(work_dir, f"{config}_{input_name.replace('@', '_')}.mp4")
+		try:
+			cmd = builder.build() + [out]
+			report = run_ffmpeg_with_progress(cmd, builder.expected_total_duration_seconds, None, record_history=False)
+		finally:
+			builder.cleanup()
+		values = {
+			"fps": report.encode_fps,
+			"speed": report.speed,
+			"cpu_seconds": (report.cpu_user_seconds + (report.cpu_system_seconds or 0.0)) if report.cpu_user_seconds is not None else None,
+			"peak_rss_mb": report.peak_rss_mb,
+			"wall_seconds": report.wall_seconds,
+		}
+		for m, v in values.items():
+			if v is not None:
+				samples[m].append(float(v))
+		if os.path.isfile(out):
+			os.remove(out)
+	return {m: (round(statistics.median(v), 3) if v else None) for m, v in samples.items()}
+
+
+def host_meta(canvas: Tuple[int, int], seconds: float) -> Dict[str, Any]:
+	caps = detect_capabilities(_FFMPEG_BIN)
+	return {
+		"host": platform.node(),
+		"machine": platform.machine(),
+		"cpu_count": os.cpu_count(),
+		"ffmpeg": caps.version if caps else None,
+		"canvas": f"{canvas[0]}x{canvas[1]}",
+		"seconds": seconds,
+		"created": datetime.now().isoformat(timespec="seconds"),
+	}
+
+
+def _num(value: Optional[float], spec: str) -> str:
+	return "-" if value is None else format(value, spec)
+
+
+def _pct(value: Optional[float]) -> str:
+	return "-" if value is None else f"{value * 100:+.1f}%"
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+	"""In bảng so sánh; trả về danh sách mục chậm đi quá ngưỡng."""
+	regressions: List[str] = []
+	print(f"{'cấu hình/input':<34} {'fps':>8} {'Δfps':>8} {'CPU s':>8} {'ΔCPU':>8}")
+	for key, cur in results.items():
+		base = baseline.get(key)
+		d_fps = d_cpu = None
+		if base:
+			if cur.get("fps") and base.get("fps"):
+				d_fps = cur["fps"] / base["fps"] - 1.0
+			if cur.get("cpu_seconds") and base.get("cpu_seconds"):
+				d_cpu = cur["cpu_seconds"] / base["cpu_seconds"] - 1.0
+		bad = (d_fps is not None and d_fps < -threshold) or (d_cpu is not None and d_cpu > threshold)
+		if bad:
+			regressions.append(key)
+		print(f"{key:<34} {_num(cur.get('fps'), '.1f'):>8} {_pct(d_fps):>8} {_num(cur.get('cpu_seconds'), '.2f'):>8} {_pct(d_cpu):>8}"
+			  + ("  << CHẬM ĐI" if bad else ("" if base else "  (chưa có baseline)")))
+	return regressions
+
+
+def _parse_size(text: str) -> Tuple[int, int]:
+	w, _, h = text.lower().partition("x")
+	return int(w), int(h)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Benchmark các tùy chọn của pipeline render trên input tổng hợp")
+	parser.add_argument("--configs", default=",".join(CONFIGS), help="Danh sách cấu hình, cách nhau bằng dấu phẩy")
+	parser.add_argument("--inputs", default=",".join(INPUTS), help="Danh sách input (WxH@fps), cách nhau bằng dấu phẩy")
+	parser.add_argument("--seconds", type=float, default=3.0, help="Thời lượng mỗi clip input")
+	parser.add_argument("--canvas", default="1080x1920", help="Canvas output (mặc định nửa 4K cho nhanh)")
+	parser.add_argument("--repeat", type=int, default=1)
+	parser.add_argument("--threads", type=int, default=0, help="-threads của encoder (0 = ffmpeg tự chọn)")
+	parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+	parser.add_argument("--threshold", type=float, default=0.15, help="Ngưỡng chậm đi (0.15 = 15%%)")
+	parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả lần này làm baseline")
+	parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+	parser.add_argument("--list", action="store_true", help="Liệt kê cấu hình và input rồi thoát")
+	args = parser.parse_args(argv)
+
+	if args.list:
+		for name, (extra, clips) in CONFIGS.items():
+			print(f"{name:<18} {clips} clip  {json.dumps(extra, ensure_ascii=False)}")
+		print("input: " + ", ".join(INPUTS))
+		return 0
+	configs = [c for c in args.configs.split(",") if c]
+	inputs = [i for i in args.inputs.split(",") if i]
+	unknown = [c for c in configs if c not in CONFIGS] + [i for i in inputs if i not in INPUTS]
+	if unknown:
+		parser.error("Không có cấu hình/input: " + ", ".join(unknown))
+	canvas = _parse_size(args.canvas)
+
+	meta = host_meta(canvas, args.seconds)
+	results: Dict[str, Dict[str, Any]] = {}
+	work_dir = tempfile.mkdtemp(prefix="veo3_bench_")
+	try:
+		for config in configs:
+			for input_name in inputs:
+				key = f"{config}/{input_name}"
+				results[key] = run_case(config, input_name, args.seconds, canvas, max(1, args.repeat), args.threads, work_dir)
+				print(f"{key}: {results[key]}", file=sys.stderr, flush=True)
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+	baseline: Dict[str, Any] = {}
+	if os.path.isfile(args.baseline):
+		with open(args.baseline, "r", encoding="utf-8") as f:
+			baseline = json.load(f)
+	base_meta = baseline.get("meta", {})
+	for field_name in ("host", "cpu_count", "ffmpeg", "canvas", "seconds"):
+		if base_meta and base_meta.get(field_name) != meta.get(field_name):
+			print(f"Cảnh báo: baseline đo với {field_name}={base_meta.get(field_name)}, lần này {meta.get(field_name)}")
+	regressions = compare(results, baseline.get("results", {}), args.threshold)
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as f:
+			json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+	if args.save_baseline:
+		merged = dict(baseline.get("results", {})) if base_meta.get("host") == meta["host"] else {}
+		merged.update(results)
+		with open(args.baseline, "w", encoding="utf-8") as f:
+			json.dump({"meta": meta, "results": merged}, f, ensure_ascii=False, indent=2, sort_keys=True)
+		print(f"Đã ghi baseline: {args.baseline}")
+		return 0
+	if regressions:
+		print(f"{len(regressions)} mục chậm đi quá {args.threshold * 100:.0f}%: " + ", ".join(regressions))
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
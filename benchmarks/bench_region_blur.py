@@ -0,0 +1,78 @@
+"""So sánh chi phí che vùng logo + 4 góc QR trên frame 2160x3840.
+
+Chạy: python benchmarks/bench_region_blur.py [--frames 60]
+
+- legacy: cách cũ, một split/overlay cho logo rồi split 5 nhánh + 4 overlay cho QR.
+- blur:   region_blur_filter(mode="blur"), crop/boxblur từng vùng, overlay ghi tại chỗ (mặc định).
+- fill:   region_blur_filter(mode="fill"), chuỗi delogo tại chỗ.
+
+Nguồn là lavfi (không cần file mẫu); lutyuv phía trước tạo frame mới, ghi được, giống
+frame đi ra từ chuỗi filter thật. Thời gian filter/frame = (CPU của biến thể - CPU chỉ có
+nguồn) / số frame, đo bằng -benchmark của ffmpeg.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from processing import _FFMPEG_BIN, region_blur_filter  # noqa: E402
+
+W, H = 2160, 3840
+LOGO = (W - 260 - 30, 30, 260, 110)
+
+LEGACY = (
+	f"split[base][crop];[crop]crop={LOGO[2]}:{LOGO[3]}:{LOGO[0]}:{LOGO[1]},boxblur=20:2[bl];[base][bl]overlay={LOGO[0]}:{LOGO[1]},"
+	"split=5[qbase][qr1][qr2][qr3][qr4];[qr1]crop=200:200:0:0,boxblur=10:2[blur1];[qr2]crop=200:200:iw-200:0,boxblur=10:2[blur2];"
+	"[qr3]crop=200:200:0:ih-200,boxblur=10:2[blur3];[qr4]crop=200:200:iw-200:ih-200,boxblur=10:2[blur4];"
+	"[qbase][blur1]overlay=0:0[tmp1];[tmp1][blur2]overlay=W-200:0[tmp2];[tmp2][blur3]overlay=0:H-200[tmp3];[tmp3][blur4]overlay=W-200:H-200"
+)
+
+
+def _regions():
+	q = 200
+	return [LOGO + (20,), (0, 0, q, q, 10), (W - q, 0, q, q, 10), (0, H - q, q, q, 10), (W - q, H - q, q, q, 10)]
+
+
+def run(graph: str, frames: int) -> float:
+	"""CPU (user + sys, giây) của ffmpeg khi chạy graph trên frames frame."""
+	cmd = [
+		_FFMPEG_BIN, "-hide_banner", "-nostats", "-benchmark",
+		"-f", "lavfi", "-i", f"testsrc2=s={W}x{H}:r=30",
+		"-filter_complex", f"[0:v]format=yuv420p,lutyuv=y=val,{graph}[o]", "-map", "[o]",
+		"-frames:v", str(frames), "-f", "null", "-",
+	]
+	res = subprocess.run(cmd, capture_output=True, text=True)
+	if res.returncode != 0:
+		raise RuntimeError(res.stderr[-2000:])
+	m = re.search(r"utime=([\d.]+)s stime=([\d.]+)s", res.stderr)
+	return float(m.group(1)) + float(m.group(2))
+
+
+def main(argv=None) -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--frames", type=int, default=60)
+	parser.add_argument("--repeat", type=int, default=3, help="Lấy thời gian nhỏ nhất sau N lần chạy")
+	args = parser.parse_args(argv)
+
+	variants = {
+		"legacy": LEGACY,
+		"blur": region_blur_filter(_regions(), W, H, "blur"),
+		"fill": region_blur_filter(_regions(), W, H, "fill"),
+	}
+	baseline = min(run("null", args.frames) for _ in range(args.repeat))
+	print(f"{W}x{H}, {args.frames} frame, nguồn + lutyuv: {baseline / args.frames * 1000:.2f} ms/frame")
+	legacy_ms = None
+	for name, graph in variants.items():
+		cpu = min(run(graph, args.frames) for _ in range(args.repeat))
+		ms = max(0.0, cpu - baseline) / args.frames * 1000
+		legacy_ms = ms if legacy_ms is None else legacy_ms
+		ratio = f"  ({legacy_ms / ms:.1f}x nhanh hơn legacy)" if name != "legacy" and ms > 0 else ""
+		print(f"{name:<7} {ms:8.2f} ms/frame{ratio}")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,148 @@
+import platform
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from app_paths import JsonFileCache, file_identity
+
+
+# Encoder phần cứng có trong danh sách -encoders vẫn có thể không chạy (thiếu GPU/driver),
+# nên phải encode thử một frame mới biết
+_HW_ENCODERS = ("h264_nvenc", "hevc_nvenc")
+
+
+@dataclass
+class FFmpegCapabilities:
+	"""Những gì bản ffmpeg hiện tại thực sự làm được trên máy này."""
+	version: str = ""
+	encoders: List[str] = field(default_factory=list)
+	filters: List[str] = field(default_factory=list)
+	hwaccels: List[str] = field(default_factory=list)
+	# Encoder phần cứng đã encode thử thành công
+	working_hw_encoders: List[str] = field(default_factory=list)
+	# Các hwaccel đã khởi tạo được thiết bị
+	working_hwaccels: List[str] = field(default_factory=list)
+
+	def has_encoder(self, name: str) -> bool:
+		if name in _HW_ENCODERS:
+			return name in self.working_hw_encoders
+		return name in self.encoders
+
+	def has_filter(self, name: str) -> bool:
+		return name in self.filters
+
+	def has_hwaccel(self, name: str) -> bool:
+		return name in self.working_hwaccels
+
+
+_cache = JsonFileCache("ffmpeg_capabilities.json")
+_memo: Dict[str, FFmpegCapabilities] = {}
+_memo_lock = threading.Lock()
+
+
+def _run(ffmpeg_bin: str, args: List[str], timeout: float = 20.0) -> subprocess.CompletedProcess:
+	return subprocess.run([ffmpeg_bin, "-hide_banner"] + args, capture_output=True, text=True, timeout=timeout)
+
+
+def _parse_table(text: str) -> List[str]:
+	"""Cột tên trong bảng của -encoders/-filters (sau dòng cờ, ví dụ ' V....D libx264  ...')."""
+	names = []
+	for line in text.splitlines():
+		m = re.match(r"^\s*([A-Z.|]{3,8})\s+(\S+)\s", line)
+		if m and m.group(2) != "=":
+			names.append(m.group(2))
+	return names
+
+
+def _parse_hwaccels(text: str) -> List[str]:
+	lines = [l.strip() for l in text.splitlines()]
+	if "Hardware acceleration methods:" in lines:
+		lines = lines[lines.index("Hardware acceleration methods:") + 1:]
+	return [l for l in lines if l and " " not in l]
+
+
+def _try_encoder(ffmpeg_bin: str, encoder: str) -> bool:
+	try:
+		res = _run(ffmpeg_bin, ["-v", "error", "-f", "lavfi", "-i", "color=black:s=256x256:r=30:d=0.2",
+								"-frames:v", "1", "-c:v", encoder, "-f", "null", "-"])
+		return res.returncode == 0
+	except (OSError, subprocess.SubprocessError):
+		return False
+
+
+def _try_hwaccel(ffmpeg_bin: str, hwaccel: str) -> bool:
+	try:
+		res = _run(ffmpeg_bin, ["-v", "error", "-init_hw_device", f"{hwaccel}=hw", "-f", "lavfi", "-i", "nullsrc=s=64x64:d=0.1",
+								"-frames:v", "1", "-f", "null", "-"])
+		return res.returncode == 0
+	except (OSError, subprocess.SubprocessError):
+		return False
+
+
+def _cache_key(ffmpeg_bin: str) -> Optional[str]:
+	resolved = shutil.which(ffmpeg_bin) or ffmpeg_bin
+	ident = file_identity(resolved)
+	return f"{ident}|{platform.node()}" if ident else None
+
+
+def detect_capabilities(ffmpeg_bin: str = "ffmpeg", use_cache: bool = True) -> Optional[FFmpegCapabilities]:
+	"""Dò encoder/filter/hwaccel/phiên bản của ffmpeg một lần cho mỗi máy + file ffmpeg.
+
+	Kết quả cache trên đĩa theo đường dẫn + kích thước + mtime của binary và tên máy,
+	nên chỉ lần chạy đầu tiên (hoặc sau khi đổi ffmpeg) mới tốn vài giây encode thử.
+	Trả về None nếu không chạy được ffmpeg.
+	"""
+	key = _cache_key(ffmpeg_bin)
+	with _memo_lock:
+		if use_cache and key and key in _memo:
+			return _memo[key]
+	if use_cache and key:
+		hit = _cache.get(key)
+		if hit:
+			caps = FFmpegCapabilities(**hit)
+			with _memo_lock:
+				_memo[key] = caps
+			return caps
+
+	try:
+		version_out = _run(ffmpeg_bin, ["-version"]).stdout
+		encoders_out = _run(ffmpeg_bin, ["-encoders"]).stdout
+		filters_out = _run(ffmpeg_bin, ["-filters"]).stdout
+		hwaccels_out = _run(ffmpeg_bin, ["-hwaccels"]).stdout
+	except (OSError, subprocess.SubprocessError):
+		return None
+
+	m = re.search(r"ffmpeg version (\S+)", version_out)
+	caps = FFmpegCapabilities(
+		version=m.group(1) if m else "",
+		encoders=_parse_table(encoders_out),
+		filters=_parse_table(filters_out),
+		hwaccels=_parse_hwaccels(hwaccels_out),
+	)
+	hw_encoders = [e for e in _HW_ENCODERS if e in caps.encoders]
+	hwaccels = [h for h in ("cuda",) if h in caps.hwaccels]
+	with ThreadPoolExecutor(max_workers=max(1, len(hw_encoders) + len(hwaccels))) as pool:
+		enc_ok = list(pool.map(lambda e: _try_encoder(ffmpeg_bin, e), hw_encoders))
+		hw_ok = list(pool.map(lambda h: _try_hwaccel(ffmpeg_bin, h), hwaccels))
+	caps.working_hw_encoders = [e for e, ok in zip(hw_encoders, enc_ok) if ok]
+	caps.working_hwaccels = [h for h, ok in zip(hwaccels, hw_ok) if ok]
+
+	if key:
+		with _memo_lock:
+			_memo[key] = caps
+		_cache.set(key, asdict(caps))
+	return caps
+
+
+def invalidate_capabilities(ffmpeg_bin: str = "ffmpeg") -> None:
+	"""Bỏ kết quả đã cache (ví dụ khi ffmpeg vẫn phải fallback lúc chạy: driver GPU đã đổi)."""
+	key = _cache_key(ffmpeg_bin)
+	if not key:
+		return
+	with _memo_lock:
+		_memo.pop(key, None)
+	_cache.set(key, None)
@@ -0,0 +1,336 @@
+"""Chế độ daemon: theo dõi thư mục input, tự gom clip mới thành job và render (không import PyQt5).
+
+Chạy:
+
+	python daemon.py in_dir [in_dir2 ...] --out out_dir --jobs 2
+	python daemon.py in_dir --out out_dir --options '{"hide_qr": true}' --once
+	python daemon.py in_dir --out out_dir --jobs auto
+
+- Clip được coi là đã ghi xong khi kích thước + mtime không đổi trong --settle giây.
+- Clip mới của mỗi thư mục được gom theo thứ tự tên file, mỗi --group clip một job (mặc định
+  từng cặp). Clip lẻ chờ thêm --single-after giây; không có clip mới thì thành job riêng
+  (một clip thì tự lặp như loop_if_single).
+- Hàng đợi (clip đã thấy, job, trạng thái, số lần thử) lưu trong SQLite: sau khi sập hoặc
+  khởi động lại, job đang chạy dở được đưa lại vào hàng đợi, clip đã gom không bị gom lại.
+- Job lỗi được thử lại tối đa --retries lần, mỗi lần chờ gấp đôi lần trước (từ --backoff giây).
+- Output được render ra file tạm trong thư mục đích rồi đổi tên: nơi nhận không thấy file dở.
+  Thư mục đích không được là (hoặc nằm trong) thư mục theo dõi, nếu không output sẽ bị gom lại.
+- --jobs auto: scheduler.JobScheduler quyết định khi nào bắt đầu job tiếp theo và số thread
+  mỗi job theo CPU, RAM còn trống và lịch sử render.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from app_paths import app_cache_dir
+from batch import BatchJob, JobResult, configure_builder, job_processes, job_renditions, run_job
+from scheduler import JobEstimate, JobScheduler, Slot
+
+VIDEO_EXTS = (".mp4", ".mov", ".mkv", ".avi", ".webm")
+# Thời gian chờ tối đa giữa hai lần thử lại
+MAX_BACKOFF_SECONDS = 3600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+	path TEXT PRIMARY KEY,
+	dir TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	stable_since REAL NOT NULL,
+	job_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS jobs (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	name TEXT NOT NULL,
+	inputs TEXT NOT NULL,
+	output TEXT NOT NULL,
+	status TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	next_run REAL NOT NULL,
+	error TEXT,
+	created REAL NOT NULL,
+	updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, next_run);
+"""
+
+
+class JobQueue:
+	"""Hàng đợi clip/job lưu trong một file SQLite; mọi thay đổi là một transaction."""
+
+	def __init__(self, path: str):
+		self.path = path
+		self._db = sqlite3.connect(path)
+		self._db.row_factory = sqlite3.Row
+		self._db.execute("PRAGMA journal_mode=WAL")
+		self._db.executescript(_SCHEMA)
+
+	def close(self) -> None:
+		self._db.close()
+
+	def recover(self) -> int:
+		"""Đưa các job còn ở trạng thái running (tiến trình trước đã dừng giữa chừng) về hàng đợi."""
+		with self._db:
+			cur = self._db.execute("UPDATE jobs SET status = 'pending', next_run = ?, updated = ? WHERE status = 'running'",
+								   (time.time(), time.time()))
+		return cur.rowcount
+
+	def observe(self, folder: str, path: str, size: int, mtime_ns: int, now: float) -> None:
+		"""Ghi nhận một clip; kích thước/mtime đổi thì tính lại thời điểm bắt đầu ổn định."""
+		with self._db:
+			row = self._db.execute("SELECT size, mtime_ns FROM clips WHERE path = ?", (path,)).fetchone()
+			if row is None:
+				self._db.execute("INSERT INTO clips (path, dir, size, mtime_ns, stable_since) VALUES (?, ?, ?, ?, ?)",
+								 (path, folder, size, mtime_ns, now))
+			elif (row["size"], row["mtime_ns"]) != (size, mtime_ns):
+				self._db.execute("UPDATE clips SET size = ?, mtime_ns = ?, stable_since = ? WHERE path = ? AND job_id IS NULL",
+								 (size, mtime_ns, now, path))
+
+	def unassigned(self, folder: str) -> List[sqlite3.Row]:
+		"""Clip chưa thuộc job nào của thư mục, theo thứ tự tên file."""
+		return self._db.execute("SELECT * FROM clips WHERE dir = ? AND job_id IS NULL ORDER BY path", (folder,)).fetchall()
+
+	def add_job(self, name: str, inputs: List[str], output: str, now: float) -> int:
+		with self._db:
+			cur = self._db.execute(
+				"INSERT INTO jobs (name, inputs, output, status, next_run, created, updated) VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+				(name, json.dumps(inputs), output, now, now, now))
+			self._db.executemany("UPDATE clips SET job_id = ? WHERE path = ?", [(cur.lastrowid, p) for p in inputs])
+		return cur.lastrowid
+
+	def claim(self, now: float, limit: int) -> List[sqlite3.Row]:
+		"""Lấy tối đa limit job đến hạn chạy, chuyển sang running."""
+		if limit <= 0:
+			return []
+		with self._db:
+			rows = self._db.execute("SELECT * FROM jobs WHERE status = 'pending' AND next_run <= ? ORDER BY id LIMIT ?",
+									(now, limit)).fetchall()
+			self._db.executemany("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?",
+								 [(now, r["id"]) for r in rows])
+		return rows
+
+	def peek(self, now: float) -> Optional[sqlite3.Row]:
+		"""Job đến hạn chạy tiếp theo (chưa chuyển sang running)."""
+		return self._db.execute("SELECT * FROM jobs WHERE status = 'pending' AND next_run <= ? ORDER BY id LIMIT 1",
+								(now,)).fetchone()
+
+	def start(self, job_id: int, now: float) -> None:
+		with self._db:
+			self._db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?", (now, job_id))
+
+	def finish(self, job_id: int, ok: bool, error: Optional[str], now: float, retries: int, backoff: float) -> str:
+		"""Ghi kết quả một lần chạy; lỗi mà còn lượt thử thì hẹn chạy lại. Trả về trạng thái mới."""
+		with self._db:
+			attempts = self._db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()["attempts"]
+			if ok:
+				status, next_run = "done", now
+			elif attempts <= retries:
+				status, next_run = "pending", now + min(MAX_BACKOFF_SECONDS, backoff * 2 ** (attempts - 1))
+			else:
+				status, next_run = "failed", now
+			self._db.execute("UPDATE jobs SET status = ?, next_run = ?, error = ?, updated = ? WHERE id = ?",
+							 (status, next_run, error, now, job_id))
+		return status
+
+	def counts(self) -> Dict[str, int]:
+		rows = self._db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+		return {r["status"]: r["n"] for r in rows}
+
+	def has_pending(self) -> bool:
+		return self._db.execute("SELECT 1 FROM jobs WHERE status IN ('pending', 'running') LIMIT 1").fetchone() is not None
+
+
+def scan_folder(queue: JobQueue, folder: str, now: float) -> None:
+	try:
+		names = os.listdir(folder)
+	except OSError:
+		return
+	for name in names:
+		# File ẩn/tạm của tiến trình đang ghi (kể cả output tạm của chính daemon)
+		if name.startswith(".") or not name.lower().endswith(VIDEO_EXTS):
+			continue
+		path = os.path.abspath(os.path.join(folder, name))
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		if st.st_size > 0:
+			queue.observe(folder, path, st.st_size, st.st_mtime_ns, now)
+
+
+def _job_output(out_dir: str, folder: str, inputs: List[str], prefix_dir: bool) -> Tuple[str, str]:
+	stems = [os.path.splitext(os.path.basename(p))[0] for p in inputs]
+	name = stems[0] if len(stems) == 1 else f"{stems[0]}__{stems[-1]}"
+	if prefix_dir:
+		name = f"{os.path.basename(os.path.normpath(folder))}_{name}"
+	return name, os.path.join(out_dir, f"{name}.mp4")
+
+
+def group_clips(queue: JobQueue, folder: str, out_dir: str, group: int, settle: float, single_after: float,
+				now: float, prefix_dir: bool = False) -> List[int]:
+	"""Gom clip đã ghi xong của thư mục thành job; trả về id các job mới."""
+	clips = queue.unassigned(folder)
+	# Chỉ gom phần đầu danh sách đã ổn định, giữ đúng thứ tự tên file
+	ready: List[sqlite3.Row] = []
+	for c in clips:
+		if now - c["stable_since"] < settle:
+			break
+		ready.append(c)
+	waiting = len(clips) > len(ready)
+	created: List[int] = []
+	while len(ready) >= group:
+		inputs = [c["path"] for c in ready[:group]]
+		name, output = _job_output(out_dir, folder, inputs, prefix_dir)
+		created.append(queue.add_job(name, inputs, output, now))
+		ready = ready[group:]
+	# Clip lẻ: chờ thêm single_after giây (clip cuối ổn định) rồi thành job riêng
+	if ready and not waiting and now - max(c["stable_since"] for c in ready) >= single_after:
+		inputs = [c["path"] for c in ready]
+		name, output = _job_output(out_dir, folder, inputs, prefix_dir)
+		created.append(queue.add_job(name, inputs, output, now))
+	return created
+
+
+def _temp_output(output: str) -> str:
+	# Bắt đầu bằng dấu chấm: scan_folder bỏ qua nếu thư mục đích cũng là thư mục theo dõi
+	head, tail = os.path.split(output)
+	return os.path.join(head, f".{tail}.part.mp4")
+
+
+def run_daemon_job(job: BatchJob, final_output: str, slot: Optional[Slot] = None) -> JobResult:
+	"""Chạy job ra file tạm rồi đổi tên thành final_output (trong tiến trình con của pool)."""
+	res = run_job(job, slot)
+	if res.ok:
+		os.replace(job.output, final_output)
+		# Các bản xuất thêm (tùy chọn "renditions") cùng đổi tên; lỗi thì render_renditions đã xóa
+		extras = zip(job_renditions(job.output, job.options)[1:], job_renditions(final_output, job.options)[1:])
+		for temp, final in extras:
+			os.replace(temp.path, final.path)
+		res.output = final_output
+	elif os.path.exists(job.output):
+		os.remove(job.output)
+	return res
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Theo dõi thư mục, tự gom clip mới thành job và render")
+	parser.add_argument("dirs", nargs="+", help="Thư mục input cần theo dõi")
+	parser.add_argument("--out", required=True, help="Thư mục output")
+	parser.add_argument("--options", default="{}", help="Tùy chọn như trong manifest batch (JSON hoặc đường dẫn file JSON)")
+	parser.add_argument("-j", "--jobs", default="1", help="Số job chạy song song; auto = tự chọn theo CPU/RAM")
+	parser.add_argument("--group", type=int, default=2, help="Số clip mỗi job")
+	parser.add_argument("--settle", type=float, default=10.0, help="Clip không đổi trong N giây mới được coi là ghi xong")
+	parser.add_argument("--single-after", type=float, default=60.0, help="Clip lẻ chờ N giây rồi thành job riêng")
+	parser.add_argument("--retries", type=int, default=3, help="Số lần thử lại job lỗi")
+	parser.add_argument("--backoff", type=float, default=30.0, help="Chờ N giây trước lần thử lại đầu tiên (gấp đôi mỗi lần sau)")
+	parser.add_argument("--poll", type=float, default=5.0, help="Quét thư mục mỗi N giây")
+	parser.add_argument("--db", default=None, help="File SQLite của hàng đợi (mặc định trong thư mục cache)")
+	parser.add_argument("--once", action="store_true", help="Xử lý các clip đang có rồi thoát")
+	args = parser.parse_args(argv)
+
+	if os.path.isfile(args.options):
+		with open(args.options, "r", encoding="utf-8") as f:
+			options: Dict[str, Any] = json.load(f)
+	else:
+		options = json.loads(args.options)
+	dirs = [os.path.abspath(d) for d in args.dirs]
+	out_dir = os.path.abspath(args.out)
+	# Output nằm trong thư mục theo dõi sẽ bị gom lại thành clip mới: render lặp vô hạn
+	for d in dirs:
+		real_out, real_dir = os.path.realpath(out_dir), os.path.realpath(d)
+		if os.path.commonpath([real_out, real_dir]) == real_dir:
+			parser.error(f"--out không được là thư mục theo dõi hoặc nằm trong đó: {d}")
+	os.makedirs(out_dir, exist_ok=True)
+	queue = JobQueue(args.db or os.path.join(app_cache_dir(), "daemon_queue.sqlite3"))
+	recovered = queue.recover()
+	if recovered:
+		print(f"Đưa lại {recovered} job chạy dở vào hàng đợi", flush=True)
+
+	scheduler = JobScheduler() if args.jobs == "auto" else None
+	max_jobs = scheduler.cpu_count if scheduler else max(1, int(args.jobs))
+	estimates: Dict[int, JobEstimate] = {}
+
+	def next_jobs(now: float) -> List[Tuple[sqlite3.Row, Optional[Slot]]]:
+		if scheduler is None:
+			return [(row, None) for row in queue.claim(now, max_jobs - len(running))]
+		started: List[Tuple[sqlite3.Row, Optional[Slot]]] = []
+		while True:
+			row = queue.peek(now)
+			if row is None:
+				return started
+			if row["id"] not in estimates:
+				job = BatchJob(inputs=json.loads(row["inputs"]), output=row["output"], options=options, name=row["name"])
+				try:
+					estimates[row["id"]] = scheduler.estimate(configure_builder(job.inputs, job.options), job_processes(job))
+				except Exception as e:
+					queue.start(row["id"], now)
+					status = queue.finish(row["id"], False, str(e), now, args.retries, args.backoff)
+					print(f"[{row['name']}] LỖI: {e} -> {status}", flush=True)
+					continue
+			slot = scheduler.admit(estimates[row["id"]])
+			if slot is None:
+				return started
+			queue.start(row["id"], now)
+			started.append((row, slot))
+
+	running: Dict[Future, Tuple[int, str, Optional[Slot]]] = {}
+	pool = ProcessPoolExecutor(max_workers=max_jobs)
+	try:
+		while True:
+			now = time.time()
+			for folder in dirs:
+				scan_folder(queue, folder, now)
+				# --once: không chờ clip đang ghi dở hay clip lẻ
+				settle, single_after = (0.0, 0.0) if args.once else (args.settle, args.single_after)
+				for job_id in group_clips(queue, folder, out_dir, max(1, args.group), settle, single_after, now, len(dirs) > 1):
+					print(f"Job #{job_id} mới", flush=True)
+			for row, slot in next_jobs(now):
+				job = BatchJob(inputs=json.loads(row["inputs"]), output=_temp_output(row["output"]), options=options, name=row["name"])
+				detail = f", {slot.describe()}" if slot else ""
+				print(f"[{row['name']}] bắt đầu (lần {row['attempts'] + 1}{detail})", flush=True)
+				running[pool.submit(run_daemon_job, job, row["output"], slot)] = (row["id"], row["name"], slot)
+			if args.once and not running and not queue.has_pending():
+				break
+			if not running:
+				time.sleep(args.poll)
+				continue
+			done, _ = wait(list(running), timeout=args.poll, return_when=FIRST_COMPLETED)
+			for fut in done:
+				job_id, name, slot = running.pop(fut)
+				if slot:
+					scheduler.release(slot)
+					# Job vừa xong đã ghi lịch sử render: ước tính lại các job còn chờ
+					estimates.clear()
+				try:
+					res = fut.result()
+					ok, error = res.ok, res.error
+				except BrokenProcessPool as e:
+					# Tiến trình con bị kill (hết RAM...): pool không dùng lại được
+					ok, error = False, f"tiến trình render bị dừng đột ngột: {e}"
+					pool.shutdown(wait=False)
+					pool = ProcessPoolExecutor(max_workers=max_jobs)
+				except Exception as e:
+					ok, error = False, str(e)
+				status = queue.finish(job_id, ok, error, time.time(), args.retries, args.backoff)
+				print(f"[{name}] {'OK' if ok else 'LỖI: ' + str(error)} -> {status}", flush=True)
+	except KeyboardInterrupt:
+		# Job đang chạy giữ trạng thái running, lần khởi động sau recover() đưa lại vào hàng đợi
+		print("Dừng daemon", flush=True)
+		pool.shutdown(wait=False, cancel_futures=True)
+		return 130
+	finally:
+		counts = queue.counts()
+		print("Hàng đợi: " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())), flush=True)
+		queue.close()
+	pool.shutdown()
+	return 1 if counts.get("failed") else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
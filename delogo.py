@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Optional, Tuple
 import cv2
 import numpy as np
 
@@ -36,27 +36,26 @@ def compute_delogo_coords(preset: DelogoPreset, w: int, h: int, margin: int) ->
 	return max(0, canvas_w - w - margin), margin
 
 
-def _compose_to_canvas_2160x3840(frame_bgr: np.ndarray) -> np.ndarray:
-	"""Resize giữ tỉ lệ vào khung 2160x3840 và pad đen giống logic FFmpeg."""
-	canvas_w, canvas_h = 2160, 3840
-	h, w = frame_bgr.shape[:2]
-	scale = min(canvas_w / w, canvas_h / h)
-	new_w, new_h = int(w * scale), int(h * scale)
-	resized = cv2.resize(frame_bgr, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-	canvas = np.zeros((canvas_h, canvas_w, 3), dtype=np.uint8)
-	off_x = (canvas_w - new_w) // 2
-	off_y = (canvas_h - new_h) // 2
-	canvas[off_y:off_y+new_h, off_x:off_x+new_w] = resized
-	return canvas
+def canvas_mapping(src_w: int, src_h: int, canvas_w: int = 2160, canvas_h: int = 3840) -> Tuple[float, int, int]:
+	"""(scale, off_x, off_y) của phép scale giữ tỉ lệ + pad đen ở giữa, giống logic FFmpeg."""
+	scale = min(canvas_w / src_w, canvas_h / src_h)
+	new_w, new_h = int(src_w * scale), int(src_h * scale)
+	return scale, (canvas_w - new_w) // 2, (canvas_h - new_h) // 2
 
 
 def infer_delogo_region_auto(frame_bgr, default_size: Tuple[int, int], default_margin: int) -> Tuple[int, int, int, int]:
 	"""Suy đoán góc watermark bằng cách đo độ tương phản/biên tại bốn góc.
 	Trả về (x, y, w, h) trên canvas 2160x3840.
+
+	Các ô ứng viên được ánh xạ ngược về độ phân giải gốc và chấm điểm trực tiếp trên
+	frame gốc, không dựng canvas 4K. Phần ô nằm trong vùng pad đen được tính là 0.
+	Phương sai Laplacian được chia cho scale^4 để quy về mức của ảnh đã phóng to
+	(phóng to làm biên mượt đi ~scale^2 lần), nên điểm số xấp xỉ cách tính cũ trên canvas.
 	"""
 	w_box, h_box = default_size
-	canvas = _compose_to_canvas_2160x3840(frame_bgr)
-	gray = cv2.cvtColor(canvas, cv2.COLOR_BGR2GRAY)
+	gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY) if frame_bgr.ndim == 3 else frame_bgr
+	src_h, src_w = gray.shape[:2]
+	scale, off_x, off_y = canvas_mapping(src_w, src_h)
 
 	candidates = {
 		"top_left": (default_margin, default_margin),
@@ -69,14 +68,20 @@ def infer_delogo_region_auto(frame_bgr, default_size: Tuple[int, int], default_m
 	best_score = -1.0
 	best_xy = (default_margin, default_margin)
 	for key, (x, y) in candidates.items():
-		roi = gray[y:y+h_box, x:x+w_box]
-		if roi.size == 0:
-			continue
-		# Score: mix of edge strength and brightness (typical watermark sáng)
-		edges = cv2.Laplacian(roi, cv2.CV_32F)
-		edge_var = float(edges.var())
-		mean_val = float(roi.mean())
-		score = edge_var * 0.7 + mean_val * 0.3
+		# Ô trên canvas -> hình chữ nhật trên frame gốc
+		x0 = max(0, int((x - off_x) / scale))
+		y0 = max(0, int((y - off_y) / scale))
+		x1 = min(src_w, int(np.ceil((x + w_box - off_x) / scale)))
+		y1 = min(src_h, int(np.ceil((y + h_box - off_y) / scale)))
+		score = 0.0
+		if x1 - x0 >= 3 and y1 - y0 >= 3:
+			roi = gray[y0:y1, x0:x1]
+			coverage = min(1.0, (x1 - x0) * (y1 - y0) * scale * scale / float(w_box * h_box))
+			# Score: mix of edge strength and brightness (typical watermark sáng)
+			edges = cv2.Laplacian(roi, cv2.CV_32F)
+			edge_var = float(edges.var()) / (scale ** 4)
+			mean_val = float(roi.mean()) * coverage
+			score = edge_var * 0.7 + mean_val * 0.3
 		if score > best_score:
 			best_score = score
 			best_xy = (x, y)
@@ -88,3 +93,71 @@ def infer_delogo_region_auto(frame_bgr, default_size: Tuple[int, int], default_m
 
 def infer_delogo_region(frame_bgr, default_size: Tuple[int, int], default_margin: int) -> Tuple[int, int, int, int]:
 	return infer_delogo_region_auto(frame_bgr, default_size, default_margin)
+
+
+def localize_static_overlay(frames: np.ndarray, static_ratio: float = 0.35, min_edge: float = 6.0,
+							max_box_fraction: float = 0.2) -> Optional[Tuple[int, int, int, int]]:
+	"""Tìm watermark/logo tĩnh từ K frame (K, H, W) grayscale rải đều trong clip.
+
+	Thống kê theo thời gian cho từng pixel (vector hóa bằng NumPy):
+	- pixel "tĩnh" khi độ lệch chuẩn theo thời gian nhỏ hơn static_ratio lần trung vị của
+	  cả khung (ngưỡng tương đối nên chịu được nhiễu/nén và watermark bán trong suốt),
+	- vùng tĩnh phải có biên (trung vị độ lớn gradient qua K frame >= min_edge) để loại
+	  viền đen letterbox/pad, vốn tĩnh nhưng phẳng.
+	Trả về (x, y, w, h) theo tọa độ frame, hoặc None nếu không đủ tin cậy (ví dụ cảnh
+	gần như tĩnh hoàn toàn thì không phân biệt được logo với nền).
+	"""
+	if frames is None or frames.ndim != 3 or frames.shape[0] < 3:
+		return None
+	k, h, w = frames.shape
+	f = frames.astype(np.float32)
+	temporal_std = f.std(axis=0)
+	ref_std = float(np.median(temporal_std))
+	if ref_std < 4.0:
+		return None
+
+	# Độ lớn gradient từng frame, lấy trung vị theo thời gian
+	grad = np.zeros_like(f)
+	grad[:, :, 1:] = np.abs(np.diff(f, axis=2))
+	grad[:, 1:, :] = np.maximum(grad[:, 1:, :], np.abs(np.diff(f, axis=1)))
+	edges = np.median(grad, axis=0)
+
+	static = temporal_std < max(2.0, static_ratio * ref_std)
+	# Nối các nét chữ/logo rời rạc thành một khối
+	ksize = max(3, int(round(min(w, h) * 0.02)) | 1)
+	mask_u8 = cv2.morphologyEx(static.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((ksize, ksize), np.uint8))
+	n, labels, stats, _ = cv2.connectedComponentsWithStats(mask_u8, connectivity=8)
+	if n <= 1:
+		return None
+
+	# Điểm biên trung bình của từng khối, tính một lần cho mọi nhãn
+	areas = stats[:, cv2.CC_STAT_AREA].astype(np.float64)
+	edge_sum = np.bincount(labels.ravel(), weights=edges.ravel(), minlength=n)
+	edge_mean = edge_sum / np.maximum(areas, 1.0)
+	bw = stats[:, cv2.CC_STAT_WIDTH]
+	bh = stats[:, cv2.CC_STAT_HEIGHT]
+	ok = (areas >= max(16.0, 0.0003 * w * h)) & (bw * bh <= max_box_fraction * w * h) \
+		& (bw < 0.9 * w) & (bh < 0.9 * h) & (edge_mean >= min_edge)
+	ok[0] = False
+	if not ok.any():
+		return None
+	score = np.where(ok, edge_mean * np.sqrt(areas), -1.0)
+	best = int(np.argmax(score))
+	x, y = int(stats[best, cv2.CC_STAT_LEFT]), int(stats[best, cv2.CC_STAT_TOP])
+	pad = max(2, ksize // 2)
+	x0, y0 = max(0, x - pad), max(0, y - pad)
+	x1, y1 = min(w, x + int(bw[best]) + pad), min(h, y + int(bh[best]) + pad)
+	return x0, y0, x1 - x0, y1 - y0
+
+
+def frame_box_to_canvas(box: Tuple[int, int, int, int], frame_w: int, frame_h: int) -> Tuple[int, int, int, int]:
+	"""Ánh xạ ô (x, y, w, h) trên frame (đã thu nhỏ, cùng tỉ lệ với nguồn) sang canvas 2160x3840."""
+	scale, off_x, off_y = canvas_mapping(frame_w, frame_h)
+	x, y, w, h = box
+	cx = int(np.floor(off_x + x * scale))
+	cy = int(np.floor(off_y + y * scale))
+	cw = int(np.ceil(w * scale))
+	ch = int(np.ceil(h * scale))
+	cx = max(0, min(2160 - 2, cx))
+	cy = max(0, min(3840 - 2, cy))
+	return cx, cy, max(2, min(cw, 2160 - cx)), max(2, min(ch, 3840 - cy))
@@ -0,0 +1,77 @@
+"""Sắp xếp lại chuỗi filter video theo chi phí mà không đổi kết quả (trong sai số ghi dưới đây).
+
+Quy tắc (chuỗi vào theo thứ tự "logic" như builder mô tả, chuỗi ra là thứ tự thực thi):
+
+1. Filter màu affine theo từng pixel (eq không có gamma) được đưa lên trước scale/pad/unsharp.
+   eq là y = a*x + b trên từng kênh; scale (trọng số tổng bằng 1) và unsharp (x + k*(x - blur(x)))
+   đều tuyến tính nên hoán đổi được. eq chạy ở độ phân giải gốc thay vì 2160x3840.
+   Sai số: làm tròn/cắt 8 bit, tối đa ±2 mức; viền pad đen giữ màu đen (Y=16) thay vì
+   eq(đen) (Y=15), chênh 1 mức.
+2. Nhiều noise=alls=N được gộp thành một noise với N = sqrt(sum(N_i^2)), cùng phương sai
+   nhiễu tổng; noise gộp nằm ở vị trí noise đầu tiên. Sai số: phân bố nhiễu (không phải
+   cường độ) khác một chút; phần nhiễu sau vignette không còn bị vignette làm tối ở góc.
+3. fps chạy đầu chuỗi khi fps nguồn >= fps đích (chỉ bỏ frame, filter phía sau xử lý ít
+   frame hơn); ngược lại chạy cuối chuỗi để frame nhân bản không bị xử lý lại. Chính xác.
+4. Filter chỉ làm việc trên RGB (lut3d) luôn nằm cuối và không có filter YUV nào được
+   đưa ra sau nó, nên chỉ có một lần chuyển YUV -> RGB -> YUV.
+"""
+import math
+import re
+from typing import List, Optional, Tuple
+
+
+# Filter tuyến tính/hình học mà filter màu affine hoán đổi được
+_COMMUTES_WITH_AFFINE = {"scale", "pad", "unsharp", "fps", "setsar", "null"}
+_NOISE_RE = re.compile(r"^noise=alls=(\d+)$")
+
+
+def _split(f: str) -> Tuple[str, str]:
+	name, _, args = f.partition("=")
+	return name.strip(), args
+
+
+def _is_affine_color(f: str) -> bool:
+	name, args = _split(f)
+	return name == "eq" and "gamma" not in args
+
+
+def _merge_noise(chain: List[str]) -> List[str]:
+	strengths = [int(m.group(1)) for m in (_NOISE_RE.match(f) for f in chain) if m]
+	if len(strengths) < 2:
+		return chain
+	merged = min(100, int(round(math.sqrt(sum(s * s for s in strengths)))))
+	out: List[str] = []
+	placed = False
+	for f in chain:
+		if _NOISE_RE.match(f):
+			if not placed:
+				out.append(f"noise=alls={merged}")
+				placed = True
+			continue
+		out.append(f)
+	return out
+
+
+def _hoist_affine_color(chain: List[str]) -> List[str]:
+	hoisted: List[str] = []
+	rest: List[str] = []
+	for f in chain:
+		# Chỉ đưa lên trước khi mọi filter đứng trước nó đều hoán đổi được với nó
+		if _is_affine_color(f) and all(_split(g)[0] in _COMMUTES_WITH_AFFINE for g in rest):
+			hoisted.append(f)
+		else:
+			rest.append(f)
+	return hoisted + rest
+
+
+def plan_video_chain(chain: List[str], src_fps: Optional[float] = None, out_fps: Optional[float] = None) -> List[str]:
+	"""Trả về chuỗi filter đã sắp xếp/gộp; out_fps (nếu có) được chèn ở vị trí rẻ nhất."""
+	planned = _merge_noise([f for f in chain if f and f != "null"])
+	planned = _hoist_affine_color(planned)
+	if out_fps:
+		fps = f"fps={out_fps:g}"
+		if src_fps and src_fps >= out_fps - 0.01:
+			planned.insert(0, fps)
+		else:
+			planned.append(fps)
+	return planned or ["null"]
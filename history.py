@@ -0,0 +1,241 @@
+"""Lịch sử hiệu năng các lần render (mỗi dòng một JSON trong render_history.jsonl).
+
+Xem nhanh từ dòng lệnh:
+
+	python history.py --last 20
+	python history.py --encoder libx264 --summary
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import threading
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app_paths import app_cache_dir
+
+
+@dataclass
+class RenderReport:
+	"""Kết quả đo của một lần chạy run_ffmpeg_with_progress."""
+	started_at: str
+	host: str
+	output: Optional[str] = None
+	status: str = "ok"  # ok | failed | cancelled
+	returncode: Optional[int] = None
+	wall_seconds: float = 0.0
+	media_seconds: Optional[float] = None
+	frames: Optional[int] = None
+	encode_fps: Optional[float] = None
+	speed: Optional[float] = None
+	cpu_user_seconds: Optional[float] = None
+	cpu_system_seconds: Optional[float] = None
+	peak_rss_mb: Optional[float] = None
+	output_size: Optional[int] = None
+	bitrate_kbps: Optional[float] = None
+	encoder: Optional[str] = None
+	preset: Optional[str] = None
+	filters: List[str] = field(default_factory=list)
+	fallback_path: List[str] = field(default_factory=list)
+	attempts: int = 0
+	options: Dict[str, Any] = field(default_factory=dict)
+	error: Optional[str] = None
+	command: List[str] = field(default_factory=list)
+
+	@property
+	def ok(self) -> bool:
+		return self.status == "ok"
+
+	def summary(self) -> str:
+		parts = [f"{self.wall_seconds:.1f}s"]
+		if self.encode_fps is not None:
+			parts.append(f"{self.encode_fps:.1f} fps")
+		if self.speed is not None:
+			parts.append(f"{self.speed:.2f}x")
+		if self.cpu_user_seconds is not None:
+			parts.append(f"CPU {self.cpu_user_seconds + (self.cpu_system_seconds or 0.0):.1f}s")
+		if self.peak_rss_mb is not None:
+			parts.append(f"RAM đỉnh {self.peak_rss_mb:.0f} MB")
+		if self.output_size is not None:
+			parts.append(f"{self.output_size / (1024 * 1024):.1f} MB")
+		if self.bitrate_kbps is not None:
+			parts.append(f"{self.bitrate_kbps:.0f} kb/s")
+		if self.encoder:
+			parts.append(self.encoder)
+		if self.fallback_path:
+			parts.append("fallback: " + " → ".join(self.fallback_path))
+		return ", ".join(parts)
+
+
+def new_report(options: Optional[Dict[str, Any]] = None) -> RenderReport:
+	return RenderReport(
+		started_at=datetime.now().isoformat(timespec="seconds"),
+		host=platform.node() or "unknown",
+		options=dict(options or {}),
+	)
+
+
+def _option_value(cmd: List[str], flag: str) -> Optional[str]:
+	try:
+		return cmd[cmd.index(flag) + 1]
+	except (ValueError, IndexError):
+		return None
+
+
+_LABEL_RE = re.compile(r"^(\[[^\]]*\])+")
+
+
+def filter_names(cmd: List[str]) -> List[str]:
+	"""Tên các filter trong -vf/-af/-filter_complex của lệnh, theo thứ tự, không lặp."""
+	names: List[str] = []
+	for flag in ("-filter_complex", "-vf", "-af"):
+		graph = _option_value(cmd, flag)
+		if not graph:
+			continue
+		for chain in graph.split(";"):
+			for part in chain.split(","):
+				part = _LABEL_RE.sub("", part.strip())
+				name = re.split(r"[=\[]", part, maxsplit=1)[0].strip()
+				if name and re.fullmatch(r"[a-z0-9_]+", name) and name not in names:
+					names.append(name)
+	return names
+
+
+def describe_command(report: RenderReport, cmd: List[str]) -> None:
+	"""Điền encoder/preset/filter/output từ lệnh ffmpeg thực sự đã chạy."""
+	report.command = list(cmd)
+	report.encoder = _option_value(cmd, "-c:v") or report.encoder
+	report.preset = _option_value(cmd, "-preset") or report.preset
+	report.filters = filter_names(cmd)
+	if cmd and not cmd[-1].startswith("-"):
+		report.output = cmd[-1]
+
+
+def finalize_output(report: RenderReport) -> None:
+	"""Kích thước file ra và bitrate trung bình (khi render thành công)."""
+	if not report.ok or not report.output or not os.path.isfile(report.output):
+		return
+	report.output_size = os.path.getsize(report.output)
+	if report.media_seconds and report.media_seconds > 0:
+		report.bitrate_kbps = report.output_size * 8 / 1000.0 / report.media_seconds
+
+
+class RenderHistory:
+	"""Kho lịch sử dạng JSON Lines, chỉ ghi nối thêm nên nhiều tiến trình dùng chung được."""
+
+	def __init__(self, path: Optional[str] = None):
+		self.path = path or os.path.join(app_cache_dir(), "render_history.jsonl")
+		self._lock = threading.Lock()
+
+	def append(self, report: RenderReport) -> None:
+		line = json.dumps(asdict(report), ensure_ascii=False)
+		with self._lock:
+			try:
+				with open(self.path, "a", encoding="utf-8") as f:
+					f.write(line + "\n")
+			except OSError:
+				pass
+
+	def load(self) -> List[RenderReport]:
+		known = {f.name for f in fields(RenderReport)}
+		reports: List[RenderReport] = []
+		try:
+			with open(self.path, "r", encoding="utf-8") as f:
+				for line in f:
+					try:
+						data = json.loads(line)
+						reports.append(RenderReport(**{k: v for k, v in data.items() if k in known}))
+					except (ValueError, TypeError):
+						continue  # dòng hỏng (ví dụ ghi dở khi tắt máy)
+		except OSError:
+			pass
+		return reports
+
+	def query(self, host: Optional[str] = None, encoder: Optional[str] = None, status: Optional[str] = None,
+			  since: Optional[str] = None, option: Optional[Dict[str, Any]] = None, last: Optional[int] = None) -> List[RenderReport]:
+		"""Lọc lịch sử. since là chuỗi ISO (so sánh theo thứ tự chuỗi); option lọc theo từng cặp key=value."""
+		result = []
+		for r in self.load():
+			if host and r.host != host:
+				continue
+			if encoder and r.encoder != encoder:
+				continue
+			if status and r.status != status:
+				continue
+			if since and r.started_at < since:
+				continue
+			if option and any(r.options.get(k) != v for k, v in option.items()):
+				continue
+			result.append(r)
+		return result[-last:] if last else result
+
+
+def summarize(reports: List[RenderReport]) -> List[Dict[str, Any]]:
+	"""Gom theo (máy, encoder, preset) và tính trung vị fps/speed của các lần thành công."""
+	groups: Dict[tuple, List[RenderReport]] = {}
+	for r in reports:
+		if r.ok:
+			groups.setdefault((r.host, r.encoder, r.preset), []).append(r)
+	rows = []
+	for (host, encoder, preset), items in sorted(groups.items(), key=lambda kv: tuple(str(x) for x in kv[0])):
+		fps = [r.encode_fps for r in items if r.encode_fps is not None]
+		speed = [r.speed for r in items if r.speed is not None]
+		rows.append({
+			"host": host, "encoder": encoder, "preset": preset, "runs": len(items),
+			"median_fps": statistics.median(fps) if fps else None,
+			"median_speed": statistics.median(speed) if speed else None,
+		})
+	return rows
+
+
+_default_history: Optional[RenderHistory] = None
+
+
+def default_history() -> RenderHistory:
+	global _default_history
+	if _default_history is None:
+		_default_history = RenderHistory()
+	return _default_history
+
+
+def _fmt(value: Optional[float], spec: str) -> str:
+	return "-" if value is None else format(value, spec)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Xem lịch sử hiệu năng render")
+	parser.add_argument("--host")
+	parser.add_argument("--encoder")
+	parser.add_argument("--status", choices=["ok", "failed", "cancelled"])
+	parser.add_argument("--since", help="Thời điểm ISO, ví dụ 2024-05-01")
+	parser.add_argument("--last", type=int, default=20)
+	parser.add_argument("--summary", action="store_true", help="Gom theo máy/encoder/preset")
+	parser.add_argument("--json", action="store_true", help="In JSON thay vì bảng")
+	args = parser.parse_args(argv)
+
+	reports = default_history().query(host=args.host, encoder=args.encoder, status=args.status, since=args.since,
+									  last=None if args.summary else args.last)
+	if args.summary:
+		rows = summarize(reports)
+		if args.json:
+			print(json.dumps(rows, ensure_ascii=False, indent=2))
+		else:
+			for row in rows:
+				print(f"{row['host']:<16} {str(row['encoder']):<12} {str(row['preset']):<10} {row['runs']:>4} lần  "
+					  f"{_fmt(row['median_fps'], '.1f'):>7} fps  {_fmt(row['median_speed'], '.2f'):>6}x")
+		return 0
+	if args.json:
+		print(json.dumps([asdict(r) for r in reports], ensure_ascii=False, indent=2))
+	else:
+		for r in reports:
+			print(f"{r.started_at}  {r.status:<9} {os.path.basename(r.output or '-'):<28} {r.summary()}")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -2,12 +2,23 @@ import os
 import sys
 import subprocess
 import datetime
-from typing import List, Optional, Tuple
+import queue
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional
 
-from PyQt5 import QtWidgets, QtCore
+from PyQt5 import QtWidgets, QtCore, QtGui
 
-from processing import FFmpegPipelineBuilder, run_ffmpeg_with_progress
+from processing import FFmpegPipelineBuilder, RenderCancelled, Rendition, probe_inputs
 from delogo import DelogoPreset
+from mezzanine import normalized_builder
+from preview import render_preview_clip, render_preview_frame
+from ratecontrol import render_with_rate_control
+from render_cache import cached_render, render_mode
+from renditions import render_renditions
+from segments import default_segment_workers, render_segmented
+from smart_render import render_smart
 
 
 class LogTextEdit(QtWidgets.QPlainTextEdit):
@@ -21,6 +32,182 @@ class LogTextEdit(QtWidgets.QPlainTextEdit):
 		self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
 
 
+@dataclass
+class RenderJob:
+	builder: FFmpegPipelineBuilder
+	output_path: str
+	# >= 2: encode chia đoạn song song (segments.render_segmented)
+	segment_workers: int = 0
+	# Lưu từng khúc đã encode để job lỗi/bị hủy chạy lại tiếp được (segments.render_segmented)
+	resumable: bool = False
+	# Dùng lại output của job trùng input + tùy chọn (render_cache.py)
+	use_render_cache: bool = True
+	# Chuẩn hóa mỗi clip một lần, job sau dùng lại (mezzanine.py)
+	use_mezzanine: bool = False
+	# Chỉ encode lại vùng quanh transition (smart_render.py)
+	use_smart_render: bool = False
+
+
+class RenderWorker(QtCore.QThread):
+	"""Chạy lần lượt các job ffmpeg trong hàng đợi, ngoài luồng giao diện."""
+
+	progress = QtCore.pyqtSignal(int)
+	log_line = QtCore.pyqtSignal(str)
+	job_started = QtCore.pyqtSignal(str)
+	job_finished = QtCore.pyqtSignal(str)
+	job_failed = QtCore.pyqtSignal(str, str)
+	job_cancelled = QtCore.pyqtSignal(str)
+	queue_changed = QtCore.pyqtSignal(int)
+
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		self._jobs: "queue.Queue[Optional[RenderJob]]" = queue.Queue()
+		self._cancel_event = threading.Event()
+		self._running = False
+
+	def enqueue(self, job: RenderJob) -> None:
+		self._jobs.put(job)
+		self.queue_changed.emit(self.pending_count())
+
+	def pending_count(self) -> int:
+		return self._jobs.qsize() + (1 if self._running else 0)
+
+	def cancel_current(self) -> None:
+		self._cancel_event.set()
+
+	def cancel_all(self) -> None:
+		try:
+			while True:
+				job = self._jobs.get_nowait()
+				if job is not None:
+					job.builder.cleanup()
+		except queue.Empty:
+			pass
+		self._cancel_event.set()
+		self.queue_changed.emit(self.pending_count())
+
+	def stop(self) -> None:
+		self.cancel_all()
+		self._jobs.put(None)
+		self.wait()
+
+	def run(self):
+		while True:
+			job = self._jobs.get()
+			if job is None:
+				return
+			self._cancel_event.clear()
+			self._running = True
+			self.queue_changed.emit(self.pending_count())
+			try:
+				self._run_job(job)
+			finally:
+				job.builder.cleanup()
+				self._running = False
+				self.queue_changed.emit(self.pending_count())
+
+	def _run_job(self, job: RenderJob) -> None:
+		self.job_started.emit(job.output_path)
+		self.progress.emit(0)
+
+		def on_progress(pct: Optional[float], line: str):
+			if pct is not None:
+				self.progress.emit(int(max(0, min(100, pct))))
+			if line:
+				self.log_line.emit(line)
+
+		try:
+			def emit_notes(notes: List[str]) -> None:
+				for note in notes:
+					self.log_line.emit(note)
+
+			# build() có chạy ffprobe/OpenCV nên cũng phải nằm ngoài luồng giao diện
+			def render():
+				if job.builder.renditions:
+					# Các bản xuất thêm ra cùng tiến trình ffmpeg: không chia đoạn/smart render
+					target = job.builder
+					if job.use_mezzanine:
+						target = normalized_builder(job.builder, on_progress=on_progress, cancel_event=self._cancel_event)
+					try:
+						return render_renditions(target, on_progress=on_progress, cancel_event=self._cancel_event, on_notes=emit_notes)
+					finally:
+						if target is not job.builder:
+							target.cleanup()
+				if job.use_smart_render:
+					return render_smart(job.builder, job.output_path, on_progress=on_progress, cancel_event=self._cancel_event)
+				target = job.builder
+				if job.use_mezzanine:
+					target = normalized_builder(job.builder, on_progress=on_progress, cancel_event=self._cancel_event)
+				try:
+					if job.segment_workers >= 2 or job.resumable:
+						report = render_segmented(target, job.output_path, job.segment_workers, on_progress=on_progress,
+												  cancel_event=self._cancel_event, resume=job.resumable)
+						emit_notes(target.build_notes)
+						return report
+					return render_with_rate_control(target, job.output_path, on_progress=on_progress, cancel_event=self._cancel_event,
+													on_notes=emit_notes)
+				finally:
+					if target is not job.builder:
+						target.cleanup()
+
+			# Cache render chỉ lưu một file output
+			if job.use_render_cache and not job.builder.renditions:
+				mode = render_mode(job.use_smart_render, job.use_mezzanine, job.segment_workers, job.resumable)
+				report = cached_render(job.builder, job.output_path, render, on_progress=on_progress, mode=mode)
+			else:
+				report = render()
+			self.log_line.emit("Hiệu năng: " + report.summary())
+			self.progress.emit(100)
+			self.job_finished.emit(job.output_path)
+		except RenderCancelled:
+			self.job_cancelled.emit(job.output_path)
+		except FileNotFoundError:
+			self.job_failed.emit("Thiếu FFmpeg", "Không tìm thấy ffmpeg trong PATH. Vui lòng cài ffmpeg và mở lại ứng dụng.")
+		except subprocess.CalledProcessError as e:
+			self.log_line.emit(str(e))
+			for line in (e.stderr or "").splitlines()[-20:]:
+				self.log_line.emit(line)
+			self.job_failed.emit("Lỗi xử lý", "FFmpeg báo lỗi. Xem log để biết thêm chi tiết.")
+		except Exception as e:
+			self.job_failed.emit("Lỗi", str(e))
+
+
+class PreviewWorker(QtCore.QThread):
+	"""Chạy một lần xem trước (frame PNG hoặc clip proxy) ngoài luồng giao diện."""
+
+	frame_ready = QtCore.pyqtSignal(bytes)
+	clip_ready = QtCore.pyqtSignal(str)
+	failed = QtCore.pyqtSignal(str)
+
+	def __init__(self, task: Callable[[], object], parent=None):
+		super().__init__(parent)
+		self._task = task
+
+	def run(self):
+		try:
+			result = self._task()
+		except subprocess.CalledProcessError as e:
+			tail = (e.stderr or "").strip().splitlines()[-3:]
+			self.failed.emit("FFmpeg báo lỗi khi xem trước: " + " | ".join(tail))
+			return
+		except Exception as e:
+			self.failed.emit(str(e))
+			return
+		if isinstance(result, bytes):
+			self.frame_ready.emit(result)
+		else:
+			self.clip_ready.emit(str(result))
+
+
+def _open_with_system_player(path: str) -> None:
+	if sys.platform.startswith("win"):
+		os.startfile(path)  # type: ignore[attr-defined]
+	elif sys.platform == "darwin":
+		subprocess.Popen(["open", path])
+	else:
+		subprocess.Popen(["xdg-open", path])
+
+
 class VideoToolUI(QtWidgets.QWidget):
 	def __init__(self):
 		super().__init__()
@@ -44,7 +231,7 @@ class VideoToolUI(QtWidgets.QWidget):
 		self.chk_loop_if_single = QtWidgets.QCheckBox("Nếu chỉ 1 video → tự động lặp lại để đủ thời lượng")
 		self.chk_loop_if_single.setChecked(True)
 
-		self.grp_transition = QtWidgets.QGroupBox("Transition giữa 2 clip")
+		self.grp_transition = QtWidgets.QGroupBox("Transition giữa các clip")
 		self.cmb_transition = QtWidgets.QComboBox()
 		self.cmb_transition.addItems([
 			"Không", 
@@ -182,6 +369,12 @@ class VideoToolUI(QtWidgets.QWidget):
 		self.grp_export = QtWidgets.QGroupBox("Xuất file")
 		self.cmb_codec = QtWidgets.QComboBox(); self.cmb_codec.addItems(["H.264", "H.265"]) 
 		self.spin_bitrate = QtWidgets.QSpinBox(); self.spin_bitrate.setRange(2, 50); self.spin_bitrate.setValue(12); self.spin_bitrate.setSuffix(" Mbps")
+		self.spin_bitrate.setToolTip("Trần bitrate (chế độ CRF)")
+		self.cmb_rate_control = QtWidgets.QComboBox(); self.cmb_rate_control.addItems(["CRF (trần bitrate)", "Dung lượng mục tiêu (2 lượt)"])
+		self.spin_target_size = QtWidgets.QSpinBox(); self.spin_target_size.setRange(1, 100000); self.spin_target_size.setValue(500); self.spin_target_size.setSuffix(" MB")
+		self.spin_target_size.setToolTip("Dung lượng file ra; bitrate tính theo tổng thời lượng các clip")
+		self.spin_target_size.setEnabled(False)
+		self.cmb_rate_control.currentIndexChanged.connect(lambda i: self.spin_target_size.setEnabled(i == 1))
 		self.chk_keep_audio = QtWidgets.QCheckBox("Giữ âm thanh gốc (nếu có)")
 		self.chk_keep_audio.setChecked(True)
 		self.chk_mute_all = QtWidgets.QCheckBox("Tắt tất cả âm thanh")
@@ -190,14 +383,23 @@ class VideoToolUI(QtWidgets.QWidget):
 		self.chk_reencode_metadata.setChecked(True)
 		self.chk_hide_qr = QtWidgets.QCheckBox("Ẩn QR code (blur vùng góc)")
 		self.chk_hide_qr.setChecked(False)
+		self.chk_extra_1080 = QtWidgets.QCheckBox("Xuất thêm bản 1080p (_1080p.mp4)")
+		self.chk_extra_720 = QtWidgets.QCheckBox("Xuất thêm bản 720p (_720p.mp4)")
+		for chk in (self.chk_extra_1080, self.chk_extra_720):
+			chk.setChecked(False)
+			chk.setToolTip("Cùng một lần giải mã + filter, chỉ thêm bước scale và encoder cho mỗi bản")
 		self.btn_save_as = QtWidgets.QPushButton("Chọn nơi lưu (Save As)...")
 		export_form = QtWidgets.QFormLayout()
 		export_form.addRow("Codec:", self.cmb_codec)
 		export_form.addRow("Bitrate:", self.spin_bitrate)
+		export_form.addRow("Điều khiển bitrate:", self.cmb_rate_control)
+		export_form.addRow("Dung lượng mục tiêu:", self.spin_target_size)
 		export_form.addRow(self.chk_keep_audio)
 		export_form.addRow(self.chk_mute_all)
 		export_form.addRow(self.chk_reencode_metadata)
 		export_form.addRow(self.chk_hide_qr)
+		export_form.addRow(self.chk_extra_1080)
+		export_form.addRow(self.chk_extra_720)
 		export_form.addRow(self.btn_save_as)
 		self.grp_export.setLayout(export_form)
 
@@ -215,21 +417,72 @@ class VideoToolUI(QtWidgets.QWidget):
 		self.spin_filter_threads.setToolTip("Luồng filter; 0 = để FFmpeg tự chọn")
 		self.chk_faststart = QtWidgets.QCheckBox("-movflags +faststart (tối ưu phát trực tuyến)")
 		self.chk_faststart.setChecked(True)
+		self.chk_stream_copy = QtWidgets.QCheckBox("Ghép nhanh không encode lại (stream copy) khi input đồng nhất")
+		self.chk_stream_copy.setChecked(True)
+		self.chk_stream_copy.setToolTip("Chỉ dùng khi mọi input cùng codec/2160x3840/fps/pixel format và không bật filter cần xử lý pixel")
+		self.chk_render_cache = QtWidgets.QCheckBox("Dùng lại kết quả đã render (cùng video + cùng tùy chọn)")
+		self.chk_render_cache.setChecked(True)
+		self.chk_mezzanine = QtWidgets.QCheckBox("Lưu bản chuẩn hóa từng clip (đổi thứ tự/transition/bitrate không phải xử lý lại)")
+		self.chk_mezzanine.setChecked(False)
+		self.chk_mezzanine.setToolTip("Tốn thêm dung lượng đĩa (cache tối đa 50 GB); lần đầu chậm hơn một chút, các lần sau nhanh hơn nhiều")
+		self.chk_smart_render = QtWidgets.QCheckBox("Smart render: chỉ encode lại vùng transition (đổi transition/thứ tự clip gần như tức thì)")
+		self.chk_smart_render.setChecked(False)
+		self.chk_smart_render.setToolTip("Lần đầu mỗi clip được encode một lần theo tùy chọn xuất; các lần sau chỉ encode vài giây quanh mỗi transition")
+		self.chk_resumable = QtWidgets.QCheckBox("Render có thể tiếp tục (lỗi/hủy/tắt máy giữa chừng: chạy lại chỉ encode phần còn thiếu)")
+		self.chk_resumable.setChecked(False)
+		self.chk_resumable.setToolTip("Encode theo từng khúc ~60 giây, lưu cạnh file output; chạy lại cùng job, cùng tùy chọn, cùng file output để tiếp tục")
+		self.spin_segment_workers = QtWidgets.QSpinBox(); self.spin_segment_workers.setRange(0, 16)
+		# Mặc định tắt như batch (segment_workers = 0): output chia khúc có GOP đóng tại mỗi điểm cắt
+		self.spin_segment_workers.setValue(0)
+		self.spin_segment_workers.setToolTip("Chia timeline thành nhiều khúc và encode song song (máy nhiều nhân); 0 = render một lượt. "
+											 f"Gợi ý cho máy này: {max(2, default_segment_workers())}")
 		perf_form = QtWidgets.QFormLayout()
 		# perf_form.addRow(self.chk_use_nvenc)
 		# perf_form.addRow(self.chk_hwaccel)
 		perf_form.addRow("Encoder preset:", self.cmb_preset)
 		perf_form.addRow("Threads:", self.spin_threads)
 		perf_form.addRow("Filter threads:", self.spin_filter_threads)
+		perf_form.addRow("Encode song song (tiến trình):", self.spin_segment_workers)
 		perf_form.addRow(self.chk_faststart)
+		perf_form.addRow(self.chk_stream_copy)
+		perf_form.addRow(self.chk_render_cache)
+		perf_form.addRow(self.chk_mezzanine)
+		perf_form.addRow(self.chk_smart_render)
+		perf_form.addRow(self.chk_resumable)
 		self.grp_perf.setLayout(perf_form)
 
+		self.grp_preview = QtWidgets.QGroupBox("Xem trước nhanh (540x960)")
+		self.spin_preview_time = QtWidgets.QDoubleSpinBox()
+		self.spin_preview_time.setRange(0.0, 36000.0); self.spin_preview_time.setDecimals(1); self.spin_preview_time.setValue(1.0)
+		self.spin_preview_time.setSuffix(" s")
+		self.btn_preview_frame = QtWidgets.QPushButton("Xem khung hình")
+		self.btn_preview_clip = QtWidgets.QPushButton("Xem trước 3 giây")
+		self.btn_preview_clip.setToolTip("Render 3 giây từ thời điểm đã chọn ở độ phân giải thấp rồi mở bằng trình phát mặc định")
+		self.lbl_preview = QtWidgets.QLabel("Chưa có ảnh xem trước")
+		self.lbl_preview.setAlignment(QtCore.Qt.AlignCenter)
+		self.lbl_preview.setMinimumHeight(320)
+		preview_btns = QtWidgets.QHBoxLayout()
+		preview_btns.addWidget(QtWidgets.QLabel("Thời điểm:"))
+		preview_btns.addWidget(self.spin_preview_time)
+		preview_btns.addWidget(self.btn_preview_frame)
+		preview_btns.addWidget(self.btn_preview_clip)
+		preview_layout = QtWidgets.QVBoxLayout()
+		preview_layout.addLayout(preview_btns)
+		preview_layout.addWidget(self.lbl_preview, 1)
+		self.grp_preview.setLayout(preview_layout)
+		self._preview_worker: Optional[PreviewWorker] = None
+
 		self.progress = QtWidgets.QProgressBar()
 		self.progress.setRange(0, 100)
 		self.txt_log = LogTextEdit()
 
 		self.btn_start = QtWidgets.QPushButton("Bắt đầu xử lý")
 		self.btn_start.setStyleSheet("font-weight: bold")
+		self.btn_cancel = QtWidgets.QPushButton("Hủy job đang chạy")
+		self.btn_cancel.setEnabled(False)
+		self.btn_cancel_all = QtWidgets.QPushButton("Hủy tất cả")
+		self.btn_cancel_all.setEnabled(False)
+		self.lbl_queue = QtWidgets.QLabel("Hàng đợi: 0")
 
 		# Layout
 		left_col = QtWidgets.QVBoxLayout()
@@ -242,6 +495,7 @@ class VideoToolUI(QtWidgets.QWidget):
 		rm_btns.addWidget(self.btn_remove_selected)
 		rm_btns.addWidget(self.btn_clear)
 		left_col.addLayout(rm_btns)
+		left_col.addWidget(self.grp_preview, 2)
 
 		# Right column with scroll area
 		right_scroll = QtWidgets.QScrollArea()
@@ -268,7 +522,12 @@ class VideoToolUI(QtWidgets.QWidget):
 		bottom = QtWidgets.QVBoxLayout()
 		bottom.addWidget(self.progress)
 		bottom.addWidget(self.txt_log, 1)
-		bottom.addWidget(self.btn_start)
+		run_btns = QtWidgets.QHBoxLayout()
+		run_btns.addWidget(self.btn_start, 1)
+		run_btns.addWidget(self.btn_cancel)
+		run_btns.addWidget(self.btn_cancel_all)
+		run_btns.addWidget(self.lbl_queue)
+		bottom.addLayout(run_btns)
 
 		root = QtWidgets.QVBoxLayout(self)
 		root.addLayout(top, 3)
@@ -282,7 +541,22 @@ class VideoToolUI(QtWidgets.QWidget):
 		self.btn_save_as.clicked.connect(self.on_save_as)
 		self.btn_select_lut.clicked.connect(self.on_select_lut)
 		self.btn_start.clicked.connect(self.on_start)
+		self.btn_cancel.clicked.connect(self.on_cancel)
+		self.btn_cancel_all.clicked.connect(self.on_cancel_all)
 		self.chk_auto_mode.toggled.connect(self.on_auto_mode_toggled)
+		self.btn_preview_frame.clicked.connect(self.on_preview_frame)
+		self.btn_preview_clip.clicked.connect(self.on_preview_clip)
+
+		# Render worker (chạy ffmpeg ngoài luồng giao diện)
+		self.worker = RenderWorker(self)
+		self.worker.progress.connect(self.progress.setValue)
+		self.worker.log_line.connect(self.log)
+		self.worker.job_started.connect(self.on_job_started)
+		self.worker.job_finished.connect(self.on_job_finished)
+		self.worker.job_failed.connect(self.on_job_failed)
+		self.worker.job_cancelled.connect(self.on_job_cancelled)
+		self.worker.queue_changed.connect(self.on_queue_changed)
+		self.worker.start()
 
 	def log(self, msg: str) -> None:
 		self.txt_log.append_line(msg)
@@ -306,6 +580,7 @@ class VideoToolUI(QtWidgets.QWidget):
 			self.cmb_preset.setCurrentText("fast")
 			self.cmb_codec.setCurrentText("H.264")
 			self.spin_bitrate.setValue(12)
+			self.cmb_rate_control.setCurrentIndex(0)
 			self.chk_mute_all.setChecked(True)
 			self.chk_reencode_metadata.setChecked(True)  # Bật re-encode metadata
 			self.chk_hide_qr.setChecked(False)  # Tắt QR blur mặc định
@@ -330,6 +605,8 @@ class VideoToolUI(QtWidgets.QWidget):
 				if f not in self.input_files:
 					self.input_files.append(f)
 					self.list_inputs.addItem(f)
+			# Probe cả thư mục song song ở nền để lúc bắt đầu xử lý chỉ còn đọc cache
+			threading.Thread(target=probe_inputs, args=(items,), daemon=True).start()
 
 	def on_remove_selected(self):
 		for item in self.list_inputs.selectedItems():
@@ -360,13 +637,12 @@ class VideoToolUI(QtWidgets.QWidget):
 			self.lut_path_label.setStyleSheet("color: green; font-weight: bold;")
 			self.log(f"Đã chọn LUT: {filename}")
 
-	def build_pipeline(self) -> Tuple[List[str], Optional[float]]:
+	def build_pipeline(self) -> RenderJob:
 		if not self.input_files:
 			raise RuntimeError("Vui lòng chọn ít nhất 1 video")
 
 		inputs = list(self.input_files)
-		if len(inputs) == 1 and self.chk_loop_if_single.isChecked():
-			inputs.append(inputs[0])
+		loop_single = len(inputs) == 1 and self.chk_loop_if_single.isChecked()
 
 		# Export options
 		use_h265 = (self.cmb_codec.currentText() == "H.265")
@@ -416,10 +692,9 @@ class VideoToolUI(QtWidgets.QWidget):
 		faststart = self.chk_faststart.isChecked()
 
 		# Build
-		if auto_mode:
-			self.log("🎯 Đang sử dụng CHẾ ĐỘ AUTO - Tất cả settings đã được tối ưu!")
-		
 		builder = FFmpegPipelineBuilder(inputs)
+		if loop_single:
+			builder.set_loop(2)
 		builder.set_target_vertical_4k(force_9_16)
 		builder.set_fps60(force_60)
 		builder.set_quality_filters(use_sharpen=use_sharpen, use_color=use_color)
@@ -437,60 +712,126 @@ class VideoToolUI(QtWidgets.QWidget):
 			preset_dl = DelogoPreset.from_vn_name(delogo_preset)
 			builder.set_delogo(preset=preset_dl, box_size=(delogo_w, delogo_h), margin=delogo_margin)
 
-		if transition != "Không" and len(inputs) == 2:
+		if transition != "Không" and (len(inputs) >= 2 or loop_single):
 			builder.set_transition(transition, trans_dur, smooth_transition)
 
 		builder.set_export(hevc=use_h265, bitrate_mbps=bitrate_mbps, keep_audio=(False if mute_all else keep_audio), reencode_metadata=reencode_metadata, hide_qr=hide_qr)
 		builder.set_performance(use_nvenc=False, preset=preset, threads=threads, faststart=faststart)  # Tắt NVENC
+		builder.set_stream_copy(self.chk_stream_copy.isChecked())
+		if self.cmb_rate_control.currentIndex() == 1:
+			builder.set_rate_control("target_size", float(self.spin_target_size.value()))
 
-		cmd = builder.build()
-		# append output
 		if self.output_path:
-			cmd = cmd + [self.output_path]
+			out_path = self.output_path
 		else:
-			now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-			cmd = cmd + [os.path.join(os.getcwd(), f"output_{now}.mp4")]
-		return cmd, None
+			now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+			out_path = os.path.join(os.getcwd(), f"output_{now}.mp4")
+		extras = [side for side, chk in ((1080, self.chk_extra_1080), (720, self.chk_extra_720)) if chk.isChecked()]
+		if extras:
+			root, ext = os.path.splitext(out_path)
+			builder.set_renditions([Rendition(out_path)] + [Rendition(f"{root}_{side}p{ext}", short_side=side) for side in extras])
+		return RenderJob(builder=builder, output_path=out_path, segment_workers=int(self.spin_segment_workers.value()),
+						 use_render_cache=self.chk_render_cache.isChecked(), use_mezzanine=self.chk_mezzanine.isChecked(),
+						 use_smart_render=self.chk_smart_render.isChecked(), resumable=self.chk_resumable.isChecked())
 
 	def on_start(self):
 		try:
-			cmd, total_secs = self.build_pipeline()
-
-			self.progress.setValue(0)
-			self.txt_log.clear()
-			self.btn_start.setEnabled(False)
-
-			def on_progress(pct: Optional[float], line: str):
-				if pct is not None:
-					self.progress.setValue(int(max(0, min(100, pct))))
-				if line:
-					self.log(line)
+			job = self.build_pipeline()
+		except Exception as e:
+			QtWidgets.QMessageBox.critical(self, "Lỗi", str(e))
+			return
+		if self.chk_auto_mode.isChecked():
+			self.log("🎯 Đang sử dụng CHẾ ĐỘ AUTO - Tất cả settings đã được tối ưu!")
+		self.worker.enqueue(job)
+		self.log(f"Đã thêm vào hàng đợi: {job.output_path}")
+		# Auto clear input list to chọn 2 video mới dễ hơn
+		self.list_inputs.clear()
+		self.input_files = []
+		self.output_path = None
+		# Reset LUT
+		self.lut_path = None
+		self.lut_path_label.setText("Chưa chọn LUT")
+		self.lut_path_label.setStyleSheet("color: gray; font-style: italic;")
 
-			QtCore.QTimer.singleShot(50, lambda: self._run_cmd(cmd, total_secs, on_progress))
+	def _start_preview(self, task: Callable[[], object]) -> None:
+		if self._preview_worker is not None and self._preview_worker.isRunning():
+			return  # bỏ qua khi lần xem trước trước đó chưa xong
+		worker = PreviewWorker(task, self)
+		worker.frame_ready.connect(self.on_preview_frame_ready)
+		worker.clip_ready.connect(self.on_preview_clip_ready)
+		worker.failed.connect(lambda msg: self.log(f"Xem trước lỗi: {msg}"))
+		worker.finished.connect(lambda: self.btn_preview_frame.setEnabled(True))
+		worker.finished.connect(lambda: self.btn_preview_clip.setEnabled(True))
+		self.btn_preview_frame.setEnabled(False)
+		self.btn_preview_clip.setEnabled(False)
+		self._preview_worker = worker
+		worker.start()
+
+	def on_preview_frame(self):
+		try:
+			builder = self.build_pipeline().builder
 		except Exception as e:
 			QtWidgets.QMessageBox.critical(self, "Lỗi", str(e))
+			return
+		t = float(self.spin_preview_time.value())
+		self._start_preview(lambda: render_preview_frame(builder, t))
 
-	def _run_cmd(self, cmd: List[str], total_secs: Optional[float], cb):
+	def on_preview_clip(self):
 		try:
-			run_ffmpeg_with_progress(cmd, total_duration_hint=total_secs, on_progress=cb)
-			self.progress.setValue(100)
-			out_path = cmd[-1] if cmd and not cmd[-1].startswith("-") else ""
-			self.log(f"Hoàn tất! Đã lưu: {out_path}")
-			# Auto clear input list to chọn 2 video mới dễ hơn
-			self.list_inputs.clear()
-			self.input_files = []
-			self.output_path = None
-			# Reset LUT
-			self.lut_path = None
-			self.lut_path_label.setText("Chưa chọn LUT")
-			self.lut_path_label.setStyleSheet("color: gray; font-style: italic;")
-		except FileNotFoundError:
-			QtWidgets.QMessageBox.critical(self, "Thiếu FFmpeg", "Không tìm thấy ffmpeg trong PATH. Vui lòng cài ffmpeg và mở lại ứng dụng.")
-		except subprocess.CalledProcessError as e:
-			self.log(str(e))
-			QtWidgets.QMessageBox.critical(self, "Lỗi xử lý", "FFmpeg báo lỗi. Xem log để biết thêm chi tiết.")
-		finally:
-			self.btn_start.setEnabled(True)
+			builder = self.build_pipeline().builder
+		except Exception as e:
+			QtWidgets.QMessageBox.critical(self, "Lỗi", str(e))
+			return
+		t = float(self.spin_preview_time.value())
+		path = os.path.join(tempfile.gettempdir(), "veo3_preview.mp4")
+
+		def task():
+			render_preview_clip(builder, path, start=t, duration=3.0)
+			return path
+		self._start_preview(task)
+
+	def on_preview_frame_ready(self, png: bytes):
+		pix = QtGui.QPixmap()
+		pix.loadFromData(png, "PNG")
+		self.lbl_preview.setPixmap(pix.scaled(self.lbl_preview.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
+
+	def on_preview_clip_ready(self, path: str):
+		self.log(f"Đã render bản xem trước: {path}")
+		try:
+			_open_with_system_player(path)
+		except OSError as e:
+			self.log(f"Không mở được trình phát: {e}")
+
+	def on_cancel(self):
+		self.worker.cancel_current()
+
+	def on_cancel_all(self):
+		self.worker.cancel_all()
+
+	def on_job_started(self, out_path: str):
+		self.progress.setValue(0)
+		self.txt_log.clear()
+		self.log(f"Đang xử lý: {out_path}")
+
+	def on_job_finished(self, out_path: str):
+		self.log(f"Hoàn tất! Đã lưu: {out_path}")
+
+	def on_job_failed(self, title: str, message: str):
+		self.log(message)
+		QtWidgets.QMessageBox.critical(self, title, message)
+
+	def on_job_cancelled(self, out_path: str):
+		self.progress.setValue(0)
+		self.log(f"Đã hủy: {out_path}")
+
+	def on_queue_changed(self, pending: int):
+		self.lbl_queue.setText(f"Hàng đợi: {pending}")
+		self.btn_cancel.setEnabled(pending > 0)
+		self.btn_cancel_all.setEnabled(pending > 0)
+
+	def closeEvent(self, event):
+		self.worker.stop()
+		super().closeEvent(event)
 
 
 def main():
@@ -0,0 +1,209 @@
+"""Cache bản chuẩn hóa (mezzanine) của từng clip: scale/pad/fps/sharpen/màu/hiệu ứng chỉ chạy một lần.
+
+Mỗi clip nguồn được render một lần qua đúng chuỗi _clip_pre_filter() của job (canvas, fps,
+unsharp, eq, cinematic/LUT, zoom bỏ logo) ra một file H.264 chất lượng rất cao (CRF thấp,
+GOP 1 giây để seek nhanh khi encode chia đoạn). Job sau chỉ còn ghép transition, che
+logo/QR và encode từ các mezzanine: đổi thứ tự clip, kiểu/thời lượng transition hay
+bitrate xuất không phải chuẩn hóa lại.
+
+Bản "smart" (smart=True, dùng cho smart_render.py) đã che sẵn logo/QR, ở đúng fps output và
+được encode bằng chính encoder xuất của job (không B-frame, GOP 1 giây): các đoạn không dính
+transition chép thẳng vào output được.
+
+Khóa của một mezzanine = dấu vân tay nội dung clip + chuỗi filter chuẩn hóa (đã gồm canvas,
+fps, hiệu ứng, góc zoom) + nội dung LUT + tham số encode mezzanine + phiên bản ffmpeg.
+Lưu trong app_cache_dir("mezzanine") bằng RenderCache (giới hạn dung lượng, LRU).
+"""
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app_paths import app_cache_dir
+from capabilities import detect_capabilities
+from processing import FFmpegPipelineBuilder, _FFMPEG_BIN, run_ffmpeg_with_progress
+from render_cache import RenderCache, content_fingerprint
+from segments import default_segment_workers
+
+# Tăng khi đổi cách tính khóa hoặc định dạng mezzanine
+MEZZANINE_SCHEMA = 1
+DEFAULT_MAX_BYTES = int(float(os.environ.get("VEO3_MEZZANINE_CACHE_GB", "50")) * 1024 ** 3)
+# Gần như không mất mát sau một lần encode lại. ultrafast (không CABAC/deblock) file lớn hơn
+# ~2.4 lần veryfast nhưng tạo nhanh gấp đôi và giải mã nhanh gấp ~1.7 lần (1080x1920, 1 nhân):
+# giải mã mezzanine là phần mỗi job sau phải trả, thay cho chuỗi chuẩn hóa
+MEZZANINE_VIDEO_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "12", "-pix_fmt", "yuv420p"]
+# Codec audio đưa thẳng vào MP4 được; codec khác encode lại AAC bitrate cao
+_COPY_AUDIO_CODECS = {"aac", "mp3", "alac", "ac3", "eac3"}
+
+_default_cache: Optional[RenderCache] = None
+
+
+def default_mezzanine_cache() -> RenderCache:
+	global _default_cache
+	if _default_cache is None:
+		_default_cache = RenderCache(app_cache_dir("mezzanine"), DEFAULT_MAX_BYTES)
+	return _default_cache
+
+
+def _mezzanine_fps(builder: FFmpegPipelineBuilder, clip: str, smart: bool = False) -> Tuple[Optional[float], Optional[float]]:
+	"""(fps gốc, fps của mezzanine). Nâng fps chỉ nhân bản frame nên để bước ghép làm:
+	mezzanine giữ fps gốc, nhỏ hơn và giải mã nhanh hơn (trừ bản smart, phải đúng fps output)."""
+	info = builder._probe(clip)
+	src_fps = info.fps if info and info.fps else None
+	out_fps = builder._out_fps()
+	if out_fps and src_fps and src_fps < out_fps and not smart:
+		return src_fps, src_fps
+	return src_fps, out_fps or src_fps
+
+
+def _clip_filter(builder: FFmpegPipelineBuilder, clip: str, smart: bool = False) -> str:
+	src_fps, mezz_fps = _mezzanine_fps(builder, clip, smart)
+	if mezz_fps != builder._out_fps():
+		builder = copy.copy(builder)
+		builder.force_fps60 = False
+	pre_base, corner_for_zoom = builder._clip_pre_filter(src_fps)
+	if smart:
+		# Che logo/QR từng clip trước xfade (delogo/boxblur là phép tuyến tính theo pixel: gần như
+		# không khác che sau xfade)
+		region_expr = builder._region_blur_expression(include_logo=not corner_for_zoom)
+		if region_expr:
+			pre_base = f"{pre_base},{region_expr}"
+	return pre_base
+
+
+def smart_gop_args(fps: float) -> List[str]:
+	"""GOP 1 giây, không B-frame: thứ tự giải mã trùng thứ tự hiển thị, cắt/chép tại keyframe
+	chính xác tới từng frame (mezzanine smart và các khúc smart_render encode lại)."""
+	return ["-g", str(max(1, int(round(fps)))), "-bf", "0"]
+
+
+def mezzanine_video_args(builder: FFmpegPipelineBuilder, clip: str, smart: bool = False) -> List[str]:
+	"""Tham số encoder video của mezzanine (kèm GOP 1 giây)."""
+	fps = _mezzanine_fps(builder, clip, smart)[1] or 30.0
+	if smart:
+		return builder._video_encoder_args() + smart_gop_args(fps)
+	return MEZZANINE_VIDEO_ARGS + ["-g", str(max(1, int(round(fps))))]
+
+
+def mezzanine_key(builder: FFmpegPipelineBuilder, clip: str, smart: bool = False) -> Optional[str]:
+	"""Khóa cache bản chuẩn hóa của clip theo tùy chọn của builder; None nếu không đọc được clip/LUT."""
+	fp = content_fingerprint(clip)
+	caps = detect_capabilities(_FFMPEG_BIN)
+	if fp is None or caps is None:
+		return None
+	payload = {
+		"schema": MEZZANINE_SCHEMA,
+		"clip": fp,
+		"filter": _clip_filter(builder, clip, smart),
+		"lut": content_fingerprint(builder.lut_path) if builder.use_lut and builder.lut_path else None,
+		"encoder": mezzanine_video_args(builder, clip, smart),
+		"keep_audio": builder.keep_audio,
+		"ffmpeg": caps.version,
+	}
+	text = json.dumps(payload, sort_keys=True, ensure_ascii=True)
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalize_command(builder: FFmpegPipelineBuilder, clip: str, output_path: str, smart: bool = False) -> List[str]:
+	info = builder._probe(clip)
+	cmd = [_FFMPEG_BIN, "-y"]
+	if builder.hwaccel_decode:
+		cmd.extend(["-hwaccel", "cuda"])
+	cmd.extend(["-i", clip, "-map", "0:v:0", "-vf", _clip_filter(builder, clip, smart)])
+	cmd.extend(mezzanine_video_args(builder, clip, smart))
+	if builder.keep_audio and info and info.has_audio:
+		cmd.extend(["-map", "0:a:0"])
+		if info.audio_codec in _COPY_AUDIO_CODECS:
+			cmd.extend(["-c:a", "copy"])
+		else:
+			cmd.extend(["-c:a", "aac", "-b:a", "320k"])
+	cmd.extend(["-map_metadata", "-1", output_path])
+	return cmd
+
+
+def normalized_builder(builder: FFmpegPipelineBuilder, cache: Optional[RenderCache] = None, on_progress=None,
+					   cancel_event: Optional[threading.Event] = None, smart: bool = False) -> FFmpegPipelineBuilder:
+	"""Bản sao builder đọc từ mezzanine của từng clip (tạo những bản còn thiếu trước).
+
+	Trả về chính builder nếu không cần/không dùng được mezzanine (job ghép bằng stream copy,
+	ffmpeg không có libx264, không đọc được clip). Bản sao có thể dùng như builder gốc:
+	build(), windowed(), render_segmented().
+	"""
+	def note(line: str) -> None:
+		# build() xóa build_notes nên thông báo đi qua on_progress như một dòng log
+		if on_progress:
+			on_progress(None, line)
+
+	builder.prefetch_probes()
+	if builder.allow_stream_copy and not builder._stream_copy_blockers():
+		return builder
+	caps = detect_capabilities(_FFMPEG_BIN)
+	if caps is None or not caps.has_encoder("libx264"):
+		note("Bản ffmpeg không có libx264: không dùng cache mezzanine")
+		return builder
+	# Cùng điều chỉnh như build() (CUDA, NVENC quyết định có zoom hay không) trước khi tính chuỗi filter
+	builder._apply_capabilities()
+	cache = cache or default_mezzanine_cache()
+	clips = list(dict.fromkeys(builder.input_files))
+	keys: Dict[str, str] = {}
+	for clip in clips:
+		key = mezzanine_key(builder, clip, smart)
+		if key is None:
+			return builder
+		keys[clip] = key
+
+	missing = [c for c in clips if cache.lookup(keys[c]) is None]
+	if missing:
+		durs = {c: (builder._probe_duration(c) or 1.0) for c in missing}
+		pcts = {c: 0.0 for c in missing}
+		lock = threading.Lock()
+
+		def normalize(clip: str) -> None:
+			def clip_progress(pct: Optional[float], line: str) -> None:
+				if pct is None or on_progress is None:
+					return
+				with lock:
+					pcts[clip] = pct
+					total = sum(pcts[c] * durs[c] for c in missing) / sum(durs.values())
+				on_progress(total, f"Chuẩn hóa {len(missing)} clip (mezzanine): {line}")
+
+			fd, tmp = tempfile.mkstemp(prefix=f"{keys[clip][:16]}_", suffix=".part.mp4", dir=cache.root)
+			os.close(fd)
+			try:
+				cmd = _normalize_command(builder, clip, tmp, smart)
+				run_ffmpeg_with_progress(cmd, durs[clip], clip_progress, cancel_event=cancel_event, record_history=False)
+				cache.store(keys[clip], tmp)
+			finally:
+				if os.path.exists(tmp):
+					os.remove(tmp)
+
+		with ThreadPoolExecutor(max_workers=min(len(missing), default_segment_workers())) as pool:
+			for future in [pool.submit(normalize, c) for c in missing]:
+				future.result()
+
+	paths = {c: cache.lookup(keys[c]) for c in clips}
+	if any(p is None for p in paths.values()):
+		# Cache quá nhỏ so với tổng dung lượng mezzanine của job: mục vừa tạo đã bị xóa
+		note("Cache mezzanine không đủ chỗ cho cả job: chuẩn hóa trực tiếp khi render")
+		return builder
+
+	sub = copy.copy(builder)
+	# Góc logo dò trên file gốc (mezzanine đã qua zoom/scale, không dò lại được)
+	if builder.delogo_preset and builder.delogo_preset.name == "auto" and builder.delogo_box_size:
+		sub.delogo_box_override = builder._auto_delogo_box(builder.delogo_box_size)
+	sub.input_files = [paths[c] for c in builder.input_files]
+	sub.normalized_inputs = True
+	if smart:
+		# Logo/QR đã che trong mezzanine
+		sub.delogo_preset = None
+		sub.hide_qr = False
+	# Mezzanine có bitrate rất cao: luôn encode lại theo tùy chọn xuất
+	sub.allow_stream_copy = False
+	sub.build_notes = []
+	sub._temp_files = []
+	note(f"Mezzanine: dùng lại {len(clips) - len(missing)}/{len(clips)} clip đã chuẩn hóa, tạo mới {len(missing)}")
+	return sub
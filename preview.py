@@ -0,0 +1,97 @@
+"""Xem trước nhanh: render đúng filter graph của job ở độ phân giải proxy.
+
+Chỉnh vị trí delogo, zoom, LUT hay hiệu ứng cinematic không cần render 4K cả video:
+bản proxy dùng cùng chuỗi filter (scale/pad/zoom/delogo/QR/hiệu ứng/xfade) nhưng canvas
+540x960, 30 fps, libx264 ultrafast, và chỉ một đoạn ngắn của timeline (mỗi clip được
+seek bằng -ss/-t như encode chia đoạn, xem FFmpegPipelineBuilder.windowed()).
+Tọa độ vùng logo/QR được thu nhỏ theo canvas nên vị trí giống hệt bản 4K.
+
+Khác bản render thật: không có audio, hiệu ứng theo pixel (unsharp, noise, boxblur)
+giữ tham số gốc nên trông mạnh hơn một chút ở độ phân giải thấp.
+"""
+import subprocess
+import threading
+from typing import List, Optional, Tuple
+
+from history import RenderReport
+from processing import FFmpegPipelineBuilder, run_ffmpeg_with_progress
+
+
+PROXY_SIZE: Tuple[int, int] = (540, 960)
+PROXY_FPS = 30.0
+
+
+def preview_window(builder: FFmpegPipelineBuilder, start: float, duration: float) -> Tuple[List[Tuple[str, float, float]], float, float]:
+	"""(các cửa sổ clip, đầu đoạn, cuối đoạn) cần render để thấy [start, start + duration) của output.
+
+	Đoạn được nới ra cho trọn các transition nó cắt ngang (xfade cần đủ T giây của cả hai
+	clip); không có transition thì đoạn nằm gọn trong clip chứa start.
+	"""
+	layout = builder.timeline_offsets()
+	clips = builder.timeline()
+	if not layout or not clips:
+		raise ValueError("Không đọc được thời lượng các clip để xem trước")
+	offsets, total, tran = layout
+	start = min(max(0.0, start), max(0.0, total - 0.05))
+	end = min(total, start + max(0.05, duration))
+	if builder.uses_transitions():
+		for k in range(1, len(clips)):
+			lo, hi = offsets[k], offsets[k] + tran
+			if lo < start < hi:
+				start = lo
+			if lo < end < hi:
+				end = hi
+	else:
+		k = max(i for i, off in enumerate(offsets) if off <= start + 1e-6)
+		end = min(end, offsets[k] + clips[k][1])
+	return builder.window_clips(start, end), start, end
+
+
+def proxy_builder(builder: FFmpegPipelineBuilder, start: float, duration: float,
+				  size: Tuple[int, int] = PROXY_SIZE, fps: float = PROXY_FPS) -> Tuple[FFmpegPipelineBuilder, float, float]:
+	"""Bản sao builder render đoạn [start, start + duration) ở canvas size; kèm (đầu, cuối) đoạn thực tế."""
+	windows, a, b = preview_window(builder, start, duration)
+	tran = builder.timeline_offsets()[2] if builder.uses_transitions() else None
+	sub = builder.windowed(windows, tran)
+	sub.canvas_size = size
+	sub.target_fps = fps
+	sub.use_nvenc = False
+	sub.use_hevc = False
+	sub.encoder_preset = "ultrafast"
+	sub.bitrate_mbps = 2
+	sub.rate_control = "crf"
+	# Khởi tạo CUDA tốn thời gian hơn cả việc giải mã vài giây video
+	sub.hwaccel_decode = False
+	sub.faststart = False
+	sub.threads = 0
+	sub.filter_threads = 0
+	return sub, a, b
+
+
+def render_preview_clip(builder: FFmpegPipelineBuilder, output_path: str, start: float = 0.0, duration: float = 3.0,
+						size: Tuple[int, int] = PROXY_SIZE, fps: float = PROXY_FPS,
+						on_progress=None, cancel_event: Optional[threading.Event] = None) -> RenderReport:
+	"""Render một đoạn ngắn của job ra output_path ở độ phân giải proxy (không ghi lịch sử hiệu năng)."""
+	sub, a, b = proxy_builder(builder, start, duration, size, fps)
+	try:
+		cmd = sub.build() + ["-frames:v", str(max(1, int(round((b - a) * fps)))), output_path]
+		return run_ffmpeg_with_progress(cmd, b - a, on_progress, cancel_event=cancel_event, record_history=False)
+	finally:
+		sub.cleanup()
+
+
+def render_preview_frame(builder: FFmpegPipelineBuilder, t: float, size: Tuple[int, int] = PROXY_SIZE) -> bytes:
+	"""Một frame của output tại giây t, trả về nội dung file PNG (đọc thẳng từ stdout của ffmpeg)."""
+	sub, a, _ = proxy_builder(builder, t, 1.0 / PROXY_FPS, size, PROXY_FPS)
+	try:
+		cmd = sub.build()
+		# Giữ phần input + filter graph, thay phần encoder/output bằng một frame PNG
+		cmd = cmd[:cmd.index("-c:v")] if "-c:v" in cmd else cmd
+		cmd += ["-ss", f"{max(0.0, t - a):.3f}", "-frames:v", "1", "-an", "-f", "image2pipe", "-c:v", "png", "pipe:1"]
+		res = subprocess.run(cmd, capture_output=True)
+		if res.returncode != 0 or not res.stdout:
+			raise subprocess.CalledProcessError(res.returncode, cmd, output=res.stdout,
+												stderr=res.stderr.decode("utf-8", errors="replace")[-4000:])
+		return res.stdout
+	finally:
+		sub.cleanup()
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Optional
+
+from app_paths import JsonFileCache, file_identity
+
+
+@dataclass
+class MediaInfo:
+	"""Thông tin một file media, lấy từ một lần chạy ffprobe duy nhất."""
+	path: str
+	size: int
+	mtime_ns: int
+	duration: Optional[float] = None
+	width: Optional[int] = None
+	height: Optional[int] = None
+	fps: Optional[float] = None
+	video_codec: Optional[str] = None
+	pix_fmt: Optional[str] = None
+	has_audio: bool = False
+	audio_codec: Optional[str] = None
+	audio_sample_rate: Optional[int] = None
+	audio_channels: Optional[int] = None
+
+
+_cache = JsonFileCache("probe_cache.json")
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+	if not rate:
+		return None
+	try:
+		if "/" in rate:
+			num, den = rate.split("/", 1)
+			return float(num) / float(den) if float(den) else None
+		return float(rate)
+	except ValueError:
+		return None
+
+
+def _parse_ffprobe_json(path: str, st: os.stat_result, data: dict) -> MediaInfo:
+	info = MediaInfo(path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+	fmt = data.get("format", {})
+	try:
+		dur = float(fmt.get("duration", 0) or 0)
+		info.duration = dur if dur > 0 else None
+	except ValueError:
+		pass
+	for stream in data.get("streams", []):
+		kind = stream.get("codec_type")
+		if kind == "video" and info.video_codec is None and not stream.get("disposition", {}).get("attached_pic"):
+			info.video_codec = stream.get("codec_name")
+			info.pix_fmt = stream.get("pix_fmt")
+			info.width = stream.get("width")
+			info.height = stream.get("height")
+			info.fps = _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate"))
+			# Video quay dọc trên điện thoại thường lưu ngang + rotation 90
+			rotation = 0
+			for side in stream.get("side_data_list", []) or []:
+				if "rotation" in side:
+					rotation = int(side["rotation"])
+			rotation = int(stream.get("tags", {}).get("rotate", rotation))
+			if abs(rotation) % 180 == 90 and info.width and info.height:
+				info.width, info.height = info.height, info.width
+			if info.duration is None:
+				try:
+					info.duration = float(stream.get("duration")) or None
+				except (TypeError, ValueError):
+					pass
+		elif kind == "audio" and not info.has_audio:
+			info.has_audio = True
+			info.audio_codec = stream.get("codec_name")
+			try:
+				info.audio_sample_rate = int(stream.get("sample_rate"))
+			except (TypeError, ValueError):
+				pass
+			info.audio_channels = stream.get("channels")
+	return info
+
+
+def probe_media(path: str, ffprobe_bin: str = "ffprobe", use_cache: bool = True) -> Optional[MediaInfo]:
+	"""Chạy ffprobe một lần (-show_format -show_streams) và trả về MediaInfo.
+
+	Kết quả được cache trên đĩa theo đường dẫn + kích thước + mtime, nên file không
+	đổi sẽ không bị probe lại giữa các lần build/các lần chạy ứng dụng.
+	"""
+	return _probe(path, ffprobe_bin, use_cache, persist=True)
+
+
+def _probe(path: str, ffprobe_bin: str, use_cache: bool, persist: bool) -> Optional[MediaInfo]:
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	key = file_identity(path)
+	if use_cache and key:
+		hit = _cache.get(key)
+		if hit is not None:
+			return MediaInfo(**hit)
+
+	try:
+		res = subprocess.run([
+			ffprobe_bin, "-v", "error", "-show_format", "-show_streams", "-of", "json", path
+		], capture_output=True, text=True, check=True)
+		info = _parse_ffprobe_json(path, st, json.loads(res.stdout or "{}"))
+	except Exception:
+		return None
+
+	if use_cache and key:
+		_cache.set(key, asdict(info), persist=persist)
+	return info
+
+
+def probe_many(paths: Iterable[str], ffprobe_bin: str = "ffprobe", max_workers: int = 8) -> Dict[str, Optional[MediaInfo]]:
+	"""Probe nhiều file song song (mỗi file một tiến trình ffprobe)."""
+	unique = list(dict.fromkeys(paths))
+	if not unique:
+		return {}
+	with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique)))) as pool:
+		infos = list(pool.map(lambda p: _probe(p, ffprobe_bin, True, persist=False), unique))
+	# Ghi cache một lần cho cả thư mục thay vì sau từng file
+	_cache.flush()
+	return dict(zip(unique, infos))
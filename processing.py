@@ -1,9 +1,22 @@
+import copy
 import os
 import subprocess
-from typing import List, Optional, Tuple
-
-from delogo import DelogoPreset, compute_delogo_coords, infer_delogo_region
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from delogo import DelogoPreset, compute_delogo_coords, frame_box_to_canvas, infer_delogo_region, localize_static_overlay
+from filter_plan import plan_video_chain
+from app_paths import JsonFileCache, file_identity
+from probe import MediaInfo, probe_many, probe_media
+from capabilities import detect_capabilities, invalidate_capabilities
+from history import RenderReport, default_history, describe_command, finalize_output, new_report
 import cv2
+import numpy as np
 import sys
 
 # Resolve ffmpeg/ffprobe paths for portable builds (PyInstaller bundle or PATH)
@@ -35,6 +48,171 @@ def _resolve_ffmpeg_paths() -> Tuple[str, str]:
 
 _FFMPEG_BIN, _FFPROBE_BIN = _resolve_ffmpeg_paths()
 
+# Kết quả dò vị trí logo tự động, dùng chung cho mọi builder/job
+_delogo_cache = JsonFileCache("delogo_cache.json")
+# Kết quả dò chưa chắc chắn (lấy mẫu bị cắt vì máy bận, hoặc phải chấm điểm bốn góc): chỉ nhớ
+# trong tiến trình này, lần chạy sau dò lại
+_delogo_session: Dict[str, Tuple[int, int, int, int, str]] = {}
+
+
+def probe_inputs(paths: List[str], max_workers: int = 8) -> Dict[str, Optional[MediaInfo]]:
+	"""Probe song song một danh sách file (ví dụ cả thư mục) và làm nóng cache."""
+	return probe_many(paths, _FFPROBE_BIN, max_workers=max_workers)
+
+
+# Số keyframe lấy mẫu mỗi clip để dò logo
+KEYFRAME_SAMPLES = 6
+# Thời gian tối đa lấy mẫu keyframe cho một clip (dò logo chạy cho mọi input của batch)
+SAMPLE_BUDGET_SECONDS = 0.9
+
+
+def sample_keyframes(path: str, count: int = KEYFRAME_SAMPLES, width: int = 360,
+					 budget_seconds: float = SAMPLE_BUDGET_SECONDS) -> Optional[np.ndarray]:
+	"""Lấy tối đa count frame grayscale (K, H, width) rải đều trong clip, chỉ giải mã keyframe.
+
+	Mỗi mẫu là một lần seek (-noaccurate_seek + -skip_frame nokey) nên chỉ keyframe được giải
+	mã (một thread, bỏ deblock vì ảnh chỉ dùng ở độ phân giải nhỏ), scale nhỏ ngay trong ffmpeg
+	và đọc thẳng vào NumPy qua pipe rawvideo.
+	Các mẫu chạy song song; hết budget_seconds (tính từ sau probe) thì dừng mẫu còn dở và trả
+	về các mẫu đã có (thứ tự lấy mẫu xen kẽ nên vài mẫu đầu vẫn rải khắp clip). Ít hơn count
+	frame nghĩa là kết quả phụ thuộc tải máy: người gọi không nên lưu lâu dài.
+	"""
+	info = probe_media(path, _FFPROBE_BIN)
+	if not info or not info.duration or not info.width or not info.height:
+		return None
+	deadline = time.monotonic() + budget_seconds
+	out_w = max(16, (int(width) // 2) * 2)
+	out_h = max(16, int(round(info.height * out_w / float(info.width) / 2.0)) * 2)
+	frame_bytes = out_w * out_h
+	# Tránh sát đầu/cuối clip (thường là fade/intro)
+	times = [info.duration * (i + 0.5) / count for i in range(count)]
+	order = list(range(0, count, 2)) + list(range(1, count, 2))
+
+	def grab(t: float) -> Optional[np.ndarray]:
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			return None
+		try:
+			res = subprocess.run([
+				_FFMPEG_BIN, "-v", "error", "-noaccurate_seek", "-ss", f"{t:.3f}",
+				"-skip_frame", "nokey", "-threads", "1", "-skip_loop_filter", "all", "-i", path, "-an", "-sn", "-dn",
+				"-frames:v", "1", "-fps_mode", "passthrough",
+				"-vf", f"scale={out_w}:{out_h}:flags=fast_bilinear,format=gray",
+				"-f", "rawvideo", "-",
+			], capture_output=True, check=True, timeout=remaining)
+		except Exception:
+			return None
+		if len(res.stdout) < frame_bytes:
+			return None
+		return np.frombuffer(res.stdout[:frame_bytes], dtype=np.uint8).reshape(out_h, out_w)
+
+	with ThreadPoolExecutor(max_workers=min(count, os.cpu_count() or 4)) as pool:
+		grabbed = dict(zip(order, pool.map(grab, [times[i] for i in order])))
+	frames = [grabbed[i] for i in range(count) if grabbed[i] is not None]
+	if not frames:
+		return None
+	return np.stack(frames)
+
+
+# Canvas dọc chuẩn của output; tọa độ delogo/preset luôn tính trên canvas này
+CANVAS_4K: Tuple[int, int] = (2160, 3840)
+
+# (x, y, w, h, bán kính blur) của một vùng cần che, theo tọa độ frame output
+Region = Tuple[int, int, int, int, int]
+
+
+@dataclass
+class Rendition:
+	"""Một bản xuất của job khi xuất nhiều độ phân giải từ cùng một lần giải mã (build_renditions)."""
+	path: str
+	# Kích thước frame; cả hai None = canvas, thiếu một chiều thì giữ tỉ lệ canvas
+	width: Optional[int] = None
+	height: Optional[int] = None
+	# Hoặc chỉ cạnh ngắn (1080 = "1080p" dù canvas dọc hay ngang), giữ tỉ lệ canvas
+	short_side: Optional[int] = None
+	# None = theo tùy chọn xuất của builder
+	hevc: Optional[bool] = None
+	# Trần bitrate (CRF)
+	bitrate_mbps: Optional[int] = None
+
+	def frame_size(self, canvas: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+		if self.width and self.height:
+			return self.width, self.height
+		if canvas is None:
+			raise ValueError(f"Không biết kích thước output: rendition {self.path} cần cả width và height")
+		cw, ch = canvas
+		width, height = self.width, self.height
+		if self.short_side and not (width or height):
+			if cw <= ch:
+				width = self.short_side
+			else:
+				height = self.short_side
+		if width:
+			return width, max(2, int(round(ch * width / cw / 2.0)) * 2)
+		if height:
+			return max(2, int(round(cw * height / ch / 2.0)) * 2), height
+		return canvas
+
+	def label(self, canvas: Optional[Tuple[int, int]]) -> str:
+		w, h = self.frame_size(canvas)
+		return f"{min(w, h)}p"
+
+
+def _merge_regions(regions: List[Region]) -> List[Region]:
+	"""Gộp các vùng chồng lên nhau (ví dụ logo nằm trong góc QR) thành khung bao."""
+	merged: List[Region] = []
+	for r in regions:
+		x, y, w, h, rad = r
+		changed = True
+		while changed:
+			changed = False
+			for i, (mx, my, mw, mh, mrad) in enumerate(merged):
+				if x < mx + mw and mx < x + w and y < my + mh and my < y + h:
+					nx, ny = min(x, mx), min(y, my)
+					w, h = max(x + w, mx + mw) - nx, max(y + h, my + mh) - ny
+					x, y, rad = nx, ny, max(rad, mrad)
+					del merged[i]
+					changed = True
+					break
+		merged.append((x, y, w, h, rad))
+	return merged
+
+
+def region_blur_filter(regions: List[Region], frame_w: int, frame_h: int, mode: str = "blur") -> str:
+	"""Một bước che nhiều vùng chữ nhật (logo + góc QR) trên frame frame_w x frame_h.
+
+	mode "blur" (mặc định): crop từng vùng → boxblur → overlay lại đúng chỗ. split chỉ tạo
+	tham chiếu tới frame, crop không chép pixel; overlay đặt repeatlast=0 để framesync không
+	giữ frame cũ, nên frame chính ghi được tại chỗ, không chép lại cả frame 4K cho mỗi vùng.
+	mode "fill": chuỗi delogo (nội suy từ viền vùng), chỉ dùng khi chọn rõ.
+	So sánh: benchmarks/bench_region_blur.py. Trả về "" nếu không có vùng nào.
+	"""
+	# delogo yêu cầu vùng nằm hẳn trong frame (cách mép ít nhất 1 px)
+	edge = 1 if mode == "fill" else 0
+	clamped: List[Region] = []
+	for x, y, w, h, rad in regions:
+		x, y = max(edge, min(int(x), frame_w - 2 - edge)), max(edge, min(int(y), frame_h - 2 - edge))
+		w, h = max(2, min(int(w), frame_w - edge - x)), max(2, min(int(h), frame_h - edge - y))
+		clamped.append((x, y, w, h, rad))
+	clamped = _merge_regions(clamped)
+	if not clamped:
+		return ""
+	if mode == "fill":
+		return ",".join(f"delogo=x={x}:y={y}:w={w}:h={h}" for x, y, w, h, _ in clamped)
+
+	n = len(clamped)
+	parts = [f"split={n + 1}[rb_base]" + "".join(f"[rb_in{i}]" for i in range(n))]
+	for i, (x, y, w, h, rad) in enumerate(clamped):
+		# boxblur: bán kính chroma (4:2:0) không được vượt quá nửa cạnh ngắn của vùng
+		rad = max(1, min(rad, min(w, h) // 4))
+		parts.append(f"[rb_in{i}]crop={w}:{h}:{x}:{y},boxblur={rad}:2[rb_bl{i}]")
+	prev = "rb_base"
+	for i, (x, y, _, _, _) in enumerate(clamped):
+		out = "" if i == n - 1 else f"[rb_t{i}]"
+		parts.append(f"[{prev}][rb_bl{i}]overlay={x}:{y}:repeatlast=0{out}")
+		prev = f"rb_t{i}"
+	return ";".join(parts)
+
 
 class FFmpegPipelineBuilder:
 	"""Xây dựng câu lệnh ffmpeg theo tùy chọn."""
@@ -47,6 +225,9 @@ class FFmpegPipelineBuilder:
 		# Options
 		self.force_vertical_4k = True
 		self.force_fps60 = True
+		# Kích thước canvas và fps output thực tế; bản xem trước (preview.py) thu nhỏ hai giá trị này
+		self.canvas_size: Tuple[int, int] = CANVAS_4K
+		self.target_fps = 60.0
 		self.use_sharpen = True
 		self.use_color = True
 		self.fast_mode = False
@@ -62,17 +243,44 @@ class FFmpegPipelineBuilder:
 
 		self.use_hevc = False
 		self.bitrate_mbps = 12
+		# Điều khiển bitrate: "crf" (chất lượng cố định, trần maxrate = bitrate_mbps) hoặc
+		# "target_size" (bitrate trung bình tính từ target_size_mb và thời lượng, encode 2 lượt: ratecontrol.py)
+		self.rate_control = "crf"
+		self.target_size_mb: Optional[float] = None
+		# Lượt encode của chế độ target_size (None = một lượt) và tiền tố file stats x264/x265
+		self.encode_pass: Optional[int] = None
+		self.pass_log: Optional[str] = None
+		# Bitrate video (kb/s) đã tính cho cả timeline: windowed() giữ nguyên cho từng khúc
+		self.video_kbps_override: Optional[int] = None
+		# Các bản xuất cùng lúc từ một graph (build_renditions); rỗng = một output như build()
+		self.renditions: List[Rendition] = []
 		self.keep_audio = True
 		self.reencode_metadata = True
 		self.hide_qr = False
+		# Cách che vùng logo/QR: "blur" (boxblur trên từng vùng) hoặc "fill" (nội suy delogo)
+		self.region_blur_mode = "blur"
 
 		# Performance
 		self.use_nvenc = True
 		self.encoder_preset = "fast"
 		self.threads = 0  # 0 = auto
+		# threads do bộ lập lịch đặt theo tải máy (scheduler.apply_slot), không phải người dùng chọn
+		self.threads_scheduled = False
 		self.faststart = True
+		# Cho phép ghép bằng -c copy khi input đã đồng nhất và không cần xử lý pixel
+		self.allow_stream_copy = True
+		self.loop_count = 1
+		# (điểm vào, thời lượng) cho từng input khi chỉ render một khúc timeline (xem windowed())
+		self.clip_windows: Optional[List[Tuple[float, float]]] = None
+		# Input đã được chuẩn hóa sẵn (mezzanine, xem mezzanine.py): bỏ scale/pad/màu/hiệu ứng/zoom,
+		# chỉ ghép transition, che logo/QR và encode
+		self.normalized_inputs = False
+		# Kết quả dò logo (x, y, w, h, góc) đã tính trên file gốc, dùng khi input là mezzanine
+		self.delogo_box_override: Optional[Tuple[int, int, int, int, str]] = None
 
 		self.expected_total_duration_seconds: Optional[float] = None
+		# Ghi chú cho người dùng về lựa chọn của build() (fast path, fallback...)
+		self.build_notes: List[str] = []
 
 		# Cinematic effects
 		self.use_film_grain = False
@@ -86,6 +294,57 @@ class FFmpegPipelineBuilder:
 		self.use_lut = False
 		self.lut_path: Optional[str] = None
 
+		# File tạm riêng cho từng job (concat list...), xóa bằng cleanup()
+		self._temp_files: List[str] = []
+
+	def cleanup(self) -> None:
+		"""Xóa các file tạm do build() tạo ra."""
+		for path in self._temp_files:
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		self._temp_files = []
+
+	def describe_options(self) -> Dict[str, object]:
+		"""Tóm tắt tùy chọn của job (ghi vào lịch sử render để so sánh hiệu năng)."""
+		size: Optional[Tuple[int, int]] = self.canvas_size if self.force_vertical_4k else None
+		if size is None:
+			info = self._probe(self.input_files[0])
+			size = (info.width, info.height) if info and info.width and info.height else None
+		return {
+			"inputs": len(self.input_files),
+			"canvas": f"{size[0]}x{size[1]}" if size else None,
+			"loop": self.loop_count,
+			"vertical_4k": self.force_vertical_4k,
+			"fps60": self.force_fps60,
+			"sharpen": self.use_sharpen,
+			"color": self.use_color,
+			"fast_mode": self.fast_mode,
+			"hwaccel_decode": self.hwaccel_decode,
+			"transition": self.transition[0] if self.transition else None,
+			"delogo": self.delogo_preset.name if self.delogo_preset else None,
+			"zoom": self.zoom_remove_logo,
+			"hevc": self.use_hevc,
+			"bitrate_mbps": self.bitrate_mbps,
+			"rate_control": self.rate_control,
+			"target_size_mb": self.target_size_mb,
+			"keep_audio": self.keep_audio,
+			"hide_qr": self.hide_qr,
+			"nvenc": self.use_nvenc,
+			"preset": self.encoder_preset,
+			"threads": self.threads,
+			"filter_threads": self.filter_threads,
+			"threads_scheduled": self.threads_scheduled,
+			"mezzanine": self.normalized_inputs,
+			# Số bản xuất cùng lúc (build_renditions); None = một output
+			"renditions": len(self.renditions) or None,
+			"effects": [name for name, on in (
+				("grain", self.use_film_grain), ("vignette", self.use_vignette), ("chromatic", self.use_chromatic),
+				("noise", self.use_digital_noise), ("lut", self.use_lut),
+			) if on],
+		}
+
 	def set_speed_options(self, fast_mode: bool, hwaccel_decode: bool, filter_threads: int):
 		self.fast_mode = fast_mode
 		self.hwaccel_decode = hwaccel_decode
@@ -139,21 +398,96 @@ class FFmpegPipelineBuilder:
 		self.reencode_metadata = reencode_metadata
 		self.hide_qr = hide_qr
 
+	def set_rate_control(self, mode: str, target_size_mb: Optional[float] = None):
+		if mode not in ("crf", "target_size"):
+			raise ValueError(f"Chế độ điều khiển bitrate không hợp lệ: {mode}")
+		if mode == "target_size" and not (target_size_mb and target_size_mb > 0):
+			raise ValueError("Chế độ target_size cần target_size_mb > 0")
+		self.rate_control = mode
+		self.target_size_mb = target_size_mb
+
+	def set_renditions(self, renditions: List[Rendition]):
+		self.renditions = list(renditions)
+
+	def set_region_blur_mode(self, mode: str):
+		if mode not in ("fill", "blur"):
+			raise ValueError(f"Chế độ che vùng không hợp lệ: {mode}")
+		self.region_blur_mode = mode
+
 	def set_performance(self, use_nvenc: bool, preset: str, threads: int, faststart: bool):
 		self.use_nvenc = use_nvenc
 		self.encoder_preset = preset
 		self.threads = threads
 		self.faststart = faststart
 
+	def set_stream_copy(self, enable: bool):
+		self.allow_stream_copy = enable
+
+	def set_loop(self, count: int):
+		"""Khi chỉ có 1 input: phát lại count lần (-stream_loop) thay vì thêm file 2 lần."""
+		self.loop_count = max(1, int(count))
+
+	def _is_loop(self) -> bool:
+		return len(self.input_files) == 1 and self.loop_count > 1
+
+	def _timeline_files(self) -> List[str]:
+		"""Danh sách clip theo thứ tự trên timeline (input lặp được tính nhiều lần)."""
+		if self._is_loop():
+			return self.input_files * self.loop_count
+		return list(self.input_files)
+
+	def _input_args(self) -> List[str]:
+		if self._is_loop():
+			# Một demuxer/decoder duy nhất cho tất cả các vòng lặp
+			return ["-stream_loop", str(self.loop_count - 1), "-i", self.input_files[0]]
+		args: List[str] = []
+		for k, p in enumerate(self.input_files):
+			if self.clip_windows:
+				inpoint, dur = self.clip_windows[k]
+				args.extend(["-ss", f"{inpoint:.3f}", "-t", f"{dur:.3f}"])
+			args.extend(["-i", p])
+		return args
+
+	def windowed(self, windows: List[Tuple[str, float, float]], transition_duration: Optional[float] = None) -> "FFmpegPipelineBuilder":
+		"""Bản sao builder chỉ render một khúc timeline (chỉ video), dùng cho encode chia đoạn.
+
+		windows là danh sách (file, điểm vào, thời lượng) theo thứ tự timeline; mỗi cửa sổ
+		là một input riêng được seek bằng -ss/-t. transition_duration là thời lượng transition
+		đã tính cho cả timeline, giữ nguyên để các khúc khớp với lần render một lượt.
+		"""
+		sub = copy.copy(self)
+		sub.input_files = [w[0] for w in windows]
+		sub.clip_windows = [(float(w[1]), float(w[2])) for w in windows]
+		sub.loop_count = 1
+		sub.allow_stream_copy = False
+		sub.keep_audio = False
+		sub.build_notes = []
+		sub._temp_files = []
+		if self.rate_control == "target_size":
+			# Bitrate theo dung lượng của cả job, không theo thời lượng của khúc
+			sub.video_kbps_override = self.target_video_kbps()
+			sub.encode_pass = None
+		if self.transition is not None and transition_duration is not None:
+			sub.transition = (self.transition[0], transition_duration) + tuple(self.transition[2:])
+		return sub
+
 	# Helpers
-	def _base_video_filter(self, force_vertical_4k: bool, use_sharpen: bool, use_color: bool, fast_mode: bool) -> str:
+	def _base_video_filter(self, force_vertical_4k: bool, use_sharpen: bool, use_color: bool, fast_mode: bool,
+						   src_fps: Optional[float] = None, out_fps: Optional[float] = None) -> str:
+		"""Chuỗi filter chuẩn hóa + hiệu ứng, đã qua plan_video_chain (thứ tự rẻ nhất, gộp filter trùng).
+
+		out_fps (nếu có) được đặt ở đầu hoặc cuối chuỗi tùy src_fps, xem filter_plan.py.
+		"""
+		if self.normalized_inputs:
+			return ",".join(plan_video_chain([], src_fps, out_fps))
 		filters = []
+		cw, ch = self.canvas_size
 		if force_vertical_4k:
 			if fast_mode:
-				filters.append("scale=2160:3840:flags=bicubic:force_original_aspect_ratio=decrease")
+				filters.append(f"scale={cw}:{ch}:flags=bicubic:force_original_aspect_ratio=decrease")
 			else:
-				filters.append("scale=2160:3840:flags=lanczos:force_original_aspect_ratio=decrease")
-			filters.append("pad=2160:3840:(ow-iw)/2:(oh-ih)/2:color=black")
+				filters.append(f"scale={cw}:{ch}:flags=lanczos:force_original_aspect_ratio=decrease")
+			filters.append(f"pad={cw}:{ch}:(ow-iw)/2:(oh-ih)/2:color=black")
 		if (not fast_mode) and use_sharpen:
 			filters.append("unsharp=5:5:1.0:5:5:0.0")
 		if (not fast_mode) and use_color:
@@ -164,51 +498,42 @@ class FFmpegPipelineBuilder:
 		if cinematic_filters:
 			filters.extend(cinematic_filters)
 		
-		vf = ",".join(filters) if filters else "null"
-		return vf
+		return ",".join(plan_video_chain(filters, src_fps, out_fps))
 
 	def _zoom_crop_filter(self, corner: str) -> str:
-		# scale up then crop to 2160x3840, pushing crop window away from the corner containing the logo
+		# scale up then crop to the canvas, pushing crop window away from the corner containing the logo
 		z = self.zoom_factor
-		scale = f"scale=round(2160*{z}):round(3840*{z}):flags=bicubic"
+		cw, ch = self.canvas_size
+		scale = f"scale=round({cw}*{z}):round({ch}*{z}):flags=bicubic"
 		# choose crop anchor
 		if corner == "top_right":
-			crop = "crop=2160:3840:0:ih-3840"
+			crop = f"crop={cw}:{ch}:0:ih-{ch}"
 		elif corner == "top_left":
-			crop = "crop=2160:3840:iw-2160:ih-3840"
+			crop = f"crop={cw}:{ch}:iw-{cw}:ih-{ch}"
 		elif corner == "bottom_right":
-			crop = "crop=2160:3840:0:0"
+			crop = f"crop={cw}:{ch}:0:0"
 		else:  # bottom_left
-			crop = "crop=2160:3840:iw-2160:0"
+			crop = f"crop={cw}:{ch}:iw-{cw}:0"
 		return f"{scale},{crop}"
 
+	@staticmethod
+	def _probe(path: str) -> Optional[MediaInfo]:
+		# Một lần ffprobe cho mỗi file, có cache trên đĩa (xem probe.py)
+		return probe_media(path, _FFPROBE_BIN)
+
 	@staticmethod
 	def _probe_duration(path: str) -> Optional[float]:
-		try:
-			res = subprocess.run([
-				_FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration",
-				"-of", "default=nw=1:nk=1", path
-			], capture_output=True, text=True, check=True)
-			val = float(res.stdout.strip())
-			return val if val > 0 else None
-		except Exception:
-			return None
+		info = FFmpegPipelineBuilder._probe(path)
+		return info.duration if info else None
 
 	@staticmethod
 	def _probe_has_audio(path: str) -> bool:
-		try:
-			res = subprocess.run([
-				_FFPROBE_BIN, "-v", "error", "-select_streams", "a:0",
-				"-show_entries", "stream=index", "-of", "csv=p=0", path
-			], capture_output=True, text=True, check=True)
-			return res.stdout.strip() != ""
-		except Exception:
-			return False
+		info = FFmpegPipelineBuilder._probe(path)
+		return bool(info and info.has_audio)
 
-	@staticmethod
-	def _blur_overlay_expression(w: int, h: int, x: int, y: int) -> str:
-		# Sử dụng giá trị boxblur trong giới hạn cho phép (tối đa 27)
-		return f"split[base][crop];[crop]crop={w}:{h}:{x}:{y},boxblur=20:2[bl];[base][bl]overlay={x}:{y}"
+	def prefetch_probes(self) -> None:
+		"""Probe song song tất cả input để build() chỉ đọc từ cache."""
+		probe_inputs(self.input_files)
 
 	@staticmethod
 	def _grab_first_frame(path: str):
@@ -220,19 +545,62 @@ class FFmpegPipelineBuilder:
 		except Exception:
 			return None
 
-	def _auto_delogo_xy(self, default_size: Tuple[int, int]) -> Tuple[int, int, str]:
+	def _auto_delogo_box(self, default_size: Tuple[int, int]) -> Tuple[int, int, int, int, str]:
+		"""Dò vùng logo tự động, trả về (x, y, w, h, góc) trên canvas 2160x3840.
+
+		Ưu tiên bộ dò theo thời gian (K keyframe, tìm overlay tĩnh ở bất kỳ đâu, ô bám sát
+		logo); nếu không đủ tin cậy thì quay về chấm điểm bốn góc với kích thước ô cố định.
+		"""
+		if self.delogo_box_override is not None:
+			return self.delogo_box_override
 		w, h = default_size
-		frame = self._grab_first_frame(self.input_files[0])
-		if frame is None:
-			# default to top_right
-			x, y = compute_delogo_coords(DelogoPreset("top_right"), w, h, self.delogo_margin)
-			return x, y, "top_right"
-		x, y, _, _ = infer_delogo_region(frame, default_size, self.delogo_margin)
+		# Kết quả dò logo được nhớ theo file (đường dẫn+kích thước+mtime) + kích thước ô + lề,
+		# dùng lại giữa các lần build và giữa các job có chung nguồn
+		ident = file_identity(self.input_files[0])
+		key = f"{ident}|{w}x{h}|{self.delogo_margin}|temporal" if ident else None
+		if key:
+			hit = _delogo_cache.get(key)
+			if hit is not None:
+				return int(hit[0]), int(hit[1]), int(hit[2]), int(hit[3]), str(hit[4])
+			if key in _delogo_session:
+				return _delogo_session[key]
+
+		frames = sample_keyframes(self.input_files[0])
+		box = localize_static_overlay(frames) if frames is not None else None
+		if box is not None:
+			x, y, w, h = frame_box_to_canvas(box, frames.shape[2], frames.shape[1])
+		else:
+			frame = frames[len(frames) // 2] if frames is not None else self._grab_first_frame(self.input_files[0])
+			if frame is None:
+				# default to top_right
+				x, y = compute_delogo_coords(DelogoPreset("top_right"), w, h, self.delogo_margin)
+				return x, y, w, h, "top_right"
+			x, y, _, _ = infer_delogo_region(frame, default_size, self.delogo_margin)
 		# infer corner label by position
-		corner = "top_right" if x > 1080 else "top_left"
-		corner = "bottom_" + ("right" if corner.endswith("right") else "left") if y > 1920 else corner
+		cx, cy = x + w / 2.0, y + h / 2.0
+		corner = "top_right" if cx > 1080 else "top_left"
+		corner = "bottom_" + ("right" if corner.endswith("right") else "left") if cy > 1920 else corner
+		if key:
+			# Chỉ lưu lâu dài kết quả của bộ dò theo thời gian với đủ mẫu
+			if box is not None and len(frames) == KEYFRAME_SAMPLES:
+				_delogo_cache.set(key, [x, y, w, h, corner])
+			else:
+				_delogo_session[key] = (x, y, w, h, corner)
+		return x, y, w, h, corner
+
+	def _auto_delogo_xy(self, default_size: Tuple[int, int]) -> Tuple[int, int, str]:
+		x, y, _, _, corner = self._auto_delogo_box(default_size)
 		return x, y, corner
 
+	def _delogo_region(self) -> Tuple[int, int, int, int]:
+		"""Vùng cần làm mờ (x, y, w, h) theo preset; preset auto dùng bộ dò tự động."""
+		w, h = self.delogo_box_size
+		if self.delogo_preset.name == "auto":
+			x, y, w, h, _ = self._auto_delogo_box((w, h))
+			return x, y, w, h
+		x, y = compute_delogo_coords(self.delogo_preset, w, h, self.delogo_margin)
+		return x, y, w, h
+
 	def _compute_auto_zoom(self) -> float:
 		if not self.delogo_box_size:
 			return self.zoom_factor
@@ -241,21 +609,98 @@ class FFmpegPipelineBuilder:
 		z = 1.0 + max((w + m) / 2160.0, (h + m) / 3840.0)
 		return float(max(1.01, min(1.20, z)))
 
-	def _build_concat_simple(self) -> Tuple[List[str], Optional[str]]:
-		list_file = os.path.join(os.getcwd(), "_ffconcat.txt")
-		with open(list_file, "w", encoding="utf-8") as f:
+	def _write_concat_list(self) -> str:
+		# Mỗi job một file concat riêng để các job chạy song song không ghi đè nhau
+		fd, list_file = tempfile.mkstemp(prefix="_ffconcat_", suffix=".txt")
+		self._temp_files.append(list_file)
+		with os.fdopen(fd, "w", encoding="utf-8") as f:
 			for p in self.input_files:
-				p_escaped = p.replace("'", "'\\''")
+				# Đường dẫn tương đối được concat demuxer hiểu theo thư mục của file list
+				p_escaped = os.path.abspath(p).replace("'", "'\\''")
 				f.write(f"file '{p_escaped}'\n")
-		vf = self._base_video_filter(self.force_vertical_4k, self.use_sharpen, self.use_color, self.fast_mode)
-		return ["-f", "concat", "-safe", "0", "-i", list_file, "-vf", vf], list_file
+		return list_file
+
+	def _stream_copy_blockers(self) -> List[str]:
+		"""Lý do không thể ghép bằng -c copy (rỗng = dùng được fast path)."""
+		reasons: List[str] = []
+		if self.transition is not None and len(self._timeline_files()) >= 2:
+			reasons.append("có transition")
+		if (not self.fast_mode) and self.use_sharpen:
+			reasons.append("bật làm nét")
+		if (not self.fast_mode) and self.use_color:
+			reasons.append("bật chỉnh màu")
+		if self._get_cinematic_filters():
+			reasons.append("bật hiệu ứng cinematic/LUT")
+		if self.delogo_preset and self.delogo_box_size:
+			reasons.append("bật xóa logo")
+		if self.hide_qr:
+			reasons.append("bật ẩn QR")
+		if reasons:
+			return reasons
+
+		infos = [self._probe(p) for p in self.input_files]
+		if any(i is None or not i.video_codec for i in infos):
+			return ["không đọc được thông tin input"]
+		first = infos[0]
+		want_codec = "hevc" if self.use_hevc else "h264"
+		if first.video_codec != want_codec:
+			reasons.append(f"codec input là {first.video_codec}, cần {want_codec}")
+		if self.force_vertical_4k and (first.width, first.height) != self.canvas_size:
+			reasons.append(f"độ phân giải {first.width}x{first.height} khác {self.canvas_size[0]}x{self.canvas_size[1]}")
+		if self.force_fps60 and not (first.fps and abs(first.fps - self.target_fps) < 0.01):
+			reasons.append(f"fps {first.fps or 0:.2f} khác 60")
+		if first.pix_fmt != "yuv420p":
+			reasons.append(f"pixel format {first.pix_fmt} khác yuv420p")
+		for info in infos[1:]:
+			if (info.video_codec, info.width, info.height, info.pix_fmt) != (first.video_codec, first.width, first.height, first.pix_fmt) \
+					or not (info.fps and first.fps and abs(info.fps - first.fps) < 0.01):
+				reasons.append("các input khác codec/độ phân giải/fps/pixel format")
+				break
+		if self.keep_audio and len({i.has_audio for i in infos}) > 1:
+			reasons.append("chỉ một số input có âm thanh")
+		return reasons
+
+	def _build_stream_copy(self) -> List[str]:
+		"""Ghép bằng concat demuxer + -c copy (remux, không giải mã/encode video)."""
+		infos = [self._probe(p) for p in self._timeline_files()]
+		if self._is_loop():
+			cmd = [_FFMPEG_BIN, "-y"] + self._input_args()
+		else:
+			cmd = [_FFMPEG_BIN, "-y", "-f", "concat", "-safe", "0", "-i", self._write_concat_list()]
+		cmd.extend(["-map", "0:v:0", "-c:v", "copy"])
+		if self.keep_audio and all(i.has_audio for i in infos):
+			cmd.extend(["-map", "0:a:0"])
+			same_audio = len({(i.audio_codec, i.audio_sample_rate, i.audio_channels) for i in infos}) == 1
+			if same_audio and infos[0].audio_codec == "aac":
+				cmd.extend(["-c:a", "copy"])
+			else:
+				cmd.extend(["-c:a", "aac", "-b:a", "192k"])
+		else:
+			cmd.append("-an")
+		if self.faststart:
+			cmd.extend(["-movflags", "+faststart"])
+		if self.reencode_metadata:
+			cmd.extend(["-map_metadata", "-1"])
+		self.expected_total_duration_seconds = sum(i.duration or 0.0 for i in infos) or None
+		return cmd
 
-	def _build_two_inputs_with_transition(self) -> List[str]:
-		tran_name = (self.transition[0] if self.transition else "Crossfade")
-		tran_dur = (self.transition[1] if self.transition else 0.6)
-		smooth_mode = (self.transition[2] if self.transition and len(self.transition) > 2 else True)
+	def _timeline_min_fps(self) -> Optional[float]:
+		rates = [info.fps if info else None for info in (self._probe(p) for p in self.input_files)]
+		return min(rates) if rates and all(rates) else None
+
+	def _out_fps(self) -> Optional[float]:
+		return self.target_fps if self.force_fps60 else None
 
-		# decide per-clip preprocessing chain
+	def _build_concat_simple(self) -> Tuple[List[str], Optional[str]]:
+		vf = self._base_video_filter(self.force_vertical_4k, self.use_sharpen, self.use_color, self.fast_mode,
+									 src_fps=self._timeline_min_fps(), out_fps=self._out_fps())
+		if self._is_loop() or self.clip_windows:
+			return self._input_args() + ["-vf", vf], None
+		list_file = self._write_concat_list()
+		return ["-f", "concat", "-safe", "0", "-i", list_file, "-vf", vf], list_file
+
+	def _zoom_corner(self) -> Optional[str]:
+		"""Góc chứa logo khi dùng zoom để đẩy logo ra khỏi khung; None nếu không zoom."""
 		corner_for_zoom = None
 		# Disable zoom path when NVENC is used to tránh xung đột phần cứng
 		if (not self.use_nvenc) and self.zoom_remove_logo and self.delogo_box_size and self.delogo_preset:
@@ -264,72 +709,237 @@ class FFmpegPipelineBuilder:
 				_, _, corner_for_zoom = self._auto_delogo_xy((w, h))
 			else:
 				corner_for_zoom = self.delogo_preset.name
+		return corner_for_zoom
 
-		if corner_for_zoom:
+	def _clip_pre_filter(self, src_fps: Optional[float] = None) -> Tuple[str, Optional[str]]:
+		"""Chuỗi filter chuẩn hóa (gồm cả fps đích) cho một clip và góc zoom (nếu dùng zoom để bỏ logo)."""
+		corner_for_zoom = self._zoom_corner()
+		if corner_for_zoom and not self.normalized_inputs:
 			z = self._compute_auto_zoom() if self.zoom_auto else self.zoom_factor
 			# patch zoom factor for filter string
 			old = self.zoom_factor
 			self.zoom_factor = z
-			pre_base = self._zoom_crop_filter(corner_for_zoom)
+			pre_base = ",".join(plan_video_chain(self._zoom_crop_filter(corner_for_zoom).split(","), src_fps, self._out_fps()))
 			self.zoom_factor = old
 		else:
-			pre_base = self._base_video_filter(self.force_vertical_4k, self.use_sharpen, self.use_color, self.fast_mode)
+			pre_base = self._base_video_filter(self.force_vertical_4k, self.use_sharpen, self.use_color, self.fast_mode,
+											   src_fps=src_fps, out_fps=self._out_fps())
+		return pre_base, corner_for_zoom
+
+	def _transition_durations(self) -> Optional[List[float]]:
+		"""Thời lượng từng clip (cần để tính offset xfade); None nếu có clip không probe được."""
+		if self.clip_windows:
+			return [dur for _, dur in self.clip_windows]
+		durs = [self._probe_duration(p) for p in self._timeline_files()]
+		if any(d is None for d in durs):
+			return None
+		return [float(d) for d in durs]
 
-		dur0 = self._probe_duration(self.input_files[0]) or 0.0
-		dur1 = self._probe_duration(self.input_files[1]) or 0.0
-		self.expected_total_duration_seconds = max(0.0, dur0 + dur1 - tran_dur)
-		offset = max(0.0, dur0 - tran_dur)
+	def transition_params(self, durations: List[float]) -> Tuple[str, float, bool]:
+		"""(tên, thời lượng thực tế, smooth) của transition cho timeline có các clip dài durations."""
+		tran_name = (self.transition[0] if self.transition else "Crossfade")
+		tran_dur = (self.transition[1] if self.transition else 0.6)
+		smooth_mode = (self.transition[2] if self.transition and len(self.transition) > 2 else True)
+		if not self.clip_windows:
+			# xfade cần transition ngắn hơn clip; giới hạn theo clip ngắn nhất
+			tran_dur = round(min(tran_dur, min(durations) / 2.0), 3)
+		return tran_name, tran_dur, smooth_mode
+
+	def _audio_transition_filters(self, durations: List[float], tran_dur: float, smooth_mode: bool) -> List[str]:
+		"""Chuỗi acrossfade khớp với chuỗi xfade, ra nhãn [af]; rỗng nếu không clip nào có audio."""
+		filters: List[str] = []
+		n = len(durations)
+		looping = self._is_loop()
+		if looping:
+			audio_sources: List[Optional[str]] = []
+			if self._probe_has_audio(self.input_files[0]):
+				d = durations[0]
+				audio_sources = [f"[as{k}]atrim=start={k * d}:end={(k + 1) * d},asetpts=PTS-STARTPTS," for k in range(n)]
+		else:
+			audio_sources = [(f"[{k}:a]" if self._probe_has_audio(p) else None) for k, p in enumerate(self.input_files)]
+		if not any(audio_sources):
+			return []
+		if looping:
+			filters.append("[0:a]asplit=" + str(n) + "".join(f"[as{k}]" for k in range(n)))
+		for k in range(n):
+			d = durations[k]
+			if audio_sources[k]:
+				# Đệm/cắt audio đúng bằng thời lượng clip để acrossfade khớp với xfade
+				filters.append(f"{audio_sources[k]}aresample=async=1:first_pts=0,aformat=sample_rates=48000:channel_layouts=stereo,apad=whole_dur={d},atrim=duration={d}[a{k}]")
+			else:
+				filters.append(f"anullsrc=r=48000:cl=stereo,atrim=duration={d}[a{k}]")
+		prev = "a0"
+		for k in range(1, n):
+			out = "af" if k == n - 1 else f"ax{k}"
+			# Audio transition với curve mượt mà hơn và anti-aliasing
+			if smooth_mode:
+				filters.append(f"[{prev}][a{k}]acrossfade=d={tran_dur}:c1=qsin:c2=qsin[{out}]")
+			else:
+				filters.append(f"[{prev}][a{k}]acrossfade=d={tran_dur}:c1=tri:c2=tri[{out}]")
+			prev = out
+		return filters
 
-		filters = []
-		pre_v0 = f"[0:v]{pre_base}"
-		pre_v1 = f"[1:v]{pre_base}"
-		if self.force_fps60:
-			pre_v0 += ",fps=60"
-			pre_v1 += ",fps=60"
-		filters.append(pre_v0 + "[v0]")
-		filters.append(pre_v1 + "[v1]")
-		# Cải thiện transition để mượt mà hơn, tránh nhiễu sóng
-		xfade_params = self._get_smooth_xfade_params(tran_name, tran_dur, offset, smooth_mode)
-		filters.append(f"[v0][v1]{xfade_params},format=yuv420p[vx]")
+	def build_audio_only(self) -> Optional[List[str]]:
+		"""Lệnh chỉ render audio của cả timeline ra AAC (chưa có file output).
 
-		# if not zooming, apply blur-overlay delogo
-		if (not corner_for_zoom) and self.delogo_preset and self.delogo_box_size:
-			w, h = self.delogo_box_size
-			if self.delogo_preset.name == "auto":
-				x, y, _ = self._auto_delogo_xy((w, h))
+		Dùng cùng chuỗi acrossfade/concat với build() để audio ghép với video render
+		theo từng khúc vẫn khớp với render một lượt. None nếu job không giữ audio.
+		"""
+		if not self.keep_audio:
+			return None
+		self.prefetch_probes()
+		if not any(self._probe_has_audio(p) for p in self.input_files):
+			return None
+		durations = self._transition_durations()
+		cmd: List[str] = [_FFMPEG_BIN, "-y"]
+		if durations and self.uses_transitions():
+			_, tran_dur, smooth_mode = self.transition_params(durations)
+			filters = self._audio_transition_filters(durations, tran_dur, smooth_mode)
+			cmd.extend(self._input_args() + ["-filter_complex", ";".join(filters), "-map", "[af]"])
+			total: Optional[float] = sum(durations) - (len(durations) - 1) * tran_dur
+		else:
+			if self._is_loop() or self.clip_windows:
+				cmd.extend(self._input_args())
 			else:
-				x, y = compute_delogo_coords(self.delogo_preset, w, h, self.delogo_margin)
-			filters.append(f"[vx]{self._blur_overlay_expression(w, h, x, y)}[vf]")
+				cmd.extend(["-f", "concat", "-safe", "0", "-i", self._write_concat_list()])
+			cmd.extend(["-map", "0:a:0"])
+			total = sum(durations) if durations else None
+		cmd.extend(["-vn", "-c:a", "aac", "-b:a", "192k"])
+		if total:
+			cmd.extend(["-t", f"{total:.3f}"])
+		return cmd
+
+	def timeline(self) -> Optional[List[Tuple[str, float]]]:
+		"""(file, thời lượng) của từng clip trên timeline; None nếu có clip không probe được."""
+		durs = self._transition_durations()
+		return list(zip(self._timeline_files(), durs)) if durs else None
+
+	def uses_transitions(self) -> bool:
+		return len(self._timeline_files()) >= 2 and self.transition is not None
+
+	def timeline_offsets(self) -> Optional[Tuple[List[float], float, float]]:
+		"""(thời điểm bắt đầu của từng clip trên output, tổng thời lượng, thời lượng transition T).
+
+		Clip k bắt đầu tại tổng(d_j - T) với j < k; None nếu có clip không probe được.
+		"""
+		durs = self._transition_durations()
+		if not durs:
+			return None
+		tran = self.transition_params(durs)[1] if self.uses_transitions() else 0.0
+		offsets = [0.0]
+		for d in durs[:-1]:
+			offsets.append(offsets[-1] + d - tran)
+		return offsets, offsets[-1] + durs[-1], tran
+
+	def window_clips(self, start: float, end: float) -> List[Tuple[str, float, float]]:
+		"""(file, điểm vào, thời lượng) của các clip giao với đoạn [start, end) của output, dùng cho windowed()."""
+		layout = self.timeline_offsets()
+		if not layout:
+			return []
+		offsets = layout[0]
+		windows = []
+		for (path, d), off in zip(self.timeline() or [], offsets):
+			if off < end - 1e-6 and off + d > start + 1e-6:
+				inpoint = max(0.0, start - off)
+				windows.append((path, inpoint, min(d, end - off) - inpoint))
+		return windows
+
+	def _build_inputs_with_transitions(self, durations: List[float]) -> List[str]:
+		"""Nối N clip bằng chuỗi xfade/acrossfade trong một -filter_complex duy nhất.
+
+		Clip i bắt đầu tại offset_i = tổng(d_j - T) với j < i, nên tổng thời lượng là
+		tổng(d_i) - (N - 1) * T.
+
+		Chế độ lặp 1 input: chỉ mở file một lần với -stream_loop, tách các vòng lặp bằng
+		split + trim ở độ phân giải gốc và ghép transition tại chỗ nối; chuỗi chuẩn hóa
+		(scale/pad/sharpen/màu...) chạy một lần sau xfade thay vì một chuỗi cho mỗi bản sao.
+		"""
+		tran_name, tran_dur, smooth_mode = self.transition_params(durations)
+		n = len(durations)
+
+		looping = self._is_loop()
+
+		filters = []
+		if looping:
+			# Mỗi vòng lặp là một đoạn [k*d, (k+1)*d) của cùng một luồng giải mã
+			d = durations[0]
+			info = self._probe(self.input_files[0])
+			# xfade cần frame rate cố định; giữ fps gốc ở đây để chuỗi 4K phía sau không xử lý frame nhân bản
+			src_fps = info.fps if info and info.fps else 30.0
+			pre_base, corner_for_zoom = self._clip_pre_filter(src_fps)
+			filters.append("[0:v]split=" + str(n) + "".join(f"[s{k}]" for k in range(n)))
+			for k in range(n):
+				filters.append(f"[s{k}]trim=start={k * d}:end={(k + 1) * d},setpts=PTS-STARTPTS,fps={src_fps:.6f}[v{k}]")
+			tail = f",{pre_base},format=yuv420p"
 		else:
-			filters.append("[vx]null[vf]")
-
-		has_a0 = self._probe_has_audio(self.input_files[0])
-		has_a1 = self._probe_has_audio(self.input_files[1])
-		map_args: List[str] = []
-		if self.keep_audio and (has_a0 or has_a1):
-			# Cải thiện audio processing để mượt mà hơn
-			filters.append("[0:a]aresample=async=1:first_pts=0,apad[a0]")
-			filters.append("[1:a]aresample=async=1:first_pts=0,apad[a1]")
-			# Audio transition với curve mượt mà hơn và anti-aliasing
-			if smooth_mode:
-				filters.append(f"[a0][a1]acrossfade=d={tran_dur}:c1=cos:c2=cos:o1=0:o2=0:curve1=cos:curve2=cos[af]")
+			corner_for_zoom = None
+			for k in range(n):
+				info = self._probe(self.input_files[k])
+				pre_base, corner_for_zoom = self._clip_pre_filter(info.fps if info else None)
+				filters.append(f"[{k}:v]{pre_base}[v{k}]")
+			tail = ",format=yuv420p"
+
+		# Cải thiện transition để mượt mà hơn, tránh nhiễu sóng
+		prev = "v0"
+		timeline = durations[0]
+		for k in range(1, n):
+			offset = round(max(0.0, timeline - tran_dur), 3)
+			xfade_params = self._get_smooth_xfade_params(tran_name, tran_dur, offset, smooth_mode)
+			if k == n - 1:
+				filters.append(f"[{prev}][v{k}]{xfade_params}{tail}[vx]")
 			else:
-				filters.append(f"[a0][a1]acrossfade=d={tran_dur}:c1=tri:c2=tri:o1=0:o2=0[af]")
+				filters.append(f"[{prev}][v{k}]{xfade_params}[x{k}]")
+			prev = f"x{k}"
+			timeline = timeline + durations[k] - tran_dur
+		self.expected_total_duration_seconds = max(0.0, timeline)
+
+		# Logo (khi không dùng zoom) và góc QR được che trong cùng một bước
+		region_expr = self._region_blur_expression(include_logo=not corner_for_zoom)
+		filters.append(f"[vx]{region_expr or 'null'}[vf]")
+
+		audio_filters = self._audio_transition_filters(durations, tran_dur, smooth_mode) if self.keep_audio else []
+		if audio_filters:
+			filters.extend(audio_filters)
 			map_args = ["-map", "[vf]", "-map", "[af]"]
 		else:
 			map_args = ["-map", "[vf]", "-an"]
 
 		filtergraph = ";".join(filters)
-		return ["-i", self.input_files[0], "-i", self.input_files[1], "-filter_complex", filtergraph] + map_args
-
-	def _append_delogo(self, cmd: List[str], already_has_filtergraph: bool) -> List[str]:
-		if not self.delogo_preset or not self.delogo_box_size or self.zoom_remove_logo:
-			return cmd
-		if already_has_filtergraph:
+		return self._input_args() + ["-filter_complex", filtergraph] + map_args
+
+	def _output_size(self) -> Optional[Tuple[int, int]]:
+		"""Kích thước frame output (trước encoder); None nếu chưa biết."""
+		if self.force_vertical_4k or self._zoom_corner():
+			return self.canvas_size
+		info = self._probe(self.input_files[0])
+		return (info.width, info.height) if info and info.width and info.height else None
+
+	def _blur_regions(self, include_logo: bool) -> List[Region]:
+		regions: List[Region] = []
+		size = self._output_size()
+		# Vùng logo tính trên canvas 4K; canvas nhỏ hơn (xem trước) thì thu nhỏ theo cùng tỉ lệ
+		k = self.canvas_size[0] / float(CANVAS_4K[0]) if size == self.canvas_size else 1.0
+		if include_logo and self.delogo_preset and self.delogo_box_size:
+			x, y, w, h = self._delogo_region()
+			regions.append((round(x * k), round(y * k), round(w * k), round(h * k), max(1, round(20 * k))))
+		if self.hide_qr and size:
+			fw, fh = size
+			q, rad = round(200 * k), max(1, round(10 * k))
+			regions.extend([(0, 0, q, q, rad), (fw - q, 0, q, q, rad), (0, fh - q, q, q, rad), (fw - q, fh - q, q, q, rad)])
+		return regions
+
+	def _region_blur_expression(self, include_logo: bool) -> str:
+		size = self._output_size()
+		regions = self._blur_regions(include_logo)
+		if not regions or not size:
+			return ""
+		return region_blur_filter(regions, size[0], size[1], self.region_blur_mode)
+
+	def _append_region_blur(self, cmd: List[str]) -> List[str]:
+		"""Che logo/QR trên đường -vf (ghép không transition)."""
+		blur_expr = self._region_blur_expression(include_logo=not self.zoom_remove_logo)
+		if not blur_expr:
 			return cmd
-		w, h = self.delogo_box_size
-		x, y = compute_delogo_coords(self.delogo_preset, w, h, self.delogo_margin)
-		blur_expr = self._blur_overlay_expression(w, h, x, y)
 		if "-vf" in cmd:
 			idx = cmd.index("-vf")
 			current = cmd[idx + 1]
@@ -339,48 +949,59 @@ class FFmpegPipelineBuilder:
 		return cmd
 
 	def build(self) -> List[str]:
+		self.prefetch_probes()
+		self.build_notes = []
+		self.expected_total_duration_seconds = None
+		if self.allow_stream_copy:
+			blockers = self._stream_copy_blockers()
+			if not blockers:
+				self.build_notes.append("Input đã đồng nhất: ghép bằng stream copy (không encode lại)")
+				return self._build_stream_copy()
+			self.build_notes.append("Không dùng stream copy vì: " + ", ".join(blockers))
+
+		self._apply_capabilities()
+		cmd = self._build_decode_filter()
+		cmd.extend(self._video_encoder_args())
+		cmd.extend(self._audio_args(cmd))
+		cmd.extend(self._mux_args())
+		return cmd
+
+	def _build_decode_filter(self) -> List[str]:
+		"""Phần lệnh giải mã + filter video (input, -vf hoặc -filter_complex và -map), chưa có encoder."""
 		cmd: List[str] = [_FFMPEG_BIN, "-y"]
 
 		# HW decode flags
 		if self.hwaccel_decode:
-			cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])  # will fallback if not available
+			# Giải mã trên GPU nhưng trả frame về RAM: toàn bộ filter phía sau chạy trên CPU,
+			# -hwaccel_output_format cuda sẽ làm filter graph không nối được
+			cmd.extend(["-hwaccel", "cuda"])
 
 		has_complex = False
-		if len(self.input_files) == 2 and self.transition is not None:
-			cmd.extend(self._build_two_inputs_with_transition())
+		durations = self._transition_durations() if self.uses_transitions() else None
+		if durations:
+			cmd.extend(self._build_inputs_with_transitions(durations))
 			has_complex = True
 		else:
 			concat_part, _ = self._build_concat_simple()
 			cmd.extend(concat_part)
 
-		if self.force_fps60 and not has_complex:
-			if "-vf" in cmd:
-				i = cmd.index("-vf")
-				cmd[i + 1] = cmd[i + 1] + ",fps=60"
-			else:
-				cmd.extend(["-vf", "fps=60"])
-
-		cmd = self._append_delogo(cmd, already_has_filtergraph=has_complex)
-
-		# Select encoder
-		video_encoder_args: List[str]
-		if self.use_nvenc:
-			video_encoder_args = ["-c:v", ("hevc_nvenc" if self.use_hevc else "h264_nvenc"), "-preset", self.encoder_preset, "-b:v", f"{self.bitrate_mbps}M", "-pix_fmt", "yuv420p"]
-		else:
-			if self.use_hevc:
-				video_encoder_args = ["-c:v", "libx265", "-preset", self.encoder_preset, "-crf", "20", "-b:v", f"{self.bitrate_mbps}M", "-pix_fmt", "yuv420p"]
-			else:
-				video_encoder_args = ["-c:v", "libx264", "-preset", self.encoder_preset, "-crf", "18", "-tune", "film", "-b:v", f"{self.bitrate_mbps}M", "-pix_fmt", "yuv420p"]
-		cmd.extend(video_encoder_args)
-
-		# Audio
-		if self.keep_audio and "-map" not in cmd:
-			cmd.extend(["-c:a", "aac", "-b:a", "192k"])
-		elif not self.keep_audio and "-map" not in cmd:
-			cmd.extend(["-an"])
-		if "-map" in cmd and "[af]" in cmd:
-			cmd.extend(["-c:a", "aac", "-b:a", "192k"])
+		if not has_complex:
+			cmd = self._append_region_blur(cmd)
+		return cmd
 
+	def _audio_args(self, head: List[str]) -> List[str]:
+		"""Tùy chọn audio của output theo phần giải mã + filter head."""
+		if self.keep_audio and "-map" not in head:
+			return ["-c:a", "aac", "-b:a", "192k"]
+		if not self.keep_audio and "-map" not in head:
+			return ["-an"]
+		if "-map" in head and "[af]" in head:
+			return ["-c:a", "aac", "-b:a", "192k"]
+		return []
+
+	def _mux_args(self) -> List[str]:
+		"""Thread, faststart, thời lượng và metadata của output."""
+		cmd: List[str] = []
 		# Threads
 		if self.threads and self.threads > 0:
 			cmd.extend(["-threads", str(self.threads)])
@@ -395,39 +1016,157 @@ class FFmpegPipelineBuilder:
 			cmd.extend(["-t", f"{self.expected_total_duration_seconds:.3f}", "-shortest"])
 		else:
 			cmd.extend(["-shortest"])  # safeguard
+			# Đường concat không cần -t, nhưng vẫn cần tổng thời lượng cho thanh tiến trình
+			durs = self._transition_durations()
+			if durs:
+				self.expected_total_duration_seconds = sum(durs)
 
 		# Metadata removal
 		if self.reencode_metadata:
 			cmd.extend(["-map_metadata", "-1"])  # Xóa tất cả metadata
 
-		# QR code hiding (blur corners)
-		if self.hide_qr:
-			cmd = self._append_qr_blur(cmd, already_has_filtergraph=has_complex)
-
 		return cmd
 
-	def _append_qr_blur(self, cmd: List[str], already_has_filtergraph: bool = False) -> List[str]:
-		"""Thêm blur cho các góc để ẩn QR code"""
-		# Blur các góc của video để ẩn QR code
-		qr_blur_filter = "split[base][qr1][qr2][qr3][qr4];[qr1]crop=200:200:0:0,boxblur=10:2[blur1];[qr2]crop=200:200:iw-200:0,boxblur=10:2[blur2];[qr3]crop=200:200:0:ih-200,boxblur=10:2[blur3];[qr4]crop=200:200:iw-200:ih-200,boxblur=10:2[blur4];[base][blur1]overlay=0:0[tmp1];[tmp1][blur2]overlay=iw-200:0[tmp2];[tmp2][blur3]overlay=0:ih-200[tmp3];[tmp3][blur4]overlay=iw-200:ih-200[final]"
-		
-		if already_has_filtergraph:
-			# Nếu đã có filter graph, thêm vào cuối
-			if "-filter_complex" in cmd:
-				idx = cmd.index("-filter_complex")
-				cmd[idx + 1] = cmd[idx + 1] + ";" + qr_blur_filter
-			else:
-				cmd.extend(["-filter_complex", qr_blur_filter])
-			# Cập nhật map để sử dụng output cuối cùng
-			if "-map" in cmd:
-				map_idx = cmd.index("-map")
-				cmd[map_idx + 1] = "[final]"
+	def _rendition_builder(self, rendition: Rendition) -> "FFmpegPipelineBuilder":
+		"""Bản sao chỉ khác tùy chọn encoder, để dựng tham số encoder của một rendition."""
+		sub = copy.copy(self)
+		if rendition.hevc is not None:
+			sub.use_hevc = rendition.hevc
+		if rendition.bitrate_mbps:
+			sub.bitrate_mbps = rendition.bitrate_mbps
+		# Dung lượng mục tiêu/2 lượt tính cho một file: mỗi bản dùng CRF với trần bitrate riêng
+		sub.rate_control = "crf"
+		sub.build_notes = []
+		caps = detect_capabilities(_FFMPEG_BIN)
+		if sub.use_hevc and not sub.use_nvenc and caps is not None and not caps.has_encoder("libx265"):
+			sub.use_hevc = False
+			self.build_notes.append(f"Bản ffmpeg không có libx265: {rendition.path} xuất H.264")
+		return sub
+
+	def build_renditions(self) -> List[str]:
+		"""Một lệnh ffmpeg xuất mọi bản trong self.renditions (đường dẫn output đã nằm trong lệnh).
+
+		Giải mã, chuẩn hóa, transition, che logo/QR chạy một lần; sau đó split ra từng bản,
+		mỗi bản scale (lanczos) và encoder riêng trong cùng tiến trình.
+		"""
+		if not self.renditions:
+			raise ValueError("Chưa có rendition nào")
+		self.prefetch_probes()
+		self.build_notes = []
+		self.expected_total_duration_seconds = None
+		self._apply_capabilities()
+		if self.rate_control == "target_size":
+			self.build_notes.append("Xuất nhiều bản: mỗi bản dùng CRF với trần bitrate riêng, không encode 2 lượt")
+		head = self._build_decode_filter()
+		size = self._output_size()
+		if "-filter_complex" in head:
+			i = head.index("-filter_complex")
+			graph = head[i + 1]
+			audio = "[af]" if "[af]" in head[i + 2:] else None
 		else:
-			# Tạo filter graph mới
-			cmd.extend(["-vf", qr_blur_filter])
-		
+			i = head.index("-vf")
+			# Chuỗi -vf (kể cả graph nhiều nhánh của chế độ che "blur") có một đầu vào và một đầu ra
+			graph = f"[0:v]{head[i + 1]}[vf]"
+			audio = "0:a?" if self.keep_audio else None
+		head = head[:i]
+
+		n = len(self.renditions)
+		parts = [graph, f"[vf]split={n}" + "".join(f"[vr{k}]" for k in range(n))]
+		for k, r in enumerate(self.renditions):
+			w, h = r.frame_size(size)
+			scale = f"scale={w}:{h}:flags=lanczos" if (w, h) != size else "null"
+			parts.append(f"[vr{k}]{scale}[vo{k}]")
+		if audio == "[af]":
+			parts.append(f"[af]asplit={n}" + "".join(f"[ao{k}]" for k in range(n)))
+		cmd = head + ["-filter_complex", ";".join(parts)]
+		mux = self._mux_args()
+		for k, r in enumerate(self.renditions):
+			cmd.extend(["-map", f"[vo{k}]"])
+			if audio:
+				cmd.extend(["-map", f"[ao{k}]" if audio == "[af]" else audio, "-c:a", "aac", "-b:a", "192k"])
+			else:
+				cmd.append("-an")
+			cmd.extend(self._rendition_builder(r)._video_encoder_args())
+			cmd.extend(mux)
+			cmd.append(r.path)
 		return cmd
 
+	def target_video_kbps(self) -> Optional[int]:
+		"""Bitrate video trung bình (kb/s) để file ra đúng target_size_mb; None nếu không đọc được thời lượng."""
+		if self.video_kbps_override:
+			return self.video_kbps_override
+		if not self.target_size_mb:
+			return None
+		layout = self.timeline_offsets()
+		if not layout or layout[1] <= 0:
+			return None
+		audio_kbps = 192 if self.keep_audio else 0
+		# ~1% cho container MP4 (moov, header từng chunk)
+		total_kbps = self.target_size_mb * 1024 * 1024 * 8 / 1000.0 / layout[1] * 0.99
+		return max(100, int(total_kbps - audio_kbps))
+
+	def _rate_control_args(self) -> List[str]:
+		kbps = self.target_video_kbps() if self.rate_control == "target_size" else None
+		if kbps is None:
+			if self.rate_control == "target_size":
+				self.build_notes.append("Không đọc được thời lượng: dùng CRF với trần bitrate thay cho dung lượng mục tiêu")
+			# CRF quyết định chất lượng, VBV giới hạn đỉnh bitrate ở bitrate_mbps
+			cap = ["-maxrate", f"{self.bitrate_mbps}M", "-bufsize", f"{self.bitrate_mbps * 2}M"]
+			if self.use_nvenc:
+				# Chỉ dùng tùy chọn chung: lệnh còn phải chạy được khi quay về libx264/libx265
+				return ["-b:v", f"{self.bitrate_mbps}M"] + cap
+			return ["-crf", "20" if self.use_hevc else "18"] + cap
+		args = ["-b:v", f"{kbps}k", "-maxrate", f"{kbps * 2}k", "-bufsize", f"{kbps * 4}k"]
+		if self.encode_pass and self.pass_log and not self.use_nvenc:
+			if self.use_hevc:
+				# Giá trị trong dấu nháy đơn: đường dẫn Windows (C:\...) có dấu ':'
+				args.extend(["-x265-params", f"pass={self.encode_pass}:stats='{self.pass_log}.x265.log'"])
+			else:
+				args.extend(["-pass", str(self.encode_pass), "-passlogfile", self.pass_log])
+		return args
+
+	def _video_encoder_args(self) -> List[str]:
+		"""Encoder video đầu ra theo tùy chọn xuất (gọi sau _apply_capabilities)."""
+		rate = self._rate_control_args()
+		if self.use_nvenc:
+			return ["-c:v", ("hevc_nvenc" if self.use_hevc else "h264_nvenc"), "-preset", self.encoder_preset] + rate + ["-pix_fmt", "yuv420p"]
+		if self.use_hevc:
+			return ["-c:v", "libx265", "-preset", self.encoder_preset] + rate + ["-pix_fmt", "yuv420p"]
+		return ["-c:v", "libx264", "-preset", self.encoder_preset, "-tune", "film"] + rate + ["-pix_fmt", "yuv420p"]
+
+	def _apply_capabilities(self) -> None:
+		"""Chỉnh tùy chọn theo khả năng thực của ffmpeg trên máy trước khi chạy lần đầu.
+
+		Tránh phải chạy ffmpeg, thất bại rồi encode lại từ đầu với CPU (xem run_ffmpeg_with_progress).
+		"""
+		caps = detect_capabilities(_FFMPEG_BIN)
+		if caps is None:
+			return
+		if self.hwaccel_decode and not caps.has_hwaccel("cuda"):
+			self.hwaccel_decode = False
+			self.build_notes.append("CUDA không khả dụng: giải mã bằng CPU")
+		if self.use_nvenc:
+			nvenc = "hevc_nvenc" if self.use_hevc else "h264_nvenc"
+			if not caps.has_encoder(nvenc):
+				self.use_nvenc = False
+				self.build_notes.append(f"{nvenc} không khả dụng: encode bằng CPU")
+		if not self.use_nvenc and self.use_hevc and not caps.has_encoder("libx265"):
+			if caps.has_encoder("hevc_nvenc"):
+				self.use_nvenc = True
+				self.build_notes.append("Bản ffmpeg không có libx265: dùng hevc_nvenc")
+			else:
+				self.use_hevc = False
+				self.build_notes.append("Bản ffmpeg không có libx265: xuất H.264")
+		if not self.use_nvenc and not self.use_hevc and not caps.has_encoder("libx264") and caps.has_encoder("h264_nvenc"):
+			self.use_nvenc = True
+			self.build_notes.append("Bản ffmpeg không có libx264: dùng h264_nvenc")
+		if self.use_lut and not caps.has_filter("lut3d"):
+			self.use_lut = False
+			self.build_notes.append("Bản ffmpeg không có filter lut3d: bỏ qua LUT")
+		if self.transition is not None and not (caps.has_filter("xfade") and caps.has_filter("acrossfade")):
+			self.transition = None
+			self.build_notes.append(f"FFmpeg {caps.version or '?'} không có xfade: ghép nối tiếp không transition")
+
 	def _get_smooth_xfade_params(self, transition: str, duration: float, offset: float, smooth: bool = True) -> str:
 		"""Tạo tham số xfade mượt mà, tránh nhiễu sóng"""
 		transition_map = {
@@ -491,18 +1230,11 @@ class FFmpegPipelineBuilder:
 
 
 def _retry_with_cpu_encoder(cmd: List[str]) -> Optional[List[str]]:
-	# Replace NVENC with CPU encoders
-	new = list(cmd)
-	if "h264_nvenc" in new:
-		idx = new.index("h264_nvenc")
-		new[idx] = "libx264"
-		# remove NVENC-only options if any (keep preset)
-		return new
-	if "hevc_nvenc" in new:
-		idx = new.index("hevc_nvenc")
-		new[idx] = "libx265"
-		return new
-	return None
+	# Replace NVENC with CPU encoders (every output: build_renditions() has one encoder per rendition)
+	cpu = {"h264_nvenc": "libx264", "hevc_nvenc": "libx265"}
+	new = [cpu.get(arg, arg) for arg in cmd]
+	# remove NVENC-only options if any (keep preset)
+	return new if new != list(cmd) else None
 
 
 def _strip_hwaccel_flags(cmd: List[str]) -> List[str]:
@@ -520,61 +1252,273 @@ def _strip_hwaccel_flags(cmd: List[str]) -> List[str]:
 	return new
 
 
-def run_ffmpeg_with_progress(cmd: List[str], total_duration_hint: Optional[float], on_progress):
+class RenderCancelled(Exception):
+	"""Người dùng đã hủy tiến trình ffmpeg đang chạy."""
+
+
+def _remove_partial_output(cmd: List[str]) -> None:
+	out = cmd[-1] if cmd and not cmd[-1].startswith("-") else None
+	if out and os.path.isfile(out):
+		try:
+			os.remove(out)
+		except OSError:
+			pass
+
+
+@dataclass
+class ProgressInfo:
+	"""Một khối tiến trình từ luồng -progress của ffmpeg."""
+	frame: Optional[int] = None
+	fps: Optional[float] = None
+	speed: Optional[float] = None
+	out_time: Optional[float] = None
+	total_size: Optional[int] = None
+	percent: Optional[float] = None
+	eta_seconds: Optional[float] = None
+	done: bool = False
+
+	def summary(self) -> str:
+		parts = []
+		if self.frame is not None:
+			parts.append(f"frame={self.frame}")
+		if self.fps is not None:
+			parts.append(f"fps={self.fps:.1f}")
+		if self.speed is not None:
+			parts.append(f"speed={self.speed:.2f}x")
+		if self.percent is not None:
+			parts.append(f"{self.percent:.1f}%")
+		if self.eta_seconds is not None:
+			m, sec = divmod(int(self.eta_seconds + 0.5), 60)
+			parts.append(f"ETA {m:02d}:{sec:02d}")
+		return " ".join(parts)
+
+
+# Số dòng stderr cuối cùng được giữ lại để báo lỗi
+_STDERR_TAIL_LINES = 200
+
+
+def _parse_progress_block(block: Dict[str, str], total: Optional[float]) -> ProgressInfo:
+	info = ProgressInfo(done=(block.get("progress") == "end"))
+	try:
+		info.frame = int(block["frame"])
+	except (KeyError, ValueError):
+		pass
+	try:
+		info.fps = float(block["fps"])
+	except (KeyError, ValueError):
+		pass
+	try:
+		info.speed = float(block.get("speed", "").rstrip("x"))
+	except ValueError:
+		pass
+	try:
+		info.total_size = int(block["total_size"])
+	except (KeyError, ValueError):
+		pass
+	# out_time_us (và out_time_ms, thực chất cũng là micro giây) tùy phiên bản ffmpeg
+	for key in ("out_time_us", "out_time_ms"):
+		try:
+			info.out_time = max(0.0, int(block[key]) / 1_000_000.0)
+			break
+		except (KeyError, ValueError):
+			continue
+	if total and total > 0 and info.out_time is not None:
+		info.percent = min(100.0, info.out_time / total * 100.0)
+		if info.speed and info.speed > 0:
+			info.eta_seconds = max(0.0, (total - info.out_time) / info.speed)
+	if info.done:
+		info.percent = 100.0 if total else info.percent
+		info.eta_seconds = 0.0
+	return info
+
+
+def _windows_process_usage(proc: subprocess.Popen) -> Tuple[Optional[float], Optional[float], Optional[int]]:
+	"""CPU user/kernel (giây) và working set đỉnh (byte) của tiến trình con đã kết thúc trên Windows."""
+	import ctypes
+	from ctypes import wintypes
+
+	class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+		_fields_ = [
+			("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+			("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+			("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+			("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+			("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t),
+		]
+
+	handle = wintypes.HANDLE(int(proc._handle))
+	kernel32 = ctypes.windll.kernel32
+	user = system = None
+	times = [wintypes.FILETIME() for _ in range(4)]
+	if kernel32.GetProcessTimes(handle, *[ctypes.byref(t) for t in times]):
+		to_sec = lambda ft: ((ft.dwHighDateTime << 32) | ft.dwLowDateTime) / 1e7
+		system, user = to_sec(times[2]), to_sec(times[3])
+	peak = None
+	counters = PROCESS_MEMORY_COUNTERS()
+	counters.cb = ctypes.sizeof(counters)
+	if kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+		peak = int(counters.PeakWorkingSetSize)
+	return user, system, peak
+
+
+def _wait_with_usage(proc: subprocess.Popen) -> Tuple[Optional[float], Optional[float], Optional[int]]:
+	"""Chờ tiến trình ffmpeg kết thúc, trả về (CPU user, CPU system, RSS đỉnh tính bằng byte).
+
+	POSIX dùng os.wait4 để lấy rusage của đúng tiến trình này (không lẫn với các job chạy
+	song song); Windows đọc GetProcessTimes/GetProcessMemoryInfo. Không đo được thì trả None.
+	"""
+	if hasattr(os, "wait4"):
+		try:
+			_, status, usage = os.wait4(proc.pid, 0)
+		except ChildProcessError:
+			# Luồng hủy đã thu hồi tiến trình trước (proc.wait), không còn rusage
+			proc.wait()
+			return None, None, None
+		proc.returncode = os.waitstatus_to_exitcode(status)
+		# ru_maxrss: KB trên Linux, byte trên macOS
+		peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+		return usage.ru_utime, usage.ru_stime, peak
+	proc.wait()
+	if os.name == "nt":
+		try:
+			return _windows_process_usage(proc)
+		except Exception:
+			pass
+	return None, None, None
+
+
+def run_ffmpeg_with_progress(cmd: List[str], total_duration_hint: Optional[float], on_progress, cancel_event: Optional[threading.Event] = None,
+							 on_stats: Optional[Callable[[ProgressInfo], None]] = None, options: Optional[Dict] = None,
+							 record_history: bool = True) -> RenderReport:
+	"""Chạy ffmpeg, đọc tiến trình dạng key=value từ -progress pipe:1.
+
+	on_progress(pct, line) nhận phần trăm + dòng tóm tắt (frame/fps/speed/ETA) cho mỗi khối
+	tiến trình, và (None, line) cho các dòng log từ stderr (gọi từ luồng đọc stderr).
+	on_stats nhận ProgressInfo đầy đủ. Stderr chỉ giữ _STDERR_TAIL_LINES dòng cuối.
+
+	Trả về RenderReport (thời gian, fps, CPU, RAM đỉnh, kích thước/bitrate file ra, encoder,
+	filter, fallback đã dùng); options là mô tả tùy chọn của job để so sánh giữa các lần chạy.
+	Khi record_history, báo cáo (kể cả lần lỗi/bị hủy) được ghi vào default_history().
+	"""
 	if not (len(cmd) >= 2 and not cmd[-1].startswith("-")):
 		from datetime import datetime
 		out = f"output_{datetime.now().strftime('%Y%m%d_%H%M')}.mp4"
 		cmd = list(cmd) + [out]
 
+	report = new_report(options)
+	last_info: List[ProgressInfo] = []
+
 	def exec_once(c: List[str]) -> Tuple[int, str]:
-		proc = subprocess.Popen(c, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-		total = total_duration_hint
-		stderr_acc = []
-		while True:
-			line = proc.stderr.readline()
-			if not line:
-				break
-			stderr_acc.append(line)
-			line_strip = line.strip()
-			if on_progress:
-				pct = None
-				if "time=" in line_strip and total:
+		if cancel_event is not None and cancel_event.is_set():
+			raise RenderCancelled()
+		run_cmd = [c[0], "-progress", "pipe:1", "-nostats"] + list(c[1:])
+		proc = subprocess.Popen(run_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+		finished = threading.Event()
+
+		def watch_cancel():
+			# Dừng ffmpeg ngay khi có yêu cầu hủy, kể cả khi stderr đang im lặng
+			while not finished.is_set():
+				if cancel_event.wait(0.2):
+					proc.terminate()
 					try:
-						tpart = line_strip.split("time=")[-1].split(" ")[0]
-						h, m, s = tpart.split(":")
-						cur = float(h) * 3600 + float(m) * 60 + float(s)
-						if total and cur is not None and total > 0:
-							pct = min(100.0, max(0.0, cur / total * 100.0))
-					except Exception:
-						pct = None
-				on_progress(pct, line_strip)
-		proc.wait()
-		return proc.returncode, ''.join(stderr_acc)
-
-	ret, err = exec_once(cmd)
-	# Fallback for missing CUDA hwaccel
-	cuda_err_markers = ["Cannot load nvcuda.dll", "Could not dynamically load CUDA", "device type cuda", "Hardware device setup failed"]
-	if ret != 0 and any(m in err for m in cuda_err_markers):
-		fallback_no_hw = _strip_hwaccel_flags(cmd)
-		if on_progress:
-			on_progress(None, "CUDA hwaccel không khả dụng. Đang thử lại với giải mã CPU...")
-		ret, err = exec_once(fallback_no_hw)
-		if ret == 0:
-			return
-		else:
-			raise subprocess.CalledProcessError(ret, fallback_no_hw)
-
-	# Fallback encoder if NVENC fails
-	if ret != 0 and ("h264_nvenc" in cmd or "hevc_nvenc" in cmd):
-		fallback = _retry_with_cpu_encoder(cmd)
-		if fallback is not None:
+						proc.wait(timeout=5)
+					except subprocess.TimeoutExpired:
+						proc.kill()
+					return
+
+		stderr_tail: Deque[str] = deque(maxlen=_STDERR_TAIL_LINES)
+
+		def read_stderr():
+			for line in proc.stderr:
+				stderr_tail.append(line)
+				line_strip = line.strip()
+				if on_progress and line_strip:
+					on_progress(None, line_strip)
+
+		if cancel_event is not None:
+			threading.Thread(target=watch_cancel, daemon=True).start()
+		stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+		stderr_thread.start()
+		total = total_duration_hint
+		block: Dict[str, str] = {}
+		try:
+			for line in proc.stdout:
+				key, sep, value = line.strip().partition("=")
+				if not sep:
+					continue
+				block[key] = value
+				if key != "progress":
+					continue
+				info = _parse_progress_block(block, total)
+				block = {}
+				last_info[:] = [info]
+				if on_stats:
+					on_stats(info)
+				if on_progress:
+					on_progress(info.percent, info.summary())
+			user, system, peak = _wait_with_usage(proc)
+			stderr_thread.join(timeout=5)
+		finally:
+			finished.set()
+		report.attempts += 1
+		if user is not None:
+			report.cpu_user_seconds = (report.cpu_user_seconds or 0.0) + user
+			report.cpu_system_seconds = (report.cpu_system_seconds or 0.0) + (system or 0.0)
+		if peak is not None:
+			report.peak_rss_mb = max(report.peak_rss_mb or 0.0, peak / (1024 * 1024))
+		if cancel_event is not None and cancel_event.is_set():
+			_remove_partial_output(c)
+			raise RenderCancelled()
+		return proc.returncode, ''.join(stderr_tail)
+
+	t0 = time.monotonic()
+	final_cmd = cmd
+	describe_command(report, final_cmd)
+	try:
+		ret, err = exec_once(cmd)
+		# Fallback for missing CUDA hwaccel
+		cuda_err_markers = ["Cannot load nvcuda.dll", "Could not dynamically load CUDA", "device type cuda", "Hardware device setup failed"]
+		if ret != 0 and any(m in err for m in cuda_err_markers):
+			final_cmd = _strip_hwaccel_flags(cmd)
+			report.fallback_path.append("cuda_strip")
+			invalidate_capabilities(cmd[0])
 			if on_progress:
-				on_progress(None, "NVENC thất bại, đang thử lại với CPU encoder...")
-			ret, err = exec_once(fallback)
-			if ret == 0:
-				return
-			else:
-				raise subprocess.CalledProcessError(ret, fallback)
-	else:
+				on_progress(None, "CUDA hwaccel không khả dụng. Đang thử lại với giải mã CPU...")
+			ret, err = exec_once(final_cmd)
+		# Fallback encoder if NVENC fails
+		elif ret != 0 and ("h264_nvenc" in cmd or "hevc_nvenc" in cmd):
+			fallback = _retry_with_cpu_encoder(cmd)
+			if fallback is not None:
+				final_cmd = fallback
+				report.fallback_path.append("nvenc_to_cpu")
+				invalidate_capabilities(cmd[0])
+				if on_progress:
+					on_progress(None, "NVENC thất bại, đang thử lại với CPU encoder...")
+				ret, err = exec_once(final_cmd)
+		report.returncode = ret
 		if ret != 0:
-			raise subprocess.CalledProcessError(ret, cmd)
+			report.status = "failed"
+			report.error = "".join(err.strip().splitlines(True)[-5:])
+			raise subprocess.CalledProcessError(ret, final_cmd, stderr=err)
+	except RenderCancelled:
+		report.status = "cancelled"
+		raise
+	except FileNotFoundError as e:
+		report.status = "failed"
+		report.error = str(e)
+		raise
+	finally:
+		report.wall_seconds = time.monotonic() - t0
+		describe_command(report, final_cmd)
+		if last_info:
+			info = last_info[0]
+			report.frames = info.frame
+			report.media_seconds = info.out_time
+			if info.frame is not None and report.wall_seconds > 0:
+				report.encode_fps = info.frame / report.wall_seconds
+			if info.out_time and report.wall_seconds > 0:
+				report.speed = info.out_time / report.wall_seconds
+		finalize_output(report)
+		if record_history:
+			default_history().append(report)
+	return report
@@ -0,0 +1,224 @@
+"""Đo chi phí từng bước của filter graph mà build() tạo ra, tính theo ms CPU / frame output.
+
+Cách đo: lấy một đoạn mẫu của timeline (windowed(), cùng cách với encode chia đoạn và xem
+trước), chạy ffmpeg -benchmark ra muxer null với các tiền tố tăng dần của chuỗi filter:
+chỉ giải mã, rồi thêm lần lượt từng filter, cuối cùng thêm encoder. Chi phí một bước là
+phần CPU tăng thêm so với tiền tố ngay trước nó. Với timeline có transition, chuỗi chuẩn hóa
+được đo trên clip đầu; xfade = cả graph video trừ tổng các chuỗi từng clip.
+
+Chạy:
+
+	python profiler.py a.mp4 b.mp4
+	python profiler.py a.mp4 --options '{"film_grain": true, "preset": "medium"}' --duration 4
+
+Số liệu là CPU (user + sys) nên không phụ thuộc số thread; bước rất rẻ có thể ra số âm nhỏ
+do dao động đo, được in là 0.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from processing import FFmpegPipelineBuilder
+from preview import preview_window
+
+
+@dataclass
+class StageCost:
+	stage: str
+	ms_per_frame: float
+	share: float = 0.0
+
+
+_BENCH_RE = re.compile(r"utime=([\d.]+)s stime=([\d.]+)s")
+# Các tùy chọn đầu ra của build() không liên quan đến chi phí xử lý frame
+_OUTPUT_FLAGS = ("-c:a", "-b:a", "-an", "-threads", "-filter_threads", "-movflags", "-t", "-shortest", "-map_metadata", "-map")
+
+
+def split_stages(graph: str) -> List[str]:
+	"""Tách chuỗi -vf thành các bước đo riêng được.
+
+	Tách theo dấu phẩy ở cấp ngoài cùng; từ filter đầu tiên có nhãn [..] (ví dụ split/overlay
+	của chế độ che "blur") trở đi, phần còn lại là một graph nhiều nhánh nên gộp thành một bước.
+	"""
+	stages: List[str] = []
+	depth = 0
+	cur = ""
+	for i, ch in enumerate(graph):
+		if ch == "[":
+			# Đã vào phần graph có nhãn: gộp phần còn lại vào bước hiện tại
+			stages.append(cur + graph[i:])
+			return [s for s in stages if s]
+		if ch == "(":
+			depth += 1
+		elif ch == ")":
+			depth -= 1
+		if ch == "," and depth == 0:
+			stages.append(cur)
+			cur = ""
+		else:
+			cur += ch
+	stages.append(cur)
+	return [s for s in stages if s]
+
+
+def _option_value(cmd: List[str], flag: str) -> Optional[str]:
+	return cmd[cmd.index(flag) + 1] if flag in cmd and cmd.index(flag) + 1 < len(cmd) else None
+
+
+def _encoder_args(cmd: List[str]) -> List[str]:
+	"""Các cặp tùy chọn encoder video của build() (từ -c:v đến trước phần audio/mux)."""
+	if "-c:v" not in cmd:
+		return []
+	args: List[str] = []
+	i = cmd.index("-c:v")
+	while i < len(cmd) - 1 and cmd[i] not in _OUTPUT_FLAGS and cmd[i].startswith("-"):
+		args.extend(cmd[i:i + 2])
+		i += 2
+	return args
+
+
+def _input_args(cmd: List[str]) -> List[str]:
+	"""Phần input (kèm -hwaccel/-ss/-t) của lệnh build(), bỏ ffmpeg và -y."""
+	end = max(i for i, a in enumerate(cmd) if a == "-i") + 2
+	return [a for a in cmd[1:end] if a != "-y"]
+
+
+def _cpu_seconds(ffmpeg_bin: str, args: List[str], repeat: int) -> float:
+	"""CPU nhỏ nhất (user + sys) sau repeat lần chạy ffmpeg -benchmark ... -f null -."""
+	best: Optional[float] = None
+	cmd = [ffmpeg_bin, "-hide_banner", "-nostats", "-benchmark"] + args + ["-f", "null", "-"]
+	for _ in range(max(1, repeat)):
+		res = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+		m = _BENCH_RE.search(res.stderr)
+		if res.returncode != 0 or not m:
+			raise subprocess.CalledProcessError(res.returncode, cmd, stderr=res.stderr[-4000:])
+		cpu = float(m.group(1)) + float(m.group(2))
+		best = cpu if best is None else min(best, cpu)
+	return best or 0.0
+
+
+def profile_builder(builder: FFmpegPipelineBuilder, start: Optional[float] = None, duration: float = 3.0, repeat: int = 2,
+					on_line: Optional[Callable[[str], None]] = None) -> List[StageCost]:
+	"""Chi phí từng bước (giải mã, từng filter, che logo/QR, xfade, encoder) của job, xếp từ đắt đến rẻ.
+
+	start None: đoạn mẫu đặt quanh transition đầu tiên (nếu có) để đo cả xfade, không thì từ 0.
+	"""
+	layout = builder.timeline_offsets()
+	if start is None:
+		start = max(0.0, layout[0][1] - duration / 2.0) if layout and builder.uses_transitions() else 0.0
+	windows, a, b = preview_window(builder, start, duration)
+	tran = layout[2] if layout and builder.uses_transitions() else None
+	sub = builder.windowed(windows, tran)
+	try:
+		cmd = sub.build()
+	finally:
+		sub.cleanup()
+	ffmpeg_bin = cmd[0]
+	inputs = _input_args(cmd)
+	encoder = _encoder_args(cmd)
+	info = sub._probe(windows[0][0])
+	fps = sub._out_fps() or (info.fps if info and info.fps else 30.0)
+
+	def run(args: List[str], label: str) -> float:
+		cpu = _cpu_seconds(ffmpeg_bin, args, repeat)
+		if on_line:
+			on_line(f"{label}: {cpu:.2f}s CPU")
+		return cpu
+
+	costs: List[Tuple[str, float]] = []
+	frames = max(1.0, (b - a) * fps)
+	vf = _option_value(cmd, "-vf")
+	graph = _option_value(cmd, "-filter_complex")
+	if graph is None:
+		stages = split_stages(vf or "null")
+		prev = run(inputs + ["-map", "0:v:0", "-an"], "giải mã")
+		costs.append(("giải mã", prev))
+		for k in range(1, len(stages) + 1):
+			cur = run(inputs + ["-an", "-vf", ",".join(stages[:k])], stages[k - 1])
+			costs.append((stages[k - 1], cur - prev))
+			prev = cur
+		full_vf = ",".join(stages)
+	else:
+		# [k:v]chuỗi chuẩn hóa[vk] ... [vx]che logo/QR[vf]; bỏ phần audio
+		parts = [p for p in graph.split(";") if not re.match(r"^\[(\d+:a|a\d+|ax\d+|as\d+)\]|^anullsrc", p)]
+		chains = [p for p in parts if re.match(r"^\[\d+:v\]", p)]
+		vx_end = next(i for i, p in enumerate(parts) if p.endswith("[vx]"))
+		up_to_vx = ";".join(parts[:vx_end + 1])
+		# Phần che logo/QR: từ [vx] đến [vf], có thể gồm nhiều nhánh (chế độ "blur")
+		region = ";".join(parts[vx_end + 1:]) or "[vx]null[vf]"
+		clip0 = re.sub(r"^\[0:v\]|\[v0\]$", "", chains[0])
+		clip0_inputs = inputs[:inputs.index("-i") + 2]
+		# Chuỗi chuẩn hóa chạy trên mọi clip với cùng chi phí / frame: ngoại suy từ clip đầu
+		# ra tổng số frame của các clip (nhiều hơn số frame output ở đoạn chồng của xfade)
+		scale = sum(w[2] for w in windows) / max(1e-3, windows[0][2])
+		prev = run(clip0_inputs + ["-map", "0:v:0", "-an"], "giải mã (clip đầu)")
+		costs.append(("giải mã", prev * scale))
+		stages = split_stages(clip0)
+		for k in range(1, len(stages) + 1):
+			cur = run(clip0_inputs + ["-an", "-vf", ",".join(stages[:k])], stages[k - 1])
+			costs.append((stages[k - 1], (cur - prev) * scale))
+			prev = cur
+		chain_total = sum(c for _, c in costs)
+		vx = run(inputs + ["-an", "-filter_complex", up_to_vx, "-map", "[vx]"], "xfade")
+		costs.append(("xfade + format", vx - chain_total))
+		full = run(inputs + ["-an", "-filter_complex", up_to_vx + ";" + region, "-map", "[vf]"], "che logo/QR")
+		costs.append((re.sub(r"^\[vx\]|\[vf\]$", "", region), full - vx))
+		prev = full
+		full_vf = None
+	if encoder:
+		if full_vf is not None:
+			enc = run(inputs + ["-an", "-vf", full_vf] + encoder, "encoder")
+		else:
+			enc = run(inputs + ["-an", "-filter_complex", up_to_vx + ";" + region, "-map", "[vf]"] + encoder, "encoder")
+		costs.append((f"encoder {' '.join(encoder[1:4])}", enc - prev))
+
+	total = sum(max(0.0, c) for _, c in costs) or 1.0
+	result = [StageCost(name, max(0.0, c) / frames * 1000.0, max(0.0, c) / total) for name, c in costs if name != "null"]
+	return sorted(result, key=lambda s: s.ms_per_frame, reverse=True)
+
+
+def format_table(costs: List[StageCost]) -> str:
+	lines = [f"{'ms/frame':>9} {'%':>6}  bước"]
+	for c in costs:
+		stage = c.stage if len(c.stage) <= 70 else c.stage[:67] + "..."
+		lines.append(f"{c.ms_per_frame:9.2f} {c.share * 100:5.1f}%  {stage}")
+	lines.append(f"{sum(c.ms_per_frame for c in costs):9.2f} 100.0%  tổng")
+	return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	from batch import configure_builder
+
+	parser = argparse.ArgumentParser(description="Đo chi phí từng filter/encoder của một job (ms CPU mỗi frame)")
+	parser.add_argument("inputs", nargs="+", help="Các file video của job")
+	parser.add_argument("--options", default="{}", help="Tùy chọn như trong manifest batch (JSON hoặc đường dẫn file JSON)")
+	parser.add_argument("--start", type=float, default=None, help="Đầu đoạn mẫu (giây); mặc định quanh transition đầu tiên")
+	parser.add_argument("--duration", type=float, default=3.0, help="Độ dài đoạn mẫu (giây)")
+	parser.add_argument("--repeat", type=int, default=2, help="Chạy mỗi bước N lần, lấy lần nhanh nhất")
+	parser.add_argument("--json", action="store_true", help="In JSON thay vì bảng")
+	args = parser.parse_args(argv)
+
+	if os.path.isfile(args.options):
+		with open(args.options, "r", encoding="utf-8") as f:
+			options = json.load(f)
+	else:
+		options = json.loads(args.options)
+	# Đo graph thật, không đi đường stream copy
+	options.setdefault("stream_copy", False)
+	builder = configure_builder(args.inputs, options)
+	costs = profile_builder(builder, start=args.start, duration=args.duration, repeat=args.repeat,
+							on_line=lambda line: print(line, file=sys.stderr, flush=True))
+	if args.json:
+		print(json.dumps([c.__dict__ for c in costs], ensure_ascii=False, indent=2))
+	else:
+		print(format_table(costs))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,134 @@
+"""Encode 2 lượt theo dung lượng mục tiêu (rate_control = "target_size").
+
+Bitrate video trung bình = target_size_mb / thời lượng timeline (đã probe) - bitrate audio
+(FFmpegPipelineBuilder.target_video_kbps). Lượt 1 chỉ phân tích (x264/x265 ghi file stats,
+ra muxer null), lượt 2 phân bổ bit theo stats nên file ra sát dung lượng mục tiêu mà không
+phí bit ở đoạn tĩnh. Đỉnh bitrate vẫn bị giới hạn (maxrate = 2 lần trung bình).
+
+Stats của lượt 1 lưu trong app_cache_dir("twopass"), khóa bằng render_cache.job_key (cùng
+input + cùng tùy chọn, gồm cả dung lượng mục tiêu): render lại job giống hệt chỉ chạy lượt 2.
+NVENC không có stats 2 lượt: encode một lượt với -b:v trung bình và trần maxrate.
+"""
+import copy
+import glob
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+from app_paths import app_cache_dir
+from history import RenderReport, default_history
+from processing import FFmpegPipelineBuilder, run_ffmpeg_with_progress
+from render_cache import job_key
+
+# Lượt 1 (x264 tự chạy nhanh: không subme/trellis cao) tốn khoảng chừng này so với lượt 2
+FIRST_PASS_SHARE = 0.35
+# Stats không dùng lại sau chừng này ngày thì bị xóa
+STATS_MAX_AGE_DAYS = 30
+
+
+def _stats_ready(prefix: str, hevc: bool) -> bool:
+	return os.path.isfile(f"{prefix}.x265.log" if hevc else f"{prefix}-0.log")
+
+
+def _prune_stats(root: str) -> None:
+	cutoff = time.time() - STATS_MAX_AGE_DAYS * 86400
+	for path in glob.glob(os.path.join(root, "*")):
+		try:
+			if os.path.getmtime(path) < cutoff:
+				os.remove(path)
+		except OSError:
+			pass
+
+
+def stats_prefix(builder: FFmpegPipelineBuilder) -> Optional[str]:
+	"""Tiền tố file stats lượt 1 của job; None nếu không tính được khóa job."""
+	key = job_key(builder)
+	return os.path.join(app_cache_dir("twopass"), key) if key else None
+
+
+def uses_two_pass(builder: FFmpegPipelineBuilder) -> bool:
+	if builder.rate_control != "target_size" or builder.use_nvenc:
+		return False
+	if builder.allow_stream_copy and not builder._stream_copy_blockers():
+		return False
+	return builder.target_video_kbps() is not None
+
+
+def render_with_rate_control(builder: FFmpegPipelineBuilder, output_path: str,
+							 on_progress: Optional[Callable[[Optional[float], str], None]] = None,
+							 cancel_event: Optional[threading.Event] = None,
+							 on_notes: Optional[Callable[[List[str]], None]] = None) -> RenderReport:
+	"""Render job một lượt, hoặc 2 lượt khi rate_control = "target_size" (dùng lại stats nếu có).
+
+	on_notes nhận build_notes của lệnh cuối cùng (để in/ghi log như đường render một lượt).
+	"""
+	builder.prefetch_probes()
+	builder._apply_capabilities()
+	prefix = stats_prefix(builder) if uses_two_pass(builder) else None
+	if prefix is None:
+		cmd = builder.build() + [output_path]
+		if on_notes:
+			on_notes(builder.build_notes)
+		return run_ffmpeg_with_progress(cmd, builder.expected_total_duration_seconds, on_progress,
+										cancel_event=cancel_event, options=builder.describe_options())
+
+	def scaled(lo: float, share: float, label: str):
+		def cb(pct: Optional[float], line: str) -> None:
+			if on_progress:
+				on_progress(None if pct is None else lo + pct * share, f"{label}: {line}" if pct is not None else line)
+		return cb
+
+	root = os.path.dirname(prefix)
+	reused = _stats_ready(prefix, builder.use_hevc)
+	first: Optional[RenderReport] = None
+	if not reused:
+		_prune_stats(root)
+		part = f"{prefix}.part"
+		first_pass = copy.copy(builder)
+		first_pass.encode_pass, first_pass.pass_log = 1, part
+		# Lượt 1 chỉ cần video: không encode audio, không ghi file
+		first_pass.keep_audio = False
+		first_pass.faststart = False
+		first_pass.build_notes = []
+		first_pass._temp_files = []
+		try:
+			cmd = first_pass.build() + ["-f", "null", os.devnull]
+			first = run_ffmpeg_with_progress(cmd, first_pass.expected_total_duration_seconds,
+											 scaled(0.0, FIRST_PASS_SHARE, "Lượt 1/2"), cancel_event=cancel_event,
+											 record_history=False)
+		finally:
+			first_pass.cleanup()
+		# Chỉ đổi tên khi lượt 1 xong: stats dở dang không bao giờ được dùng lại
+		for path in glob.glob(glob.escape(part) + "*"):
+			os.replace(path, prefix + path[len(part):])
+	elif on_progress:
+		on_progress(FIRST_PASS_SHARE * 100.0, "Dùng lại stats lượt 1 của lần render trước (cùng input + tùy chọn)")
+
+	second = copy.copy(builder)
+	second.encode_pass, second.pass_log = 2, prefix
+	cmd = second.build() + [output_path]
+	if on_notes:
+		on_notes(second.build_notes)
+	options = dict(builder.describe_options(), two_pass="reused" if reused else "new",
+				   target_video_kbps=builder.target_video_kbps())
+	report = run_ffmpeg_with_progress(cmd, second.expected_total_duration_seconds,
+									  scaled(FIRST_PASS_SHARE * 100.0, 1.0 - FIRST_PASS_SHARE, "Lượt 2/2"),
+									  cancel_event=cancel_event, options=options, record_history=False)
+	# Lịch sử ghi cả hai lượt như một lần render
+	if first is not None:
+		report.wall_seconds += first.wall_seconds
+		report.attempts += first.attempts
+		if first.cpu_user_seconds is not None and report.cpu_user_seconds is not None:
+			report.cpu_user_seconds += first.cpu_user_seconds
+			report.cpu_system_seconds = (report.cpu_system_seconds or 0.0) + (first.cpu_system_seconds or 0.0)
+		if first.peak_rss_mb is not None:
+			report.peak_rss_mb = max(report.peak_rss_mb or 0.0, first.peak_rss_mb)
+		if report.frames and report.wall_seconds > 0:
+			report.encode_fps = report.frames / report.wall_seconds
+		if report.media_seconds and report.wall_seconds > 0:
+			report.speed = report.media_seconds / report.wall_seconds
+	default_history().append(report)
+	if on_progress:
+		on_progress(100.0, f"Xong 2 lượt: {report.summary()}")
+	return report
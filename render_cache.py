@@ -0,0 +1,312 @@
+"""Cache kết quả render theo nội dung: job giống hệt (cùng input, cùng tùy chọn) không encode lại.
+
+Khóa của một job là SHA-256 của:
+- dấu vân tay nội dung từng input (kích thước + các khối 64 KB rải đều trong file, không
+  dựa vào đường dẫn: copy/đổi tên file vẫn trúng cache, ghi đè nội dung thì trượt),
+- mọi thuộc tính tùy chọn của FFmpegPipelineBuilder, tuần tự hóa ổn định (khóa sắp xếp),
+  LUT được tính theo nội dung file; trừ tùy chọn chỉ ảnh hưởng tốc độ (thread, giải mã GPU),
+- đường render của job (render_mode: smart render, mezzanine, chia đoạn), vì mỗi đường cho
+  ra byte khác nhau dù cùng tùy chọn,
+- phiên bản ffmpeg và mã nguồn các module dựng lệnh (sửa filter thì kết quả cũ không dùng lại).
+
+Kết quả nằm trong app_cache_dir("render_cache"); trúng cache thì output được hard-link tới
+file trong cache (khác ổ đĩa thì copy). Mỗi mục lưu kích thước + mtime của file cache: nếu
+file bị ghi đè qua hard link (ffmpeg -y ghi vào cùng inode), mục đó tự bị bỏ. Tổng dung lượng
+được giới hạn, mục lâu không dùng nhất bị xóa trước (LRU).
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from dataclasses import asdict, is_dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from app_paths import JsonFileCache, app_cache_dir, file_identity
+from capabilities import detect_capabilities
+from history import RenderReport, default_history, finalize_output, new_report
+from processing import FFmpegPipelineBuilder, _FFMPEG_BIN
+
+# Tăng khi đổi cách tính khóa
+CACHE_SCHEMA = 2
+DEFAULT_MAX_BYTES = int(float(os.environ.get("VEO3_RENDER_CACHE_GB", "20")) * 1024 ** 3)
+
+_BLOCK = 64 * 1024
+_SAMPLES = 16
+# Thuộc tính của builder không ảnh hưởng tới nội dung output
+_IGNORED_ATTRS = {"input_files", "build_notes", "expected_total_duration_seconds", "_temp_files", "encode_pass", "pass_log",
+				  # Chỉ đổi tốc độ (scheduler tự đặt thread theo tải máy), không đổi thứ người dùng yêu cầu
+				  "hwaccel_decode", "threads", "filter_threads", "threads_scheduled"}
+# Module quyết định lệnh ffmpeg; đổi mã nguồn thì khóa đổi theo
+_CODE_MODULES = ("processing.py", "filter_plan.py", "delogo.py", "segments.py", "mezzanine.py", "smart_render.py",
+				 "ratecontrol.py")
+
+_fingerprints = JsonFileCache("content_fingerprints.json")
+
+
+def content_fingerprint(path: str) -> Optional[str]:
+	"""Băm kích thước + _SAMPLES khối rải đều (gồm khối đầu và cuối) của file.
+
+	Đọc tối đa ~1 MB mỗi file; kết quả nhớ theo đường dẫn + kích thước + mtime.
+	"""
+	ident = file_identity(path)
+	if ident is None:
+		return None
+	hit = _fingerprints.get(ident)
+	if hit:
+		return hit
+	size = os.path.getsize(path)
+	h = hashlib.blake2b(digest_size=20)
+	h.update(str(size).encode())
+	try:
+		with open(path, "rb") as f:
+			if size <= _BLOCK * _SAMPLES:
+				h.update(f.read())
+			else:
+				step = (size - _BLOCK) / float(_SAMPLES - 1)
+				for i in range(_SAMPLES):
+					f.seek(int(i * step))
+					h.update(f.read(_BLOCK))
+	except OSError:
+		return None
+	digest = h.hexdigest()
+	_fingerprints.set(ident, digest)
+	return digest
+
+
+def _canonical(value: Any) -> Any:
+	if is_dataclass(value) and not isinstance(value, type):
+		return _canonical(asdict(value))
+	if isinstance(value, dict):
+		return {str(k): _canonical(v) for k, v in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [_canonical(v) for v in value]
+	if isinstance(value, float):
+		return round(value, 6)
+	return value
+
+
+_code_hash: Optional[str] = None
+
+
+def _code_fingerprint() -> str:
+	global _code_hash
+	if _code_hash is None:
+		h = hashlib.sha256()
+		base = os.path.dirname(os.path.abspath(__file__))
+		for name in _CODE_MODULES:
+			try:
+				with open(os.path.join(base, name), "rb") as f:
+					h.update(f.read())
+			except OSError:
+				# Bản đóng gói (PyInstaller) không có file .py: dùng chung một giá trị cho cả bản build
+				h.update(name.encode())
+		_code_hash = h.hexdigest()
+	return _code_hash
+
+
+def render_mode(smart_render: bool = False, mezzanine: bool = False, segment_workers: int = 0,
+				resumable: bool = False) -> Dict[str, Any]:
+	"""Đường render cấp job (ngoài builder) làm đổi byte output, để đưa vào job_key.
+
+	Smart render chép khúc từ mezzanine riêng (GOP 1 giây, không B-frame); mezzanine thường là
+	bản trung gian CRF 12; chia đoạn có GOP đóng tại điểm cắt, số khúc theo số tiến trình (bản
+	tiếp tục được chia theo timeline).
+	"""
+	if smart_render:
+		return {"smart_render": True}
+	segments: Any = 0
+	if resumable:
+		segments = "resume"
+	elif segment_workers >= 2:
+		segments = int(segment_workers)
+	return {"mezzanine": bool(mezzanine), "segments": segments}
+
+
+def job_key(builder: FFmpegPipelineBuilder, mode: Optional[Dict[str, Any]] = None) -> Optional[str]:
+	"""Khóa cache của job (mode: render_mode() của đường render); None nếu không đọc được input/LUT
+	hoặc không chạy được ffmpeg."""
+	inputs = [content_fingerprint(p) for p in builder.input_files]
+	if not inputs or any(fp is None for fp in inputs):
+		return None
+	options = {k: _canonical(v) for k, v in vars(builder).items() if k not in _IGNORED_ATTRS}
+	if builder.use_lut and builder.lut_path:
+		options["lut_path"] = content_fingerprint(builder.lut_path)
+	caps = detect_capabilities(_FFMPEG_BIN)
+	if caps is None:
+		return None
+	payload = {
+		"schema": CACHE_SCHEMA,
+		"inputs": inputs,
+		"options": options,
+		"mode": _canonical(mode or {}),
+		"ffmpeg": caps.version,
+		"code": _code_fingerprint(),
+	}
+	text = json.dumps(payload, sort_keys=True, ensure_ascii=True, default=str)
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+	if os.path.lexists(dst):
+		os.remove(dst)
+	try:
+		os.link(src, dst)
+	except OSError:
+		shutil.copy2(src, dst)
+
+
+class RenderCache:
+	"""Kho output đã render, khóa theo job_key(), giới hạn dung lượng theo LRU."""
+
+	def __init__(self, root: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+		self.root = root or app_cache_dir("render_cache")
+		os.makedirs(self.root, exist_ok=True)
+		self.max_bytes = max_bytes
+		# Mục: {"size", "mtime_ns", "last_used", "created"}; mục đã xóa được ghi là None
+		self._index = JsonFileCache(os.path.join(os.path.abspath(self.root), "index.json"))
+		self._lock = threading.Lock()
+
+	def _path(self, key: str) -> str:
+		return os.path.join(self.root, f"{key}.mp4")
+
+	def _valid(self, key: str) -> Optional[Dict[str, Any]]:
+		entry = self._index.get(key)
+		if not entry:
+			return None
+		try:
+			st = os.stat(self._path(key))
+		except OSError:
+			self._index.set(key, None)
+			return None
+		if st.st_size != entry.get("size") or st.st_mtime_ns != entry.get("mtime_ns"):
+			# File cache đã bị ghi đè (qua hard link) hoặc hỏng
+			self._drop(key)
+			return None
+		return entry
+
+	def _drop(self, key: str) -> None:
+		try:
+			os.remove(self._path(key))
+		except OSError:
+			pass
+		self._index.set(key, None)
+
+	def lookup(self, key: str) -> Optional[str]:
+		"""Đường dẫn file trong cache nếu còn hợp lệ (đánh dấu mục vừa được dùng)."""
+		with self._lock:
+			entry = self._valid(key)
+			if not entry:
+				return None
+			self._index.set(key, dict(entry, last_used=time.time()))
+			return self._path(key)
+
+	def materialize(self, key: str, output_path: str) -> bool:
+		"""Đặt kết quả đã cache vào output_path (hard link, không được thì copy); False nếu trượt cache."""
+		with self._lock:
+			entry = self._valid(key)
+			if not entry:
+				return False
+			out_dir = os.path.dirname(os.path.abspath(output_path))
+			os.makedirs(out_dir, exist_ok=True)
+			try:
+				_link_or_copy(self._path(key), output_path)
+			except OSError:
+				return False
+			self._index.set(key, dict(entry, last_used=time.time()))
+			return True
+
+	def store(self, key: str, output_path: str) -> None:
+		"""Đưa output vừa render vào cache rồi dọn bớt nếu vượt max_bytes."""
+		with self._lock:
+			path = self._path(key)
+			try:
+				_link_or_copy(output_path, path)
+				st = os.stat(path)
+			except OSError:
+				return
+			now = time.time()
+			self._index.set(key, {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "last_used": now, "created": now})
+			self._evict()
+
+	def entries(self) -> Dict[str, Dict[str, Any]]:
+		return {k: v for k, v in self._index.snapshot().items() if v}
+
+	def total_bytes(self) -> int:
+		return sum(int(e.get("size", 0)) for e in self.entries().values())
+
+	def _evict(self) -> None:
+		entries = sorted(self.entries().items(), key=lambda kv: kv[1].get("last_used", 0.0))
+		total = sum(int(e.get("size", 0)) for _, e in entries)
+		for key, entry in entries:
+			if total <= self.max_bytes:
+				break
+			self._drop(key)
+			total -= int(entry.get("size", 0))
+
+	def clear(self) -> None:
+		with self._lock:
+			for key in list(self.entries()):
+				self._drop(key)
+
+
+_default_cache: Optional[RenderCache] = None
+
+
+def default_render_cache() -> RenderCache:
+	global _default_cache
+	if _default_cache is None:
+		_default_cache = RenderCache()
+	return _default_cache
+
+
+def cached_render(builder: FFmpegPipelineBuilder, output_path: str, render: Callable[[], RenderReport],
+				  cache: Optional[RenderCache] = None, on_progress=None,
+				  mode: Optional[Dict[str, Any]] = None) -> RenderReport:
+	"""Chạy render() trừ khi job đã có trong cache; render xong thì lưu output vào cache.
+
+	mode: render_mode() của đường render() sẽ chạy (cùng builder, khác đường render thì khác khóa).
+
+	Trúng cache vẫn ghi một dòng lịch sử (status ok, options.render_cache = "hit").
+	"""
+	cache = cache or default_render_cache()
+	t0 = time.monotonic()
+	key = job_key(builder, mode)
+	if key and cache.materialize(key, output_path):
+		report = new_report(dict(builder.describe_options(), render_cache="hit"))
+		report.output = output_path
+		report.returncode = 0
+		report.wall_seconds = time.monotonic() - t0
+		report.media_seconds = sum(d for _, d in builder.timeline() or []) or None
+		finalize_output(report)
+		default_history().append(report)
+		if on_progress:
+			on_progress(100.0, "Job đã render trước đó với cùng input và tùy chọn: dùng lại kết quả trong cache")
+		return report
+	if os.path.lexists(output_path):
+		# Output cũ có thể là hard link tới file trong cache: ffmpeg -y sẽ ghi đè cả file cache
+		os.remove(output_path)
+	report = render()
+	if key and report.ok and os.path.isfile(output_path):
+		cache.store(key, output_path)
+	return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Xem/dọn cache kết quả render")
+	parser.add_argument("--clear", action="store_true", help="Xóa toàn bộ cache")
+	args = parser.parse_args(argv)
+	cache = default_render_cache()
+	if args.clear:
+		cache.clear()
+	entries = cache.entries()
+	print(f"{len(entries)} mục, {cache.total_bytes() / 1024 ** 3:.2f} GB / {cache.max_bytes / 1024 ** 3:.0f} GB ({cache.root})")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
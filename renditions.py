@@ -0,0 +1,78 @@
+"""Xuất nhiều độ phân giải (vd. 2160p + 1080p + 720p) từ một lần giải mã trong một tiến trình ffmpeg.
+
+FFmpegPipelineBuilder.build_renditions() dựng một graph: giải mã, chuẩn hóa, transition, che
+logo/QR chạy một lần, rồi split ra từng bản với scale (lanczos) và encoder riêng. So với render
+từng bản một, phần giải mã + filter (thường chiếm phần lớn thời gian với clip nguồn 4K) không
+lặp lại; các encoder chạy song song trong cùng tiến trình.
+
+Mọi bản đi cùng nhịp (một graph) nên chung phần trăm tiến trình; dòng tiến trình kèm dung lượng
+và bitrate hiện tại của từng bản. Lịch sử ghi một lần render, output là bản đầu tiên.
+"""
+import os
+import subprocess
+import threading
+from typing import Callable, Dict, Optional
+
+from history import RenderReport, default_history, finalize_output
+from processing import FFmpegPipelineBuilder, ProgressInfo, RenderCancelled, run_ffmpeg_with_progress
+
+
+def _remove_outputs(builder: FFmpegPipelineBuilder) -> None:
+	for r in builder.renditions:
+		if os.path.isfile(r.path):
+			try:
+				os.remove(r.path)
+			except OSError:
+				pass
+
+
+def render_renditions(builder: FFmpegPipelineBuilder,
+					  on_progress: Optional[Callable[[Optional[float], str], None]] = None,
+					  cancel_event: Optional[threading.Event] = None,
+					  on_notes: Optional[Callable[[list], None]] = None) -> RenderReport:
+	"""Render mọi bản trong builder.renditions bằng một lệnh ffmpeg.
+
+	Lỗi hoặc bị hủy thì xóa mọi file dở dang (không để lại bộ rendition thiếu bản).
+	"""
+	cmd = builder.build_renditions()
+	if on_notes:
+		on_notes(builder.build_notes)
+	size = builder._output_size()
+	labels = [r.label(size) for r in builder.renditions]
+	for r in builder.renditions:
+		os.makedirs(os.path.dirname(os.path.abspath(r.path)), exist_ok=True)
+
+	def log_only(pct: Optional[float], line: str) -> None:
+		# Dòng tiến trình đi qua on_stats (kèm từng bản); ở đây chỉ chuyển log stderr
+		if on_progress and pct is None and not line.startswith("frame="):
+			on_progress(None, line)
+
+	def on_stats(info: ProgressInfo) -> None:
+		if on_progress is None:
+			return
+		parts = []
+		for label, r in zip(labels, builder.renditions):
+			out_bytes = os.path.getsize(r.path) if os.path.isfile(r.path) else 0
+			text = f"{label} {out_bytes / (1024 * 1024):.1f} MB"
+			if info.out_time:
+				text += f" {out_bytes * 8 / 1e6 / info.out_time:.1f} Mb/s"
+			parts.append(text)
+		on_progress(info.percent, f"{info.summary()} | {', '.join(parts)}")
+
+	options = dict(builder.describe_options(), rendition_labels=labels)
+	try:
+		report = run_ffmpeg_with_progress(cmd, builder.expected_total_duration_seconds, log_only, cancel_event=cancel_event,
+										  on_stats=on_stats, options=options, record_history=False)
+	except (RenderCancelled, subprocess.CalledProcessError):
+		_remove_outputs(builder)
+		raise
+	report.output = builder.renditions[0].path
+	finalize_output(report)
+	sizes: Dict[str, int] = {}
+	for label, r in zip(labels, builder.renditions):
+		sizes[label] = os.path.getsize(r.path) if os.path.isfile(r.path) else 0
+	report.options["rendition_sizes"] = sizes
+	default_history().append(report)
+	if on_progress:
+		on_progress(100.0, f"Xong {len(labels)} bản ({', '.join(labels)}): {report.summary()}")
+	return report
@@ -0,0 +1,274 @@
+"""Lập lịch nhiều job ffmpeg chạy cùng lúc: bao nhiêu job, mỗi job bao nhiêu thread.
+
+Một tiến trình libx264/libx265 không tăng tốc tuyến tính theo số nhân (4K dùng hiệu quả
+khoảng 12-16 nhân, 1080p khoảng 6-8, phần lớn filter gần như chạy một luồng), nên với
+nhiều job, chạy vài job song song, mỗi job ít thread hơn, cho tổng số frame/giây cao hơn
+chạy lần lượt từng job với toàn bộ máy. Với mỗi job, bộ lập lịch ước tính:
+- số nhân một job dùng hiệu quả: trung vị CPU/wall của các lần chạy tương tự trong lịch sử
+  render (threads tự động hoặc do bộ lập lịch đặt, không tính lần người dùng tự giới hạn
+  thread), không có thì theo mô hình độ phân giải/encoder;
+- RAM đỉnh: lần chạy tương tự gần nhất (+20%), không có thì theo mô hình số frame mà
+  decoder, filter graph và lookahead của encoder giữ trong bộ nhớ;
+- khối lượng (frame x megapixel x CPU mỗi frame đo được) để xếp job nặng chạy trước.
+Số job cùng lúc = số nhân / số nhân hiệu quả mỗi job, giới hạn bởi RAM còn trống (85%) và
+số phiên NVENC; mỗi job nhận -threads/-filter_threads = số nhân / số job. Job chỉ được
+bắt đầu khi phần RAM đã giữ cho các job đang chạy cộng với job mới vẫn nằm trong giới hạn:
+nhiều graph 4K không bao giờ cùng chạy quá RAM. Job lớn hơn cả giới hạn vẫn chạy, một mình.
+"""
+import json
+import os
+import statistics
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from history import RenderHistory, RenderReport, default_history
+from processing import FFmpegPipelineBuilder
+
+# Phần RAM còn trống được phép dùng cho các job
+MEMORY_FRACTION = 0.85
+# GeForce giới hạn số phiên NVENC đồng thời
+NVENC_MAX_JOBS = 3
+# Số lần chạy gần nhất của cùng loại job được dùng để ước tính
+HISTORY_WINDOW = 20
+# Frame lookahead của libx264/libx265 theo preset (rc-lookahead mặc định)
+_LOOKAHEAD = {"ultrafast": 0, "superfast": 0, "veryfast": 10, "faster": 20, "fast": 30,
+			  "medium": 40, "slow": 50, "slower": 60, "veryslow": 60, "placebo": 60}
+# CPU mỗi megapixel-frame so với preset fast (chỉ dùng khi chưa có lịch sử, để xếp thứ tự)
+_PRESET_COST = {"ultrafast": 0.25, "superfast": 0.35, "veryfast": 0.5, "faster": 0.75, "fast": 1.0,
+				"medium": 1.4, "slow": 2.5, "slower": 5.0, "veryslow": 10.0, "placebo": 20.0}
+# Tùy chọn (describe_options) quyết định chi phí một job
+_PROFILE_KEYS = ("canvas", "fps60", "hevc", "nvenc", "preset", "sharpen", "color", "fast_mode", "transition",
+				 "delogo", "zoom", "hide_qr", "effects", "mezzanine", "renditions")
+
+
+@dataclass
+class JobEstimate:
+	profile: str
+	# Số nhân một tiến trình ffmpeg của job dùng hiệu quả khi không bị giới hạn thread
+	cores: float
+	# RAM đỉnh ước tính của một tiến trình
+	memory_mb: float
+	# Khối lượng tương đối (chỉ để so sánh các job với nhau)
+	work: float
+	nvenc: bool = False
+	# Số tiến trình ffmpeg chạy cùng lúc trong job (encode chia đoạn)
+	processes: int = 1
+	from_history: bool = False
+
+
+@dataclass
+class Slot:
+	"""Phần máy đã giao cho một job đang chạy."""
+	threads: int
+	filter_threads: int
+	memory_mb: float
+	processes: int = 1
+	nvenc: bool = False
+
+	def describe(self) -> str:
+		per = f"{self.processes} tiến trình x " if self.processes > 1 else ""
+		return f"{per}{self.threads} thread, filter {self.filter_threads} thread, giữ {self.memory_mb * self.processes:.0f} MB RAM"
+
+
+def available_memory_mb() -> Optional[float]:
+	"""RAM còn dùng được (MB); None nếu không đọc được trên hệ điều hành này."""
+	if os.name == "nt":
+		try:
+			import ctypes
+
+			class MEMORYSTATUSEX(ctypes.Structure):
+				_fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+							("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+							("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+							("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+							("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+			status = MEMORYSTATUSEX()
+			status.dwLength = ctypes.sizeof(status)
+			if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+				return status.ullAvailPhys / (1024 * 1024)
+		except Exception:
+			pass
+		return None
+	try:
+		with open("/proc/meminfo", "r", encoding="ascii") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) / 1024.0
+	except (OSError, ValueError, IndexError):
+		pass
+	try:
+		return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+	except (ValueError, OSError, AttributeError):
+		return None
+
+
+def job_profile(options: Dict[str, Any]) -> str:
+	"""Khóa nhóm các job có cùng chi phí mỗi frame (cùng canvas, encoder, preset, filter)."""
+	return json.dumps([options.get(k) for k in _PROFILE_KEYS], sort_keys=True, default=str)
+
+
+def _megapixels(canvas: Optional[str]) -> float:
+	try:
+		w, h = (int(v) for v in str(canvas).split("x"))
+		return w * h / 1e6
+	except ValueError:
+		return 8.3  # không biết kích thước: coi như 4K (ước tính RAM an toàn)
+
+
+def _model_cores(options: Dict[str, Any], mpix: float) -> float:
+	if options.get("nvenc"):
+		# Encoder chạy trên GPU: CPU chỉ giải mã + filter
+		return 2.0
+	return min(16.0, max(2.0, 2.0 + 3.0 * mpix))
+
+
+def _model_memory_mb(options: Dict[str, Any], mpix: float, src_mpix: float, cores: float) -> float:
+	"""RAM của các frame mà decoder, filter graph và encoder giữ cùng lúc (yuv420p 8 bit)."""
+	frame_mb = mpix * 1.5
+	stages = 2 + sum(1 for k in ("sharpen", "color", "zoom", "delogo", "hide_qr") if options.get(k)) + len(options.get("effects") or [])
+	if options.get("transition"):
+		stages += 2
+	encoder_frames = 0.0 if options.get("nvenc") else 1.5 * (_LOOKAHEAD.get(str(options.get("preset")), 40) + cores + 4)
+	if options.get("hevc") and not options.get("nvenc"):
+		encoder_frames *= 1.5
+	decoders = 2 if options.get("transition") else 1
+	return 150.0 + frame_mb * (encoder_frames + 3 * stages) + src_mpix * 1.5 * (cores + 4) * decoders
+
+
+class JobScheduler:
+	"""Quyết định job nào được bắt đầu và với bao nhiêu thread, theo CPU/RAM còn trống.
+
+	Dùng: estimate() cho từng job, order() để xếp thứ tự, rồi admit() trước khi chạy một job
+	(None = chờ job khác xong) và release() khi job kết thúc. An toàn khi gọi từ nhiều luồng.
+	"""
+
+	def __init__(self, cpu_count: Optional[int] = None, memory_mb: Optional[float] = None, max_jobs: Optional[int] = None,
+				 history: Optional[RenderHistory] = None):
+		self.cpu_count = max(1, cpu_count or os.cpu_count() or 1)
+		# memory_mb cố định (ví dụ giới hạn container); None = đọc RAM còn trống khi máy rảnh
+		self._fixed_memory = memory_mb
+		self.max_jobs = max_jobs
+		self._history = history or default_history()
+		self._reports: Optional[List[RenderReport]] = None
+		self._running: List[Slot] = []
+		self._budget_mb: Optional[float] = None
+		self._lock = threading.Lock()
+
+	def _similar(self, profile: str) -> List[RenderReport]:
+		if self._reports is None:
+			# Smart render chỉ encode một phần timeline: không đại diện cho chi phí của loại job
+			self._reports = [r for r in self._history.load() if r.ok and r.wall_seconds > 1.0 and not r.options.get("smart_render")]
+		return [r for r in self._reports if job_profile(r.options) == profile][-HISTORY_WINDOW:]
+
+	def estimate(self, builder: FFmpegPipelineBuilder, processes: int = 1) -> JobEstimate:
+		"""Chi phí của job; processes > 1 khi job tự chia thành nhiều tiến trình (segment_workers)."""
+		builder.prefetch_probes()
+		options = builder.describe_options()
+		profile = job_profile(options)
+		mpix = _megapixels(options.get("canvas"))
+		info = builder._probe(builder.input_files[0])
+		src_mpix = info.width * info.height / 1e6 if info and info.width and info.height else mpix
+		cores = _model_cores(options, mpix)
+		memory = _model_memory_mb(options, mpix, src_mpix, cores)
+		cpu_per_mpix_frame = 0.02 * _PRESET_COST.get(str(options.get("preset")), 1.0)
+
+		similar = self._similar(profile)
+		# Số nhân hiệu quả đo từ lần chạy một tiến trình; bỏ lần người dùng tự giới hạn thread
+		# (thread do bộ lập lịch đặt vẫn tính, để lịch sử các đợt --jobs auto cập nhật ước tính)
+		free_runs = [r for r in similar if (not r.options.get("threads") or r.options.get("threads_scheduled"))
+					 and not r.options.get("segments") and r.cpu_user_seconds is not None]
+		if free_runs:
+			cores = statistics.median((r.cpu_user_seconds + (r.cpu_system_seconds or 0.0)) / r.wall_seconds for r in free_runs)
+			cores = min(float(self.cpu_count), max(1.0, cores))
+		peaks = [r.peak_rss_mb for r in similar if r.peak_rss_mb]
+		if peaks:
+			memory = max(peaks[-5:]) * 1.2
+		per_frame = [(r.cpu_user_seconds + (r.cpu_system_seconds or 0.0)) / r.frames / mpix
+					 for r in similar if r.cpu_user_seconds is not None and r.frames]
+		if per_frame:
+			cpu_per_mpix_frame = statistics.median(per_frame)
+
+		fps = builder._out_fps() or (info.fps if info and info.fps else 30.0)
+		layout = builder.timeline_offsets()
+		seconds = layout[1] if layout else sum(builder._probe_duration(p) or 0.0 for p in builder.input_files)
+		return JobEstimate(profile=profile, cores=cores, memory_mb=memory, work=seconds * fps * mpix * cpu_per_mpix_frame,
+						   nvenc=bool(options.get("nvenc")), processes=max(1, processes), from_history=bool(similar))
+
+	@staticmethod
+	def order(estimates: List[JobEstimate]) -> List[int]:
+		"""Chỉ số các job theo thứ tự nên chạy: nặng trước (job dài không bị dồn về cuối đợt)."""
+		return sorted(range(len(estimates)), key=lambda i: estimates[i].work, reverse=True)
+
+	def _memory_budget(self) -> Optional[float]:
+		if self._fixed_memory is not None:
+			return self._fixed_memory
+		avail = available_memory_mb()
+		return avail * MEMORY_FRACTION if avail is not None else None
+
+	def concurrency(self, estimate: JobEstimate, budget_mb: Optional[float] = None) -> int:
+		"""Số job loại này nên chạy cùng lúc để tổng thông lượng cao nhất."""
+		if budget_mb is None:
+			budget_mb = self._memory_budget()
+		n = max(1, int(round(self.cpu_count / (estimate.cores * estimate.processes))))
+		if budget_mb is not None:
+			n = min(n, max(1, int(budget_mb // (estimate.memory_mb * estimate.processes))))
+		if estimate.nvenc:
+			n = min(n, NVENC_MAX_JOBS)
+		if self.max_jobs:
+			n = min(n, self.max_jobs)
+		return n
+
+	def admit(self, estimate: JobEstimate) -> Optional[Slot]:
+		"""Giữ chỗ cho job nếu máy còn đủ CPU/RAM; None thì phải chờ một job đang chạy xong."""
+		with self._lock:
+			if not self._running:
+				# Máy rảnh: đọc lại RAM còn trống (các chương trình khác có thể đã mở/đóng)
+				self._budget_mb = self._memory_budget()
+			n = self.concurrency(estimate, self._budget_mb)
+			threads = max(1, self.cpu_count // (n * estimate.processes))
+			slot = Slot(threads=threads, filter_threads=threads, memory_mb=estimate.memory_mb,
+						processes=estimate.processes, nvenc=estimate.nvenc)
+			if self._running:
+				if self.max_jobs and len(self._running) >= self.max_jobs:
+					return None
+				used = sum(s.threads * s.processes for s in self._running)
+				if used + threads * estimate.processes > self.cpu_count:
+					return None
+				reserved = sum(s.memory_mb * s.processes for s in self._running)
+				if self._budget_mb is not None and reserved + estimate.memory_mb * estimate.processes > self._budget_mb:
+					return None
+				if estimate.nvenc and sum(1 for s in self._running if s.nvenc) >= NVENC_MAX_JOBS:
+					return None
+			self._running.append(slot)
+			return slot
+
+	def release(self, slot: Slot) -> None:
+		with self._lock:
+			if slot in self._running:
+				self._running.remove(slot)
+			# Job vừa xong đã ghi lịch sử: lần ước tính sau đọc lại
+			self._reports = None
+
+	def running(self) -> int:
+		with self._lock:
+			return len(self._running)
+
+
+def apply_slot(builder: FFmpegPipelineBuilder, slot: Slot) -> None:
+	"""Đặt số thread của slot cho builder đã cấu hình, trừ khi người dùng đã đặt sẵn.
+
+	Không ghi vào tùy chọn job: số thread tùy tải máy lúc job bắt đầu nên không được làm đổi
+	khóa job (cache render, manifest render tiếp tục).
+	"""
+	if not builder.threads:
+		builder.threads = slot.threads
+		builder.threads_scheduled = True
+	if not builder.filter_threads:
+		builder.filter_threads = slot.filter_threads
+
+
+def describe_estimate(estimate: JobEstimate) -> str:
+	source = "lịch sử" if estimate.from_history else "mô hình"
+	return f"~{estimate.cores:.1f} nhân, ~{estimate.memory_mb:.0f} MB RAM ({source})"
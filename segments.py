@@ -0,0 +1,384 @@
+"""Encode chia đoạn: cắt timeline thành nhiều khúc, encode song song rồi ghép bằng stream copy.
+
+libx264/libx265 ở 4K không tận dụng hết máy nhiều nhân với một tiến trình; chạy vài
+tiến trình ffmpeg trên các khúc khác nhau của timeline thì tận dụng được. Điểm cắt:
+- luôn nằm ngoài vùng transition (mỗi khúc chứa trọn các xfade của nó),
+- trùng với biên frame của output,
+- trùng biên clip khi không có transition (mỗi khúc khi đó chỉ thuộc một clip).
+Mỗi khúc bắt đầu bằng một keyframe nên ghép lại bằng concat demuxer + -c copy được.
+Audio của cả timeline được render một lần riêng rồi mux vào cuối.
+
+Chế độ tiếp tục được (resume=True): các khúc nằm trong thư mục cố định cạnh output
+(.<tên output>.resume) kèm manifest.json ghi khóa job (render_cache.job_key), cách chia khúc
+và các khúc đã xong. Mỗi khúc được ghi ra file tạm, fsync, đổi tên rồi mới ghi vào manifest.
+ffmpeg lỗi, người dùng hủy hay máy tắt giữa chừng: chạy lại cùng job chỉ encode các khúc còn
+thiếu rồi ghép. Đổi input/tùy chọn thì khóa đổi, các khúc cũ bị bỏ.
+"""
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from history import RenderReport, default_history, describe_command, finalize_output, new_report
+from processing import FFmpegPipelineBuilder, ProgressInfo, RenderCancelled, run_ffmpeg_with_progress
+from render_cache import job_key
+
+
+# Khúc ngắn hơn mức này thì chi phí khởi động ffmpeg/seek lớn hơn lợi ích chạy song song
+MIN_SEGMENT_SECONDS = 4.0
+# Độ dài mỗi khúc khi render có thể tiếp tục: dừng giữa chừng mất tối đa chừng này giây encode
+RESUME_SEGMENT_SECONDS = 60.0
+# Số khúc tối thiểu khi render có thể tiếp tục (đủ cho default_segment_workers() tối đa 8 tiến trình)
+RESUME_MIN_SEGMENTS = 8
+# Tăng khi đổi định dạng manifest.json
+RESUME_SCHEMA = 1
+
+
+@dataclass
+class Segment:
+	index: int
+	start: float
+	end: float
+	# (file, điểm vào, thời lượng) của các clip nằm trong khúc
+	windows: List[Tuple[str, float, float]]
+
+	@property
+	def duration(self) -> float:
+		return self.end - self.start
+
+
+def default_segment_workers() -> int:
+	"""Số khúc encode cùng lúc: mỗi tiến trình libx264 4K dùng tốt khoảng 4 nhân."""
+	return max(1, min(8, (os.cpu_count() or 1) // 4))
+
+
+def _output_fps(builder: FFmpegPipelineBuilder) -> Optional[float]:
+	if builder.force_fps60:
+		return builder.target_fps
+	rates = {round(builder._probe(p).fps or 0.0, 3) for p in builder.input_files if builder._probe(p)}
+	if len(rates) == 1 and next(iter(rates)) > 0:
+		return next(iter(rates))
+	return None  # fps thay đổi giữa các clip: không cắt chính xác theo frame được
+
+
+def plan_segments(builder: FFmpegPipelineBuilder, count: int, min_seconds: float = MIN_SEGMENT_SECONDS) -> List[Segment]:
+	"""Chia timeline của builder thành tối đa count khúc; [] nếu không chia được (hoặc chỉ được 1 khúc)."""
+	clips = builder.timeline()
+	layout = builder.timeline_offsets()
+	fps = _output_fps(builder)
+	if not clips or not layout or not fps or count < 2:
+		return []
+	durs = [d for _, d in clips]
+	n = len(clips)
+	transitions = builder.uses_transitions()
+	offsets, total, tran = layout
+	frame = 1.0 / fps
+
+	# Vùng được phép cắt trong từng clip: cách transition vào/ra đủ xa để mọi khúc
+	# vẫn có clip dài >= 2T (giữ nguyên giới hạn T của transition_params)
+	safe: List[Tuple[float, float]] = []
+	for k in range(n):
+		lo = offsets[k] + (2 * tran + frame if k > 0 and transitions else 0.0)
+		hi = offsets[k] + durs[k] - (2 * tran + frame if k < n - 1 and transitions else 0.0)
+		if hi > lo:
+			safe.append((lo, hi))
+
+	def snap(t: float) -> Optional[float]:
+		best = None
+		for lo, hi in safe:
+			c = min(max(t, lo), hi)
+			c = round(c * fps) / fps
+			if c < lo - 1e-9:
+				c += frame
+			if c > hi + 1e-9:
+				c -= frame
+			if lo - 1e-9 <= c <= hi + 1e-9 and (best is None or abs(c - t) < abs(best - t)):
+				best = c
+		return best
+
+	count = min(count, int(total // min_seconds))
+	cuts = {snap(total * i / count) for i in range(1, count)} if count >= 2 else set()
+	if not transitions:
+		# Không có transition: mỗi khúc phải nằm trong một clip (concat demuxer không seek được)
+		cuts.update(round(o * fps) / fps for o in offsets[1:])
+	points = [0.0]
+	for c in sorted(c for c in cuts if c is not None and 0.0 < c < total):
+		if c - points[-1] >= (min_seconds if transitions else frame):
+			points.append(c)
+	if len(points) < 2:
+		return []
+	points.append(total)
+
+	return [Segment(index=i, start=points[i], end=points[i + 1], windows=builder.window_clips(points[i], points[i + 1]))
+			for i in range(len(points) - 1)]
+
+
+def _write_concat_list(paths: List[str], list_file: str) -> None:
+	with open(list_file, "w", encoding="utf-8") as f:
+		for p in paths:
+			p_escaped = os.path.abspath(p).replace("'", "'\\''")
+			f.write(f"file '{p_escaped}'\n")
+
+
+def mux_parts(builder: FFmpegPipelineBuilder, ffmpeg_bin: str, paths: List[str], audio_path: Optional[str], total: float,
+			  output_path: str, work_dir: str, cancel_event: Optional[threading.Event] = None) -> RenderReport:
+	"""Ghép các khúc video (cùng tham số encoder, mỗi khúc mở đầu bằng keyframe) bằng concat
+	demuxer + -c copy, kèm audio của cả timeline đã render riêng."""
+	list_file = os.path.join(work_dir, "segments.txt")
+	_write_concat_list(paths, list_file)
+	mux = [ffmpeg_bin, "-y", "-f", "concat", "-safe", "0", "-i", list_file]
+	if audio_path:
+		mux.extend(["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy"])
+	else:
+		mux.extend(["-map", "0:v:0", "-c", "copy", "-an"])
+	if builder.faststart:
+		mux.extend(["-movflags", "+faststart"])
+	if builder.reencode_metadata:
+		mux.extend(["-map_metadata", "-1"])
+	mux.extend(["-t", f"{total:.3f}", output_path])
+	return run_ffmpeg_with_progress(mux, total, None, cancel_event=cancel_event, record_history=False)
+
+
+def resume_dir(output_path: str) -> str:
+	"""Thư mục chứa các khúc đã encode và manifest của render có thể tiếp tục."""
+	out_dir, name = os.path.split(os.path.abspath(output_path))
+	return os.path.join(out_dir, f".{name}.resume")
+
+
+def _write_resume_manifest(work_dir: str, manifest: Dict[str, Any]) -> None:
+	path = os.path.join(work_dir, "manifest.json")
+	tmp = path + ".tmp"
+	with open(tmp, "w", encoding="utf-8") as f:
+		json.dump(manifest, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, path)
+
+
+def _open_resume_manifest(work_dir: str, key: Optional[str], segments: List[Segment]) -> Dict[str, Any]:
+	"""Manifest của lần chạy trước nếu cùng job và cùng cách chia khúc; không thì xóa các khúc cũ, tạo manifest mới."""
+	plan = [[round(s.start, 6), round(s.end, 6)] for s in segments]
+	try:
+		with open(os.path.join(work_dir, "manifest.json"), "r", encoding="utf-8") as f:
+			data = json.load(f)
+		if key and data.get("schema") == RESUME_SCHEMA and data.get("key") == key and data.get("plan") == plan:
+			return data
+	except (OSError, ValueError, AttributeError):
+		pass
+	shutil.rmtree(work_dir, ignore_errors=True)
+	os.makedirs(work_dir, exist_ok=True)
+	manifest = {"schema": RESUME_SCHEMA, "key": key, "plan": plan, "done": {}}
+	_write_resume_manifest(work_dir, manifest)
+	return manifest
+
+
+def _resume_done(work_dir: str, manifest: Dict[str, Any], name: str) -> bool:
+	size = manifest["done"].get(name)
+	path = os.path.join(work_dir, name)
+	return size is not None and os.path.isfile(path) and os.path.getsize(path) == size
+
+
+def _checkpoint(work_dir: str, manifest: Dict[str, Any], lock: threading.Lock, tmp: str, name: str) -> None:
+	"""Ghi file vừa encode xong xuống đĩa rồi mới đánh dấu xong trong manifest (mất điện ngay sau vẫn dùng được)."""
+	with open(tmp, "rb+") as f:
+		os.fsync(f.fileno())
+	path = os.path.join(work_dir, name)
+	os.replace(tmp, path)
+	with lock:
+		manifest["done"][name] = os.path.getsize(path)
+		_write_resume_manifest(work_dir, manifest)
+
+
+def render_segmented(builder: FFmpegPipelineBuilder, output_path: str, workers: int,
+					 on_progress: Optional[Callable[[Optional[float], str], None]] = None,
+					 cancel_event: Optional[threading.Event] = None,
+					 max_segments: Optional[int] = None, resume: bool = False) -> RenderReport:
+	"""Render job bằng nhiều tiến trình ffmpeg song song, mỗi tiến trình một khúc timeline.
+
+	resume=True: lưu từng khúc đã xong để lần chạy sau (sau lỗi, hủy, khởi động lại máy) chỉ
+	encode phần còn thiếu; chạy được cả với workers=1.
+	Tự quay về render một lượt khi không có lợi hoặc không làm được: stream copy, NVENC
+	(GPU giới hạn số phiên encode), fps output không cố định, timeline quá ngắn.
+	"""
+	full_cmd = builder.build()
+	ffmpeg_bin = full_cmd[0]
+	is_copy = "-c:v" in full_cmd and full_cmd[full_cmd.index("-c:v") + 1] == "copy"
+	workers = max(1, workers)
+	segments: List[Segment] = []
+	if (workers >= 2 or resume) and not is_copy and not builder.use_nvenc:
+		if resume:
+			# Cách chia chỉ theo timeline: chạy tiếp với số tiến trình khác (đổi ô "Encode song song",
+			# máy khác số nhân) vẫn khớp plan trong manifest và dùng lại các khúc đã xong
+			layout = builder.timeline_offsets()
+			count = max(RESUME_MIN_SEGMENTS, int(math.ceil(layout[1] / RESUME_SEGMENT_SECONDS)) if layout else 0)
+		else:
+			count = max_segments or workers * 2
+		segments = plan_segments(builder, count)
+	if len(segments) < 2:
+		if on_progress:
+			note = " (không tiếp tục được nếu bị dừng)" if resume else ""
+			on_progress(None, f"Không chia đoạn được cho job này: render một lượt{note}")
+		return run_ffmpeg_with_progress(full_cmd + [output_path], builder.expected_total_duration_seconds, on_progress,
+										cancel_event=cancel_event, options=builder.describe_options())
+
+	total = segments[-1].end
+	fps = _output_fps(builder) or 60.0
+	tran = builder.timeline_offsets()[2] if builder.uses_transitions() else None
+	threads = builder.threads if builder.threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+	out_dir = os.path.dirname(os.path.abspath(output_path))
+	os.makedirs(out_dir, exist_ok=True)
+	manifest: Optional[Dict[str, Any]] = None
+	if resume:
+		work_dir = resume_dir(output_path)
+		manifest = _open_resume_manifest(work_dir, job_key(builder), segments)
+	else:
+		work_dir = tempfile.mkdtemp(prefix=".ffseg_", dir=out_dir)
+	reused = [s.index for s in segments if manifest is not None and _resume_done(work_dir, manifest, f"seg_{s.index:04d}.mp4")]
+	if on_progress:
+		on_progress(None, f"Encode chia đoạn: {len(segments)} khúc, {workers} tiến trình x {threads} thread")
+		if reused:
+			on_progress(None, f"Tiếp tục render: đã có {len(reused)}/{len(segments)} khúc từ lần chạy trước")
+
+	# Hủy từ người dùng hoặc một khúc lỗi đều dừng mọi tiến trình còn lại
+	abort = threading.Event()
+	done = threading.Event()
+	if cancel_event is not None:
+		def link_cancel():
+			while not done.is_set():
+				if cancel_event.wait(0.2):
+					abort.set()
+					return
+		threading.Thread(target=link_cancel, daemon=True).start()
+
+	seg_time: Dict[int, float] = {i: segments[i].duration for i in reused}
+	lock = threading.Lock()
+
+	def make_stats(idx: int):
+		def on_stats(info: ProgressInfo):
+			with lock:
+				seg_time[idx] = min(info.out_time or 0.0, segments[idx].duration)
+				pct = min(100.0, sum(seg_time.values()) / total * 100.0)
+			if on_progress:
+				on_progress(pct, f"{pct:.1f}% ({len(segments)} khúc song song)")
+		return on_stats
+
+	def encode(seg: Segment) -> Tuple[str, Optional[RenderReport]]:
+		name = f"seg_{seg.index:04d}.mp4"
+		path = os.path.join(work_dir, name)
+		if seg.index in reused:
+			return path, None
+		if abort.is_set():
+			raise RenderCancelled()
+		sub = builder.windowed(seg.windows, tran)
+		sub.threads = threads
+		sub.faststart = False
+		sub.allow_stream_copy = False
+		target = os.path.join(work_dir, f"seg_{seg.index:04d}.part.mp4") if manifest is not None else path
+		cmd = sub.build() + ["-frames:v", str(int(round(seg.duration * fps))), target]
+		try:
+			report = run_ffmpeg_with_progress(cmd, seg.duration, None, cancel_event=abort, on_stats=make_stats(seg.index), record_history=False)
+			if manifest is not None:
+				_checkpoint(work_dir, manifest, lock, target, name)
+		except Exception:
+			abort.set()
+			raise
+		finally:
+			sub.cleanup()
+		return path, report
+
+	def encode_audio() -> Optional[Tuple[str, Optional[RenderReport]]]:
+		cmd = builder.build_audio_only()
+		if cmd is None:
+			return None
+		path = os.path.join(work_dir, "audio.m4a")
+		if manifest is not None and _resume_done(work_dir, manifest, "audio.m4a"):
+			return path, None
+		target = os.path.join(work_dir, "audio.part.m4a") if manifest is not None else path
+		try:
+			report = run_ffmpeg_with_progress(cmd + [target], None, None, cancel_event=abort, record_history=False)
+			if manifest is not None:
+				_checkpoint(work_dir, manifest, lock, target, "audio.m4a")
+			return path, report
+		except Exception:
+			abort.set()
+			raise
+
+	options = dict(builder.describe_options(), segments=len(segments), segment_workers=workers)
+	if resume:
+		options["resumed_segments"] = len(reused)
+	report = new_report(options)
+	finished = False
+	describe_command(report, full_cmd + [output_path])
+	t0 = time.monotonic()
+	try:
+		with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+			audio_future = pool.submit(encode_audio)
+			futures = [pool.submit(encode, seg) for seg in segments]
+			errors: List[BaseException] = []
+			results: List[Tuple[str, RenderReport]] = []
+			audio: Optional[Tuple[str, RenderReport]] = None
+			for fut in futures:
+				try:
+					results.append(fut.result())
+				except Exception as e:
+					errors.append(e)
+			try:
+				audio = audio_future.result()
+			except Exception as e:
+				errors.append(e)
+		if cancel_event is not None and cancel_event.is_set():
+			raise RenderCancelled()
+		if errors:
+			# Báo lỗi thật trước, không phải các khúc bị dừng theo
+			raise next((e for e in errors if not isinstance(e, RenderCancelled)), errors[0])
+
+		mux_report = mux_parts(builder, ffmpeg_bin, [p for p, _ in results], audio[0] if audio else None, total,
+							   output_path, work_dir, cancel_event)
+
+		parts = [r for _, r in results if r is not None] + ([audio[1]] if audio and audio[1] else []) + [mux_report]
+		report.attempts = sum(r.attempts for r in parts)
+		report.fallback_path = sorted({f for r in parts for f in r.fallback_path})
+		cpu = [r for r in parts if r.cpu_user_seconds is not None]
+		if cpu:
+			report.cpu_user_seconds = sum(r.cpu_user_seconds for r in cpu)
+			report.cpu_system_seconds = sum(r.cpu_system_seconds or 0.0 for r in cpu)
+		peaks = [r.peak_rss_mb for r in parts if r.peak_rss_mb is not None]
+		report.peak_rss_mb = max(peaks) if peaks else None
+		# Chỉ tính frame encode trong lần chạy này (encode_fps đúng với thời gian đo)
+		report.frames = sum(r.frames or 0 for _, r in results if r is not None) or None
+		report.media_seconds = total
+		report.returncode = 0
+		finished = True
+		if on_progress:
+			on_progress(100.0, f"Đã ghép {len(segments)} khúc")
+		return report
+	except RenderCancelled:
+		report.status = "cancelled"
+		if os.path.isfile(output_path):
+			os.remove(output_path)
+		raise
+	except subprocess.CalledProcessError as e:
+		report.status = "failed"
+		report.returncode = e.returncode
+		report.error = "".join((e.stderr or "").strip().splitlines(True)[-5:])
+		raise
+	finally:
+		done.set()
+		if manifest is None or finished:
+			shutil.rmtree(work_dir, ignore_errors=True)
+		elif on_progress:
+			kept = len([n for n in manifest["done"] if n.startswith("seg_")])
+			on_progress(None, f"Đã lưu {kept}/{len(segments)} khúc ở {work_dir}: chạy lại job để tiếp tục")
+		report.wall_seconds = time.monotonic() - t0
+		if report.frames and report.wall_seconds > 0:
+			report.encode_fps = report.frames / report.wall_seconds
+			report.speed = (total - sum(segments[i].duration for i in reused)) / report.wall_seconds
+		finalize_output(report)
+		default_history().append(report)
@@ -0,0 +1,251 @@
+"""Smart render: chỉ encode lại vùng quanh transition, phần còn lại của mỗi clip chép thẳng.
+
+Dùng mezzanine bản smart (mezzanine.normalized_builder(smart=True)): clip đã chuẩn hóa, đã che
+logo/QR, ở đúng fps output, encode bằng chính encoder xuất của job, không B-frame, keyframe ít
+nhất mỗi giây. Khi đó chỉ đoạn xfade cần pixel mới. Timeline được chia thành các khúc:
+- khúc chép: phần giữa một clip, từ keyframe đầu tiên sau transition vào tới keyframe cuối cùng
+  trước transition ra, chép bằng -c copy (không giải mã);
+- khúc encode: từ keyframe đó của clip trước tới keyframe đầu của clip sau, render bằng
+  windowed() (xfade) với đúng tham số encoder của mezzanine.
+Các khúc ghép bằng concat demuxer + -c copy (segments.mux_parts), audio của cả timeline render
+riêng. SPS/PPS (extradata) của khúc encode được so với mezzanine trước khi ghép; khác nhau thì
+render cả timeline từ mezzanine như bình thường.
+
+Clip 60 giây + crossfade 0.8 giây: mỗi transition encode lại khoảng 0.8 + 2 x 1 giây (GOP),
+dưới 5% số frame của hai clip.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from app_paths import JsonFileCache, file_identity
+from history import RenderReport, default_history, describe_command, finalize_output, new_report
+from mezzanine import normalized_builder, smart_gop_args
+from processing import FFmpegPipelineBuilder, RenderCancelled, _FFMPEG_BIN, _FFPROBE_BIN, run_ffmpeg_with_progress
+from segments import _output_fps, mux_parts
+
+
+@dataclass
+class Piece:
+	# "copy": một đoạn của một mezzanine; "encode": các cửa sổ clip nối với nhau bằng xfade
+	kind: str
+	# (file, frame đầu, frame cuối (không gồm)) theo thứ tự timeline
+	windows: List[Tuple[str, int, int]]
+	# Số frame của khúc trong output
+	frames: int
+
+
+_keyframes = JsonFileCache("keyframes.json")
+
+
+def video_keyframes(path: str) -> Tuple[int, List[Tuple[int, float]]]:
+	"""(số frame video, [(chỉ số frame, pts) của các keyframe]) đọc từ packet, không giải mã.
+
+	Chỉ đúng cho luồng không B-frame (thứ tự packet = thứ tự hiển thị), như mezzanine smart.
+	"""
+	ident = file_identity(path)
+	hit = _keyframes.get(ident) if ident else None
+	if hit:
+		return int(hit[0]), [(int(i), float(t)) for i, t in hit[1]]
+	cmd = [_FFPROBE_BIN, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+	res = subprocess.run(cmd, capture_output=True, text=True, check=True)
+	count = 0
+	keys: List[Tuple[int, float]] = []
+	for line in res.stdout.splitlines():
+		parts = line.strip().split(",")
+		if len(parts) < 2 or parts[0] in ("", "N/A"):
+			continue
+		if "K" in parts[1]:
+			keys.append((count, float(parts[0])))
+		count += 1
+	if ident:
+		_keyframes.set(ident, [count, keys])
+	return count, keys
+
+
+def plan_pieces(clips: List[Tuple[str, int, List[int]]], tran_frames: int) -> List[Piece]:
+	"""Chia timeline (file, số frame, keyframe) nối bằng transition tran_frames frame thành các khúc."""
+	pieces: List[Piece] = []
+	pending: List[Tuple[str, int, int]] = []
+
+	def flush() -> None:
+		if pending:
+			frames = sum(e - s for _, s, e in pending) - (len(pending) - 1) * tran_frames
+			pieces.append(Piece("encode", list(pending), frames))
+			pending.clear()
+
+	n = len(clips)
+	for k, (path, count, keys) in enumerate(clips):
+		lo = tran_frames if k > 0 else 0
+		hi = count - tran_frames if k < n - 1 else count
+		a = next((f for f in keys if f >= lo), None)
+		b = count if k == n - 1 else max((f for f in keys if f <= hi), default=None)
+		if a is None or b is None or b <= a:
+			# GOP dài hơn phần giữa clip: cả clip nằm trong khúc encode
+			pending.append((path, 0, count))
+			continue
+		if a > 0:
+			pending.append((path, 0, a))
+		flush()
+		pieces.append(Piece("copy", [(path, a, b)], b - a))
+		if b < count:
+			pending.append((path, b, count))
+	flush()
+	return pieces
+
+
+def _extradata_hash(path: str) -> Optional[str]:
+	cmd = [_FFPROBE_BIN, "-v", "error", "-show_data_hash", "sha256", "-select_streams", "v:0",
+		   "-show_entries", "stream=extradata_hash", "-of", "csv=p=0", path]
+	res = subprocess.run(cmd, capture_output=True, text=True)
+	return res.stdout.strip() or None if res.returncode == 0 else None
+
+
+def smart_render_blockers(builder: FFmpegPipelineBuilder) -> List[str]:
+	"""Lý do không smart render được (rỗng = làm được)."""
+	reasons: List[str] = []
+	builder.prefetch_probes()
+	if not builder.uses_transitions() or len(builder._timeline_files()) < 2:
+		reasons.append("không có transition")
+	builder._apply_capabilities()
+	if builder.use_nvenc:
+		reasons.append("encoder NVENC (tham số encode không cố định giữa các lần chạy)")
+	if _output_fps(builder) is None:
+		reasons.append("fps output không cố định")
+	return reasons
+
+
+def render_smart(builder: FFmpegPipelineBuilder, output_path: str,
+				 on_progress: Optional[Callable[[Optional[float], str], None]] = None,
+				 cancel_event: Optional[threading.Event] = None) -> RenderReport:
+	"""Render job bằng smart render; không làm được thì tự render cả timeline như bình thường."""
+
+	def full_render(target: FFmpegPipelineBuilder, reason: str) -> RenderReport:
+		if on_progress:
+			on_progress(None, f"Không smart render được ({reason}): render cả timeline")
+		cmd = target.build() + [output_path]
+		return run_ffmpeg_with_progress(cmd, target.expected_total_duration_seconds, on_progress,
+										cancel_event=cancel_event, options=target.describe_options())
+
+	blockers = smart_render_blockers(builder)
+	if blockers:
+		return full_render(builder, ", ".join(blockers))
+	compose = normalized_builder(builder, on_progress=on_progress, cancel_event=cancel_event, smart=True)
+	if compose is builder:
+		return full_render(builder, "không tạo được mezzanine")
+	try:
+		fps = _output_fps(compose)
+		layout = compose.timeline_offsets()
+		clips = compose.timeline()
+		if not fps or not layout or not clips:
+			return full_render(compose, "không đọc được thời lượng clip")
+		tran_frames = int(round(layout[2] * fps))
+		timeline = []
+		key_pts = {}
+		for path, _ in clips:
+			count, keys = video_keyframes(path)
+			timeline.append((path, count, [i for i, _ in keys]))
+			key_pts[path] = dict(keys)
+		pieces = plan_pieces(timeline, tran_frames)
+		if not any(p.kind == "copy" for p in pieces):
+			return full_render(compose, "clip quá ngắn so với GOP")
+		return _render_pieces(builder, compose, pieces, key_pts, fps, tran_frames, output_path, on_progress, cancel_event, full_render)
+	finally:
+		compose.cleanup()
+
+
+def _render_pieces(builder: FFmpegPipelineBuilder, compose: FFmpegPipelineBuilder, pieces: List[Piece], key_pts, fps: float,
+				   tran_frames: int, output_path: str, on_progress, cancel_event: Optional[threading.Event],
+				   full_render: Callable[[FFmpegPipelineBuilder, str], RenderReport]) -> RenderReport:
+	total_frames = sum(p.frames for p in pieces)
+	encode_frames = sum(p.frames for p in pieces if p.kind == "encode")
+	total = total_frames / fps
+	if on_progress:
+		on_progress(None, f"Smart render: encode lại {encode_frames}/{total_frames} frame "
+						  f"({encode_frames / max(1, total_frames) * 100:.1f}%), phần còn lại chép thẳng")
+	out_dir = os.path.dirname(os.path.abspath(output_path))
+	os.makedirs(out_dir, exist_ok=True)
+	work_dir = tempfile.mkdtemp(prefix=".ffsmart_", dir=out_dir)
+	report = new_report(dict(builder.describe_options(), smart_render=True, reencoded_frames=encode_frames))
+	t0 = time.monotonic()
+	parts: List[RenderReport] = []
+	fell_back = False
+	try:
+		paths: List[str] = []
+		done = 0
+		for idx, piece in enumerate(pieces):
+			path = os.path.join(work_dir, f"piece_{idx:04d}.mp4")
+			if piece.kind == "copy":
+				src, a, b = piece.windows[0]
+				# -ss đúng pts của keyframe: ffmpeg bắt đầu chép tại keyframe đó, không kèm frame trước
+				cmd = [_FFMPEG_BIN, "-y", "-ss", f"{key_pts[src][a]:.6f}", "-i", src, "-map", "0:v:0", "-c", "copy",
+					   "-frames:v", str(b - a), path]
+				parts.append(run_ffmpeg_with_progress(cmd, None, None, cancel_event=cancel_event, record_history=False))
+			else:
+				windows = [(f, s / fps, (e - s) / fps) for f, s, e in piece.windows]
+				sub = compose.windowed(windows, tran_frames / fps)
+				sub.faststart = False
+				try:
+					cmd = sub.build() + smart_gop_args(fps) + ["-frames:v", str(piece.frames), path]
+					if not report.command:
+						describe_command(report, cmd[:-1] + [output_path])
+					parts.append(run_ffmpeg_with_progress(cmd, piece.frames / fps, None, cancel_event=cancel_event, record_history=False))
+				finally:
+					sub.cleanup()
+				done += piece.frames
+				if on_progress:
+					pct = done / max(1, encode_frames) * 95.0
+					on_progress(pct, f"Smart render: {pct:.1f}% (khúc {idx + 1}/{len(pieces)})")
+			paths.append(path)
+
+		# Chỉ ghép -c copy được khi mọi khúc cùng SPS/PPS
+		hashes = {_extradata_hash(p) for p in paths}
+		if len(hashes) != 1 or None in hashes:
+			fell_back = True
+			shutil.rmtree(work_dir, ignore_errors=True)
+			return full_render(compose, "khúc encode lại khác tham số encoder của mezzanine")
+
+		audio_path: Optional[str] = None
+		audio_cmd = compose.build_audio_only()
+		if audio_cmd is not None:
+			audio_path = os.path.join(work_dir, "audio.m4a")
+			parts.append(run_ffmpeg_with_progress(audio_cmd + [audio_path], None, None, cancel_event=cancel_event, record_history=False))
+		parts.append(mux_parts(compose, _FFMPEG_BIN, paths, audio_path, total, output_path, work_dir, cancel_event))
+
+		report.attempts = sum(r.attempts for r in parts)
+		cpu = [r for r in parts if r.cpu_user_seconds is not None]
+		if cpu:
+			report.cpu_user_seconds = sum(r.cpu_user_seconds for r in cpu)
+			report.cpu_system_seconds = sum(r.cpu_system_seconds or 0.0 for r in cpu)
+		peaks = [r.peak_rss_mb for r in parts if r.peak_rss_mb is not None]
+		report.peak_rss_mb = max(peaks) if peaks else None
+		report.frames = total_frames
+		report.media_seconds = total
+		report.returncode = 0
+		if on_progress:
+			on_progress(100.0, f"Đã ghép {len(pieces)} khúc (smart render)")
+		return report
+	except RenderCancelled:
+		report.status = "cancelled"
+		if os.path.isfile(output_path):
+			os.remove(output_path)
+		raise
+	except subprocess.CalledProcessError as e:
+		report.status = "failed"
+		report.returncode = e.returncode
+		report.error = "".join((e.stderr or "").strip().splitlines(True)[-5:])
+		raise
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+		if not fell_back:
+			report.wall_seconds = time.monotonic() - t0
+			if report.frames and report.wall_seconds > 0:
+				report.encode_fps = report.frames / report.wall_seconds
+				report.speed = total / report.wall_seconds
+			finalize_output(report)
+			default_history().append(report)